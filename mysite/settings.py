@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 from django.contrib.messages import constants as messages
@@ -119,6 +120,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME'  : os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file instead of the in-memory database, so that tests can write from several threads at once.
+        # The process id keeps test runs at the same time apart:
+        'TEST'  : {'NAME': os.path.join(tempfile.gettempdir(), 'messlog_test_{}.sqlite3'.format(os.getpid()))},
     }
 }
 
@@ -135,6 +139,31 @@ DATABASES = {
 }
 """
 
+# The mol files of the molecule view are cached with the sha256 of the CIF file as key.
+# LocMemCache evicts the least recently used entries when more than MAX_ENTRIES are stored.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Every process has its own LocMemCache. MAX_ENTRIES limits the number of mol files, not their size,
+    # therefore larger mol files than MOLFILE_CACHE_MAX_SIZE are not cached. This bounds the cache to
+    # about 300 * 200 kB = 60 MB per process:
+    'molfiles': {
+        'BACKEND' : 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'molfiles',
+        'TIMEOUT' : None,
+        'OPTIONS' : {
+            'MAX_ENTRIES': 300,
+        },
+    },
+}
+# Mol files with more characters are not cached:
+MOLFILE_CACHE_MAX_SIZE = 200_000
+# Seconds to cache the running measurements of the start page. A save clears only the cache of its own
+# process with the LocMemCache above, so other processes show changes at the latest after this time.
+# With a shared cache backend like memcached, every save clears the cache of all processes.
+RUNNING_MEASUREMENTS_CACHE_TIMEOUT = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
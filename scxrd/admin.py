@@ -4,7 +4,8 @@ from django.contrib import admin
 from django.contrib.admin import StackedInline, TabularInline
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User, Group
-from django.db.models import Count
+from django.db.models import Count, Q
+from django.utils import timezone
 from django.utils.datetime_safe import datetime
 from django.utils.translation import gettext_lazy as _
 from simple_history.admin import SimpleHistoryAdmin
@@ -14,16 +15,23 @@ from scxrd.models.cif_model import CifFileModel
 from scxrd.models.measurement_model import Measurement
 from scxrd.models.models import Machine, WorkGroup, CrystalSupport, CrystalGlue, Profile, CheckCifModel, ReportModel, \
     MachineLogbookModel
-from scxrd.models.sample_model import Sample
+from scxrd.models.counter_model import peek_next_measurement_number
+from scxrd.models.formula_model import FormulaElement
+from scxrd.models.reduced_cell_model import ReducedCell
+from scxrd.models.sample_model import Sample, samples_with_status
 
 admin.site.site_header = "MESSLOG Admin"
 admin.site.site_title = "MESSLOG Admin Portal"
 admin.site.index_title = "MESSLOG Administration"
 
 
+def year_start(years_ago: int = 0) -> datetime:
+    """The beginning of the current year or of the year years_ago before."""
+    return timezone.make_aware(datetime(datetime.now().year - years_ago, 1, 1))
+
+
 class WorkGroupInline(TabularInline):
     model = Profile
-    list_display = ('members',)
     # fields = ('user',)
     extra = 0
 
@@ -33,26 +41,29 @@ class WorkGroupInline(TabularInline):
         }),
     )
 
-    def members(self, obj: WorkGroup):
-        WorkGroup.objects.filter(profiles__user=obj)
-
-    members.short_description = _("group members")
-
 
 class WorkGroupAdmin(admin.ModelAdmin):
     model = WorkGroup
     list_display = ('group_head', 'members', 'measurements_this_year')
     inlines = (WorkGroupInline,)
 
+    def get_queryset(self, request):
+        """The numbers of the list are counted in the query of the list instead of one query per row."""
+        return super().get_queryset(request).annotate(
+            _members=Count('profiles', distinct=True),
+            _measurements_this_year=Count('profiles__user__customer_measurements', distinct=True,
+                                          filter=Q(profiles__user__customer_measurements__measure_date__gt=year_start())),
+        )
+
     def members(self, obj: WorkGroup):
-        return len(User.objects.filter(profile__work_group_id=obj.pk))
+        return obj._members
 
     def measurements_this_year(self, group: WorkGroup):
-        today = datetime.now()
-        return Measurement.objects.filter(measure_date__gt=str(today.year) + '-1-1',
-                                          customer__profile__work_group=group).count()
+        return group._measurements_this_year
 
+    members.admin_order_field = '_members'
     members.short_description = _("group members")
+    measurements_this_year.admin_order_field = '_measurements_this_year'
     measurements_this_year.short_description = _("measurements this year")
 
 
@@ -74,6 +85,7 @@ class MeasurementReportInline(StackedInline):
 class MeasurementAdmin(SimpleHistoryAdmin, admin.ModelAdmin):
     list_display = ('measurement_name', 'machine', 'measure_date', 'operator', 'sum_formula', 'customer')
     list_filter = ['measure_date']
+    list_select_related = ['machine', 'operator', 'customer']
     history_list_display = ["status"]
     search_fields = ['measurement_name', 'number', 'sum_formula']
     ordering = ['-number']
@@ -85,32 +97,36 @@ class MeasurementAdmin(SimpleHistoryAdmin, admin.ModelAdmin):
 
     def get_form(self, request, obj=None, **kwargs):
         form = super(MeasurementAdmin, self).get_form(request, obj, **kwargs)
-        try:
-            form.base_fields['number'].initial = Measurement.objects.first().number + 1
-        except AttributeError:
-            form.base_fields['number'].initial = 1
+        form.base_fields['number'].initial = peek_next_measurement_number()
         return form
 
 
 class SampleAdmin(SimpleHistoryAdmin, admin.ModelAdmin):
     model = Sample
     list_display = ['sample_name', 'submit_date', 'customer_samp', 'solve_refine_selve', 'was_measured']
+    list_select_related = ['customer_samp']
+
+    def get_queryset(self, request):
+        return samples_with_status(super().get_queryset(request))
 
 
 class CifAdmin(SimpleHistoryAdmin, admin.ModelAdmin):
     model = CifFileModel
     list_display = ['edit_file', 'data', 'related_measurement', 'number_of_atoms']
+    list_select_related = ['measurement']
 
     def edit_file(self, obj):
-        return self.model.objects.get(id=obj.id)
+        return obj
 
     def related_measurement(self, obj):
-        return Measurement.objects.get(ciffilemodel=obj.pk)
+        return obj.measurement
 
     def number_of_atoms(self, obj):
+        if not obj.file_exists:
+            return _('no atoms found')
         try:
             # cif = CifFileModel.objects.get(cif_file_on_disk=obj.pk)
-            cif = CifContainer(Path(str(obj.cif_file_on_disk.file)))
+            cif = CifContainer(Path(str(obj.cif_file_on_disk.file)), metadata_only=True)
         except RuntimeError:
             return _('no atoms found')
         # Example:
@@ -122,6 +138,20 @@ class CifAdmin(SimpleHistoryAdmin, admin.ModelAdmin):
     edit_file.short_description = _("edit file")
 
 
+class ReducedCellAdmin(admin.ModelAdmin):
+    model = ReducedCell
+    list_display = ['measurement', 'source', 'a', 'b', 'c', 'alpha', 'beta', 'gamma', 'volume']
+    list_select_related = ['measurement']
+
+
+class FormulaElementAdmin(admin.ModelAdmin):
+    model = FormulaElement
+    list_display = ['measurement', 'sample', 'source', 'element', 'count']
+    list_filter = ['source']
+    list_select_related = ['measurement', 'sample']
+    search_fields = ['element']
+
+
 class ProfileInline(admin.StackedInline):
     model = Profile
     can_delete = False
@@ -137,7 +167,7 @@ class UserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
     list_display = ['username', 'profile', 'work_group', 'number_of_measurements', 'is_superuser', 'is_operator']
     list_filter = ('is_superuser', 'profile__work_group')
-    list_select_related = ('profile',)
+    list_select_related = ('profile__work_group',)
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
         (_('Personal info'), {'fields': ('first_name', 'last_name', 'email')}),
@@ -153,12 +183,16 @@ class UserAdmin(BaseUserAdmin):
     def work_group(self, obj: User):
         return obj.profile.work_group
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_number_of_measurements=Count('operator_measurements'))
+
     def number_of_measurements(self, obj: User):
-        return obj.operator_measurements.count()  # Measurement.objects.filter(operator=obj).count()
+        return obj._number_of_measurements
 
     is_operator.boolean = True
     is_operator.short_description = _("is operator")
     work_group.short_description = _("work group")
+    number_of_measurements.admin_order_field = '_number_of_measurements'
     number_of_measurements.short_description = _("number_of_measurements")
 
     def get_inline_instances(self, request, obj=None):
@@ -181,7 +215,7 @@ class GluesAdmin(admin.ModelAdmin):
 
     def used_by(self, obj):
         """Returns the number of measurement that use this glue"""
-        return obj.measurements.count()
+        return obj._used_by
 
     used_by.admin_order_field = '_used_by'
     used_by.short_description = _("used by")
@@ -191,10 +225,15 @@ class CrystalSupportAdmin(admin.ModelAdmin):
     model = CrystalSupport
     list_display = ['support', 'used_by']
 
+    def get_queryset(self, request):
+        """Method to do the sorting for the admin_order_field"""
+        return super().get_queryset(request).annotate(_used_by=Count('measurements'))
+
     def used_by(self, obj):
-        """Returns the number of measurement that use this glue"""
-        return obj.measurements.count()
+        """Returns the number of measurement that use this support"""
+        return obj._used_by
 
+    used_by.admin_order_field = '_used_by'
     used_by.short_description = _("used by")
 
 
@@ -203,19 +242,27 @@ class MachinesAdmin(admin.ModelAdmin):
     list_display = ['diffrn_measurement_device_type', 'measurements', 'measurements_last_year',
                     'measurements_this_year']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _measurements=Count('measurements'),
+            _measurements_last_year=Count('measurements', filter=Q(measurements__measure_date__gt=year_start(1),
+                                                                   measurements__measure_date__lt=year_start())),
+            _measurements_this_year=Count('measurements', filter=Q(measurements__measure_date__gt=year_start())),
+        )
+
     def measurements(self, machine):
         """Returns the number of measurement that use this machine"""
-        return machine.measurements.count()
+        return machine._measurements
 
     def measurements_last_year(self, machine: Machine):
-        today = datetime.now()
-        return machine.measurements.filter(measure_date__gt=str(today.year - 1) + '-1-1',
-                                           measure_date__lt=str(today.year) + '-1-1').count()
+        return machine._measurements_last_year
 
     def measurements_this_year(self, machine: Machine):
-        today = datetime.now()
-        return machine.measurements.filter(measure_date__gt=str(today.year) + '-1-1').count()
+        return machine._measurements_this_year
 
+    measurements.admin_order_field = '_measurements'
+    measurements_last_year.admin_order_field = '_measurements_last_year'
+    measurements_this_year.admin_order_field = '_measurements_this_year'
     measurements.short_description = _("measurements")
     measurements_last_year.short_description = _("measurements last year")
     measurements_this_year.short_description = _("measurements this year")
@@ -224,6 +271,8 @@ class MachinesAdmin(admin.ModelAdmin):
 admin.site.unregister(Group)
 admin.site.register(Measurement, MeasurementAdmin)
 admin.site.register(CifFileModel, CifAdmin)
+admin.site.register(ReducedCell, ReducedCellAdmin)
+admin.site.register(FormulaElement, FormulaElementAdmin)
 # admin.site.register(CifFileModel)
 admin.site.register(Sample, SampleAdmin)
 # admin.site.register(Profile)
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ScxrdConfig(AppConfig):
     name = 'scxrd'
+
+    def ready(self):
+        from scxrd.models.models import check_unchecked_files
+        from scxrd.search_index import create_search_index
+        post_migrate.connect(check_unchecked_files, sender=self)
+        post_migrate.connect(create_search_index, sender=self)
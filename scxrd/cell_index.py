@@ -0,0 +1,190 @@
+"""
+An in-memory index of all reduced unit cells for the "known cell?" check when a new crystal is mounted.
+The cells are kept in contiguous NumPy arrays sorted by volume. A search first selects the cells of similar
+volume with bisect and then compares their metric tensors vectorized. Every process has its own index,
+it follows the ReducedCell table through the post_save and post_delete signals. Cells written by other
+processes, e.g. by reindex_cifs, are found by comparing the number and the highest id of the cells before
+each search. Cells that were changed in place by other processes are only found after a reload, optionally
+every max_age seconds.
+"""
+from bisect import bisect_left, bisect_right
+from math import cos, radians
+from threading import RLock
+from time import monotonic
+
+from django.db import transaction
+from django.db.models import Max, Count
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from scxrd.models.reduced_cell_model import ReducedCell
+from scxrd.utils import niggli_reduced_cell
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def metric_tensor(a: float, b: float, c: float, alpha: float, beta: float, gamma: float) -> list:
+    """
+    The six independent elements of the metric tensor: a², b², c², 2bc cos(alpha), 2ac cos(beta), 2ab cos(gamma)
+    """
+    return [a * a, b * b, c * c, 2 * b * c * cos(radians(alpha)), 2 * a * c * cos(radians(beta)),
+            2 * a * b * cos(radians(gamma))]
+
+
+class CellIndex():
+    """
+    The reduced cells sorted by their volume. The keys are (measurement_id, source) of the ReducedCell.
+    """
+
+    def __init__(self, max_age: float = None):
+        self._lock = RLock()
+        self._loaded = False
+        # Seconds after which all cells are loaded again, also if the table looks unchanged, None for never:
+        self.max_age = max_age
+        self._loaded_at = 0.0
+        # Number and highest id of the cells at the last load:
+        self._signature = None
+        self._keys = []
+        self._volumes = []
+        self._cells = None
+        self._tensors = None
+        # The volume of each key to find it in the sorted arrays:
+        self._volume_of = {}
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._keys)
+
+    @staticmethod
+    def _table_signature() -> tuple:
+        signature = ReducedCell.objects.aggregate(count=Count('pk'), max_id=Max('pk'))
+        return signature['count'], signature['max_id']
+
+    def _ensure_loaded(self) -> None:
+        """
+        Loads the cells again if the table was changed without the signals of this process.
+        """
+        signature = self._table_signature()
+        with self._lock:
+            expired = self.max_age is not None and monotonic() - self._loaded_at > self.max_age
+            if not self._loaded or signature != self._signature or expired:
+                self.reload()
+
+    def reload(self) -> None:
+        """
+        Loads all cells from the ReducedCell table.
+        """
+        rows = ReducedCell.objects.order_by('volume').values_list('measurement_id', 'source', 'a', 'b', 'c',
+                                                                  'alpha', 'beta', 'gamma', 'volume')
+        with self._lock:
+            signature = self._table_signature()
+            rows = list(rows)
+            self._signature = signature
+            self._loaded_at = monotonic()
+            self._keys = [(x[0], x[1]) for x in rows]
+            self._volumes = [x[8] for x in rows]
+            self._cells = np.array([x[2:8] for x in rows], dtype=float).reshape(-1, 6)
+            self._tensors = np.array([metric_tensor(*x[2:8]) for x in rows], dtype=float).reshape(-1, 6)
+            self._volume_of = dict(zip(self._keys, self._volumes))
+            self._loaded = True
+
+    def _position(self, key: tuple) -> int:
+        volume = self._volume_of[key]
+        pos = bisect_left(self._volumes, volume)
+        while self._keys[pos] != key:
+            pos += 1
+        return pos
+
+    def remove(self, key: tuple, pk: int = None) -> None:
+        """
+        Removes the reduced cell of key. pk is the id of the deleted ReducedCell row.
+        """
+        with self._lock:
+            if not self._loaded or key not in self._volume_of:
+                return
+            if pk is not None and self._signature:
+                count, max_id = self._signature
+                if pk == max_id:
+                    max_id = ReducedCell.objects.aggregate(max_id=Max('pk'))['max_id']
+                self._signature = (count - 1, max_id)
+            pos = self._position(key)
+            del self._keys[pos]
+            del self._volumes[pos]
+            self._cells = np.delete(self._cells, pos, axis=0)
+            self._tensors = np.delete(self._tensors, pos, axis=0)
+            del self._volume_of[key]
+
+    def update(self, key: tuple, cell: (list, tuple), volume: float, pk: int = None) -> None:
+        """
+        Adds or replaces the reduced cell of key. pk is the id of the saved ReducedCell row, with it the
+        signature of the table is kept in step, so that the next search does not load all cells again.
+        """
+        with self._lock:
+            if not self._loaded:
+                # The cell will be there after the first load:
+                return
+            if pk is not None and self._signature and key not in self._volume_of:
+                count, max_id = self._signature
+                self._signature = (count + 1, max(max_id or 0, pk))
+            self.remove(key)
+            pos = bisect_right(self._volumes, volume)
+            self._keys.insert(pos, key)
+            self._volumes.insert(pos, volume)
+            self._cells = np.insert(self._cells, pos, cell, axis=0)
+            self._tensors = np.insert(self._tensors, pos, metric_tensor(*cell), axis=0)
+            self._volume_of[key] = volume
+
+    def search(self, cell: (list, tuple), centring: str = 'P', volume_percent: float = 3.0,
+               max_distance: float = 0.03, limit: int = 20) -> list:
+        """
+        Returns the most similar cells as list of dictionaries, ranked by the distance of their metric tensors
+        relative to the metric tensor of cell.
+        :param cell: a, b, c, alpha, beta, gamma
+        :param centring: The lattice centring of cell
+        :param volume_percent: Only cells with this volume difference are compared
+        :param max_distance: Relative metric tensor distance of the most different result
+        :param limit: Maximum number of results
+        """
+        reduced = niggli_reduced_cell(cell, centring)
+        if not reduced:
+            return []
+        a, b, c, alpha, beta, gamma, volume = reduced
+        query = np.array(metric_tensor(a, b, c, alpha, beta, gamma))
+        self._ensure_loaded()
+        with self._lock:
+            start = bisect_left(self._volumes, volume * (1 - volume_percent / 100.0))
+            end = bisect_right(self._volumes, volume * (1 + volume_percent / 100.0))
+            distances = np.linalg.norm(self._tensors[start:end] - query, axis=1) / np.linalg.norm(query)
+            ranked = np.argsort(distances, kind='stable')[:limit]
+            results = []
+            for num in ranked:
+                if distances[num] > max_distance:
+                    break
+                measurement_id, source = self._keys[start + num]
+                results.append({'measurement_id': measurement_id, 'source': source,
+                                'cell'          : self._cells[start + num].tolist(),
+                                'volume'        : self._volumes[start + num], 'distance': float(distances[num])})
+            return results
+
+
+cell_index = CellIndex()
+
+
+@receiver(post_save, sender=ReducedCell)
+def update_cell_index(sender, instance: ReducedCell, **kwargs):
+    if np is None:
+        return
+    key = (instance.measurement_id, instance.source)
+    cell = (instance.a, instance.b, instance.c, instance.alpha, instance.beta, instance.gamma)
+    pk = instance.pk
+    transaction.on_commit(lambda: cell_index.update(key, cell, instance.volume, pk))
+
+
+@receiver(post_delete, sender=ReducedCell)
+def remove_from_cell_index(sender, instance: ReducedCell, **kwargs):
+    key = (instance.measurement_id, instance.source)
+    pk = instance.pk
+    transaction.on_commit(lambda: cell_index.remove(key, pk))
@@ -5,47 +5,146 @@
 #  and you think this stuff is worth it, you can buy me a beer in return.
 #  Dr. Daniel Kratzert
 #  ----------------------------------------------------------------------------
+from functools import wraps
 from pathlib import Path
 from typing import List, Tuple, Iterator
 
 import gemmi
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def memoized(method):
+    """
+    Caches the result of a CifContainer method without arguments in its _memo dictionary.
+    The cache is cleared when the cif block is changed.
+    """
+
+    @wraps(method)
+    def wrapper(self):
+        try:
+            return self._memo[method.__name__]
+        except KeyError:
+            result = self._memo[method.__name__] = method(self)
+            return result
+
+    return wrapper
+
 
 class CifContainer():
     """
     This class holds the content of a cif file, independent of the file parser used.
+    With metadata_only=True, the large text fields like the hkl and res file are left out while reading
+    a file. They are read from the file only when they are accessed.
     """
+    # Text fields that are often the largest part of a cif file:
+    large_value_keys = ('_shelx_hkl_file', '_shelx_res_file', '_shelx_fab_file')
 
-    def __init__(self, file: Path = None, chunks: Iterator = None):
+    def __init__(self, file: Path = None, chunks: Iterator = None, metadata_only: bool = False):
         self.fileobj = file
+        self.metadata_only = bool(file and metadata_only)
+        # The large values that were left out in metadata only mode:
+        self._deferred = set()
+        self._full_cif = None
+        self._resdata = None
+        # Symmetry and structure derived values, see memoized():
+        self._memo = {}
         # I do this in small steps instead of gemmi.cif.read_file() in order to
         # leave out the check_for_missing_values. This was gemmi reads cif files
         # with missing values.
-        if file:
+        if self.metadata_only:
+            self.doc = self.read_string(''.join(self._lines_without_large_values(self.fileobj)))
+            self.block = self.doc.sole_block()
+            self.chars_ok = True
+        elif file:
             self.doc = self.read_file(str(self.fileobj.absolute()))
             self.block = self.doc.sole_block()
             # will not ok with non-ascii characters in the res file:
             self.chars_ok = True
             try:
-                self.resdata = self.block.find_value('_shelx_res_file')
+                self._resdata = self.block.find_value('_shelx_res_file')
             except UnicodeDecodeError:
                 # This is a fallback in case _shelx_res_file has non-ascii characters.
                 print('File has non-ascii characters. Switching to compatible mode.')
                 self.doc = self.read_string(self.fileobj.read_text(encoding='cp1250', errors='ignore'))
                 self.block = self.doc.sole_block()
-                self.resdata = self.block.find_value('_shelx_res_file')
+                self._resdata = self.block.find_value('_shelx_res_file')
                 self.chars_ok = False
         else:
             self.doc = self.read_string(str(chunks))
             self.block = self.doc.sole_block()
-            self.resdata = self.block.find_value('_shelx_res_file')
+            self._resdata = self.block.find_value('_shelx_res_file')
             self.chars_ok = False
         self.doc.check_for_duplicates()
-        self.atomic_struct = gemmi.make_small_structure_from_block(self.block)
         # A dictionary to convert Atom names like 'C1_2' or 'Ga3' into Element names like 'C' or 'Ga'
         self._name2elements = dict(
             zip(self.block.find_loop('_atom_site_label'), self.block.find_loop('_atom_site_type_symbol')))
 
+    def _lines_without_large_values(self, path: Path) -> Iterator[str]:
+        """
+        Yields the lines of a cif file where the semicolon text fields of the large_value_keys are replaced by '?'.
+        """
+        in_text_field = False
+        skip_text_field = False
+        # The line of a large value key, as long as it is unclear if a text field follows:
+        key_line = ''
+        with open(str(path), 'rb') as f:
+            for line in f:
+                try:
+                    line = line.decode('utf-8')
+                except UnicodeDecodeError:
+                    line = line.decode('cp1250', errors='ignore')
+                if skip_text_field:
+                    if line.startswith(';'):
+                        skip_text_field = False
+                    continue
+                if key_line:
+                    if not line.strip():
+                        continue
+                    if line.startswith(';'):
+                        key = key_line.strip()
+                        self._deferred.add(key.lower())
+                        yield '{} ?\n'.format(key)
+                        skip_text_field = True
+                        key_line = ''
+                        continue
+                    yield key_line
+                    key_line = ''
+                if line.startswith(';'):
+                    in_text_field = not in_text_field
+                elif not in_text_field and line.strip().lower() in self.large_value_keys:
+                    key_line = line
+                    continue
+                yield line
+        if key_line:
+            yield key_line
+
+    def _large_value(self, key: str) -> str:
+        """
+        Returns the raw value of key. Values left out in metadata only mode are read from the complete file.
+        """
+        if key.lower() not in self._deferred:
+            return self.block.find_value(key)
+        if self._full_cif is None:
+            self._full_cif = CifContainer(self.fileobj)
+            self.chars_ok = self._full_cif.chars_ok
+        return self._full_cif.block.find_value(key)
+
+    @property
+    def resdata(self) -> str:
+        if self._resdata is None:
+            self._resdata = self._large_value('_shelx_res_file')
+        return self._resdata
+
+    @property
+    @memoized
+    def atomic_struct(self) -> gemmi.SmallStructure:
+        # The structure is only built when it is needed:
+        return gemmi.make_small_structure_from_block(self.block)
+
     def read_file(self, path: str) -> gemmi.cif.Document:
         """
         Reads a cif file and returns a gemmi document object.
@@ -68,7 +167,7 @@ class CifContainer():
         return doc
 
     def __getitem__(self, item: str) -> str:
-        result = self.block.find_value(item)
+        result = self._large_value(item)
         if result:
             if result == '?' or result == "'?'":
                 return ''
@@ -80,12 +179,15 @@ class CifContainer():
 
     def __delitem__(self, key):
         self.block.find_pair_item(key).erase()
+        self._memo.clear()
 
     def save(self, filename: str = None) -> None:
         """
         Saves the current cif file in the specific order of the order list.
         :param filename:  Name to save cif file to.
         """
+        if self._deferred:
+            raise ValueError('The large values of a cif file in metadata only mode can not be saved.')
         if not filename:
             filename = str(self.fileobj.absolute())
         self.doc.write_file(filename, gemmi.cif.Style.Indent35)
@@ -101,9 +203,11 @@ class CifContainer():
         return loops
 
     @property
+    @memoized
     def Z_value(self):
         return self.atomic_struct.cell.volume / self.atomic_struct.cell.volume_per_image()
 
+    @memoized
     def _spgr(self) -> gemmi.SpaceGroup:
         if self.symmops:
             symm_ops = self.symmops
@@ -112,6 +216,7 @@ class CifContainer():
         return gemmi.find_spacegroup_by_ops(gemmi.GroupOps([gemmi.Op(o) for o in symm_ops]))
 
     @property
+    @memoized
     def space_group(self) -> str:
         """
         Returns the space group from the symmetry operators.
@@ -126,6 +231,7 @@ class CifContainer():
                 return ''
 
     @property
+    @memoized
     def symmops_from_spgr(self) -> List[str]:
         # _symmetry_space_group_name_Hall
         space_group = None
@@ -140,20 +246,24 @@ class CifContainer():
         return ops
 
     @property
+    @memoized
     def spgr_number_from_symmops(self) -> int:
         return self._spgr().number
 
     @property
+    @memoized
     def crystal_system(self) -> str:
         if not self._spgr():
             return ''
         return self._spgr().crystal_system_str()
 
     @property
+    @memoized
     def hall_symbol(self) -> str:
         return self._spgr().hall
 
     @property
+    @memoized
     def hkl_checksum_calcd(self) -> int:
         """
         Calculates the shelx checksum for the hkl file content of a cif file.
@@ -165,13 +275,14 @@ class CifContainer():
         #>>> c.hkl_checksum_calcd
         #0
         """
-        hkl = self.block.find_value('_shelx_hkl_file')
+        hkl = self._large_value('_shelx_hkl_file')
         if hkl:
             return self.calc_checksum(hkl[1:-1])
         else:
             return 0
 
     @property
+    @memoized
     def res_checksum_calcd(self) -> int:
         """
         Calculates the shelx checksum for the res file content of a cif file.
@@ -183,7 +294,7 @@ class CifContainer():
         #>>> c.res_checksum_calcd
         #0
         """
-        res = self.block.find_value('_shelx_res_file')
+        res = self.resdata
         if res:
             return self.calc_checksum(res[1:-1])
         return 0
@@ -215,6 +326,7 @@ class CifContainer():
         """
         newname = ''.join([i for i in newname if i.isascii()])
         self.block.name = newname
+        self._memo.clear()
         for item in self.block:
             if item.pair is not None:
                 key, value = item.pair
@@ -224,6 +336,7 @@ class CifContainer():
                     self.block.set_pair(newkey, value)
 
     @property
+    @memoized
     def symmops(self) -> List[str]:
         """
         Reads the symmops from the cif file.
@@ -242,6 +355,7 @@ class CifContainer():
             return []
 
     @property
+    @memoized
     def is_centrosymm(self) -> bool:
         """
         >>> from scxrd.cif.cif_file_io import CifContainer
@@ -300,8 +414,15 @@ class CifContainer():
             return False
 
     @property
+    @memoized
     def cell(self) -> tuple:
-        c = self.atomic_struct.cell
+        values = [self.block.find_value(key) for key in ('_cell_length_a', '_cell_length_b', '_cell_length_c',
+                                                         '_cell_angle_alpha', '_cell_angle_beta', '_cell_angle_gamma')]
+        if 'atomic_struct' not in self._memo and all(values):
+            # No need to build the structure only for the cell:
+            c = gemmi.UnitCell(*[gemmi.cif.as_number(x) for x in values])
+        else:
+            c = self.atomic_struct.cell
         return c.a, c.b, c.c, c.alpha, c.beta, c.gamma, c.volume
 
     def ishydrogen(self, label: str) -> bool:
@@ -357,25 +478,125 @@ class CifContainer():
         return self._name2elements[name]
 
     def natoms(self, without_h: bool = False) -> int:
-        return len(list(self.atoms(without_h)))
+        return self._count_rows(('_atom_site_label',), without_h)
 
     def nbonds(self, without_h: bool = False) -> int:
         """
         Number of bonds in the cif object, with and without hydrogen atoms.
         """
-        return len(list(self.bonds(without_h)))
+        return self._count_rows(('_geom_bond_atom_site_label_1', '_geom_bond_atom_site_label_2'), without_h)
 
     def nangles(self, without_h: bool = False) -> int:
         """
         Number of bond angles in the cif object, with and without hydrogen atoms.
         """
-        return len(list(self.angles(without_h)))
+        return self._count_rows(('_geom_angle_atom_site_label_1', '_geom_angle_atom_site_label_2',
+                                 '_geom_angle_atom_site_label_3'), without_h)
 
     def ntorsion_angles(self, without_h: bool = False) -> int:
         """
         Number of torsion angles in the cif object, with and without hydrogen atoms.
         """
-        return len(list(self.torsion_angles(without_h)))
+        return self._count_rows(('_geom_torsion_atom_site_label_1', '_geom_torsion_atom_site_label_2',
+                                 '_geom_torsion_atom_site_label_3', '_geom_torsion_atom_site_label_4'), without_h)
+
+    def _count_rows(self, label_keys: tuple, without_h: bool) -> int:
+        """
+        Counts the rows of the loop with the atom labels in label_keys. Rows with a hydrogen atom
+        are left out with without_h=True.
+        """
+        columns = [self.block.find_loop(key) for key in label_keys]
+        if not without_h:
+            return len(columns[0])
+        if np is None:
+            return sum(1 for labels in zip(*columns) if not any(self.ishydrogen(x) for x in labels))
+        return int(np.count_nonzero(~self._hydrogen_mask([np.array(list(x), dtype=str) for x in columns])))
+
+    @property
+    @memoized
+    def _hydrogen_labels(self):
+        return np.array([label for label, element in self._name2elements.items() if element in ('H', 'D')],
+                        dtype=str)
+
+    def _hydrogen_mask(self, label_columns: list):
+        """
+        A boolean array that is True for every row where one of the labels is a hydrogen atom.
+        """
+        mask = np.zeros(len(label_columns[0]), dtype=bool)
+        for labels in label_columns:
+            mask |= np.isin(labels, self._hydrogen_labels)
+        return mask
+
+    def _loop_table(self, columns: dict, numbers: tuple = (), integers: tuple = (),
+                    labels: tuple = (), without_h: bool = False) -> dict:
+        """
+        Returns the columns of a loop as dictionary of NumPy arrays. Numbers are floats without their s.u.,
+        and missing or unknown numbers are nan. The 'hydrogen' array is True for every row with a hydrogen atom.
+        :param columns: The names of the table columns and their cif keys. The first column defines the length.
+        :param numbers: Names of float columns
+        :param integers: Names of integer columns
+        :param labels: Names of the atom label columns for the hydrogen mask
+        :param without_h: Leave out the rows with hydrogen atoms
+        """
+        length = None
+        table = {}
+        for name, key in columns.items():
+            column = self.block.find_loop(key)
+            if length is None:
+                length = len(column)
+            if len(column) != length:
+                # The column is not in the loop:
+                column = ['?'] * length
+            if name in numbers:
+                table[name] = np.array([gemmi.cif.as_number(x) for x in column], dtype=float)
+            elif name in integers:
+                table[name] = np.array([gemmi.cif.as_int(x, 0) for x in column], dtype=int)
+            else:
+                table[name] = np.array(list(column), dtype=str)
+        table['hydrogen'] = self._hydrogen_mask([table[x] for x in labels])
+        if without_h:
+            return {name: values[~table['hydrogen']] for name, values in table.items()}
+        return table
+
+    def atoms_table(self, without_h: bool = False) -> dict:
+        """
+        The atoms of the cif file as NumPy arrays with the same names as in atoms().
+        """
+        return self._loop_table({'label': '_atom_site_label', 'type': '_atom_site_type_symbol',
+                                 'x'    : '_atom_site_fract_x', 'y': '_atom_site_fract_y', 'z': '_atom_site_fract_z',
+                                 'part' : '_atom_site_disorder_group', 'occ': '_atom_site_occupancy',
+                                 'ueq'  : '_atom_site_U_iso_or_equiv'},
+                                numbers=('x', 'y', 'z', 'occ', 'ueq'), integers=('part',), labels=('label',),
+                                without_h=without_h)
+
+    def bonds_table(self, without_h: bool = False) -> dict:
+        return self._loop_table({'label1': '_geom_bond_atom_site_label_1', 'label2': '_geom_bond_atom_site_label_2',
+                                 'dist'  : '_geom_bond_distance', 'symm': '_geom_bond_site_symmetry_2'},
+                                numbers=('dist',), labels=('label1', 'label2'), without_h=without_h)
+
+    def angles_table(self, without_h: bool = False) -> dict:
+        return self._loop_table({'label1': '_geom_angle_atom_site_label_1', 'label2': '_geom_angle_atom_site_label_2',
+                                 'label3': '_geom_angle_atom_site_label_3', 'angle': '_geom_angle',
+                                 'symm1' : '_geom_angle_site_symmetry_1', 'symm2': '_geom_angle_site_symmetry_3'},
+                                numbers=('angle',), labels=('label1', 'label2', 'label3'), without_h=without_h)
+
+    def torsion_angles_table(self, without_h: bool = False) -> dict:
+        return self._loop_table({'label1': '_geom_torsion_atom_site_label_1',
+                                 'label2': '_geom_torsion_atom_site_label_2',
+                                 'label3': '_geom_torsion_atom_site_label_3',
+                                 'label4': '_geom_torsion_atom_site_label_4',
+                                 'torsang': '_geom_torsion',
+                                 'symm1': '_geom_torsion_site_symmetry_1', 'symm2': '_geom_torsion_site_symmetry_2',
+                                 'symm3': '_geom_torsion_site_symmetry_3', 'symm4': '_geom_torsion_site_symmetry_4'},
+                                numbers=('torsang',), labels=('label1', 'label2', 'label3', 'label4'),
+                                without_h=without_h)
+
+    def hydrogen_bonds_table(self) -> dict:
+        return self._loop_table({'label_d'  : '_geom_hbond_atom_site_label_D', 'label_h': '_geom_hbond_atom_site_label_H',
+                                 'label_a'  : '_geom_hbond_atom_site_label_A', 'dist_dh': '_geom_hbond_distance_DH',
+                                 'dist_ha'  : '_geom_hbond_distance_HA', 'dist_da': '_geom_hbond_distance_DA',
+                                 'angle_dha': '_geom_hbond_angle_DHA', 'symm': '_geom_hbond_site_symmetry_A'},
+                                numbers=('dist_dh', 'dist_ha', 'dist_da', 'angle_dha'), labels=('label_h',))
 
     def torsion_angles(self, without_h: bool = False):
         label1 = self.block.find_loop('_geom_torsion_atom_site_label_1')
@@ -463,6 +684,7 @@ class CifContainer():
         Add an additional key value pair to the cif block.
         """
         self.block.set_pair(key, value)
+        self._memo.clear()
 
     def test_checksums(self) -> str:
         """
@@ -3,7 +3,11 @@ MOl V3000 format
 """
 
 import os
+from itertools import product
+from math import floor
 
+from scxrd.cif.cif_file_io import CifContainer
+from scxrd.cif.sdm import SDM
 from scxrd.cif.tools.atoms import get_radius_from_element
 from scxrd.cif.tools.dsrmath import distance
 
@@ -61,37 +65,46 @@ class MolFile(object):
         returns a connectivity table from the atomic coordinates and the covalence
         radii of the atoms.
         a bond is defined with less than the sum of the covalence radii plus the extra_param:
+        The atoms are sorted into a grid of cubes with the longest possible bond as edge length, so that
+        only atoms in neighbouring cubes have to be compared. Every pair of atoms is visited only once.
         :param extra_param: additional distance to the covalence radius
         :type extra_param: float
         """
-        # t1 = perf_counter()
-        conlist = []
         h = ('H', 'D')
-        for num1, at1 in enumerate(self.atoms, 1):
-            at1_part = at1[5]
-            rad1 = get_radius_from_element(at1[1])
-            for num2, at2 in enumerate(self.atoms, 1):
-                at2_part = at2[5]
-                if at1_part * at2_part != 0 and at1_part != at2_part:
-                    continue
-                if at1[0] == at2[0]:  # name1 = name2
-                    continue
-                d = distance(at1[2], at1[3], at1[4], at2[2], at2[3], at2[4])
-                if d > 4.0:  # makes bonding faster (longer bonds do not exist)
-                    continue
-                rad2 = get_radius_from_element(at2[1])
-                if (rad1 + rad2) + extra_param > d:
-                    if at1[1] in h and at2[1] in h:
+        radii = [get_radius_from_element(at[1]) for at in self.atoms]
+        if not radii:
+            return []
+        # Longer bonds than 4 A do not exist:
+        edge = min(4.0, 2 * max(radii) + extra_param)
+        grid = {}
+        for num, at in enumerate(self.atoms):
+            grid.setdefault((floor(at[2] / edge), floor(at[3] / edge), floor(at[4] / edge)), []).append(num)
+        bonds = set()
+        for (x, y, z), cube in grid.items():
+            neighbours = []
+            for dx, dy, dz in product((-1, 0, 1), repeat=3):
+                neighbours.extend(grid.get((x + dx, y + dy, z + dz), ()))
+            for num1 in cube:
+                at1 = self.atoms[num1]
+                at1_part = at1[5]
+                rad1 = radii[num1]
+                for num2 in neighbours:
+                    if num2 <= num1:
                         continue
-                    # print(num1, num2, d)
-                    # The extra time for this is not too much:
-                    if [num2, num1] in conlist:
+                    at2 = self.atoms[num2]
+                    at2_part = at2[5]
+                    if at1_part * at2_part != 0 and at1_part != at2_part:
                         continue
-                    conlist.append([num1, num2])
-        # t2 = perf_counter()
-        # print('Bondzeit:', round(t2-t1, 3), 's')
-        # print('len:', len(conlist))
-        return conlist
+                    if at1[0] == at2[0]:  # name1 = name2
+                        continue
+                    d = distance(at1[2], at1[3], at1[4], at2[2], at2[3], at2[4])
+                    if d > 4.0:
+                        continue
+                    if (rad1 + radii[num2]) + extra_param > d:
+                        if at1[1] in h and at2[1] in h:
+                            continue
+                        bonds.add((num1 + 1, num2 + 1))
+        return [[num1, num2] for num1, num2 in sorted(bonds)]
 
     def footer(self) -> str:
         """
@@ -109,3 +122,32 @@ class MolFile(object):
         footer = self.footer()
         mol = "{0}{5}{1}{5}{2}{5}{3}{5}{4}".format(header, connection_table, atoms, bonds, footer, '\n')
         return mol
+
+
+def make_molfile(cif: CifContainer, grow: bool = False) -> str:
+    """
+    Returns a mol file with the molecule from the CIF file.
+    :param cif: The CIF object
+    :param grow: wheather to grow the molecule with its symmetry equivalents or not
+    :return: molfile string
+    """
+    molfile = ' '
+    bonds = None
+    if grow:
+        sdm = SDM(list(cif.atoms_fract), cif.symmops, cif.cell[:6], centric=cif.is_centrosymm)
+        try:
+            needsymm = sdm.calc_sdm()
+            atoms = sdm.packer(sdm, needsymm)
+            # The sdm already knows the bonds:
+            bonds = sdm.bondlist
+        except Exception as e:
+            print('Error in SDM:', e)
+            return molfile
+    else:
+        atoms = cif.atoms_orth
+    try:
+        molfile = MolFile(atoms, bonds=bonds)
+        molfile = molfile.make_mol()
+    except (TypeError, KeyError):
+        print("Error while writing mol file.")
+    return molfile
@@ -12,7 +12,13 @@
 
 
 import time
-from math import sqrt, cos, radians
+from itertools import product
+from math import sqrt, cos, radians, sin, floor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from scxrd.cif.tools.atoms import get_radius_from_element
 from scxrd.cif.tools.dsrmath import SymmetryElement, Array, frac_to_cart
@@ -76,6 +82,42 @@ class SymmCards():
             self._symmcards.append(newSymm)
 
 
+class AtomHash():
+    """
+    A spatial hash of atoms in fractional coordinates. The grid cells are as wide as the search distance,
+    so only atoms in the neighbouring cells of the same disorder part can be nearer than this distance.
+    """
+
+    def __init__(self, sdm: 'SDM', distance: float):
+        self.sdm = sdm
+        self.distance = distance
+        self.widths = [distance * x for x in sdm.reciprocal_lengths]
+        self._cells = {}
+
+    def _cell(self, atom: list) -> tuple:
+        return tuple(floor(atom[n + 2] / self.widths[n]) for n in range(3))
+
+    def add(self, atom: list) -> None:
+        x, y, z = self._cell(atom)
+        self._cells.setdefault((atom[5], x, y, z), []).append(atom)
+
+    def is_there(self, atom: list) -> bool:
+        """
+        Is there already an atom of the same part nearer than the search distance?
+        """
+        x, y, z = self._cell(atom)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for other in self._cells.get((atom[5], x + dx, y + dy, z + dz), ()):
+                        length = self.sdm.vector_length(atom[2] - other[2],
+                                                        atom[3] - other[3],
+                                                        atom[4] - other[4])
+                        if length < self.distance:
+                            return True
+        return False
+
+
 class SDMItem(object):
     __slots__ = ['dist', 'atom1', 'atom2', 'a1', 'a2', 'symmetry_number', 'covalent', 'dddd']
 
@@ -104,14 +146,25 @@ class SDMItem(object):
 
 
 class SDM():
-    def __init__(self, atoms: list, symmlist: list, cell: list, centric=False):
+    # Possible engines for the shortest distance matrix:
+    backends = ('auto', 'python', 'numpy', 'grid')
+    # 'auto' uses the grid neighbour search above this number of atoms:
+    grid_min_atoms = 100
+    # Longer distances are never in the sdm_list:
+    max_distance = 4.0
+
+    def __init__(self, atoms: list, symmlist: list, cell: list, centric=False, backend: str = 'auto'):
         """
         Calculates the shortest distance matrix
                         0      1      2  3  4   5     6          7
         :param atoms: [Name, Element, X, Y, Z, Part, ocuupancy, molindex -> (later)]
         :param symmlist:
         :param cell:
+        :param backend: The engine for the distance matrix, one of SDM.backends. All engines give the same result.
         """
+        if backend not in self.backends:
+            raise ValueError('Unknown SDM backend "{}". Use one of {}.'.format(backend, ', '.join(self.backends)))
+        self.backend = backend
         self.atoms = atoms
         self.symmcards = SymmCards()
         if centric:
@@ -130,11 +183,45 @@ class SDM():
         self.bsq = self.cell[1] ** 2
         self.csq = self.cell[2] ** 2
         self.sdm_list = []  # list of sdmitems
+        self.bondlist = []  # bonds of the packed atoms, see packer()
         self.maxmol = 1
         self.sdmtime = 0
 
     def calc_sdm(self) -> list:
         t1 = time.perf_counter()
+        backend = self.used_backend
+        if backend == 'grid':
+            self._calc_sdm_grid()
+        elif backend == 'numpy':
+            self._calc_sdm_numpy()
+        else:
+            self._calc_sdm_python()
+        t2 = time.perf_counter()
+        self.sdmtime = t2 - t1
+        # if DEBUG:
+        print('Time for sdm:', round(self.sdmtime, 3), 's')
+        self.sdm_list.sort()
+        self.calc_molindex(list(self.atoms))
+        need_symm = self.collect_needed_symmetry()
+        if DEBUG:
+            print("The asymmetric unit contains {} fragments.".format(self.maxmol))
+        return need_symm
+
+    @property
+    def used_backend(self) -> str:
+        """
+        The SDM engine that is actually used. Without NumPy, this is always the Python engine.
+        """
+        if np is None:
+            return 'python'
+        if self.backend == 'auto':
+            return 'grid' if len(self.atoms) > self.grid_min_atoms else 'numpy'
+        return self.backend
+
+    def _calc_sdm_python(self) -> None:
+        """
+        The original pure Python shortest distance matrix. It is used when NumPy is not available.
+        """
         h = ('H', 'D')
         nlen = len(self.symmcards)
         at2_plushalf = [Array([j + 0.5 for j in x[2:5]]) for x in self.atoms]
@@ -179,19 +266,128 @@ class SDM():
                     sdmItem.covalent = False
                 if hma:
                     self.sdm_list.append(sdmItem)
-        t2 = time.perf_counter()
-        self.sdmtime = t2 - t1
-        # if DEBUG:
-        print('Time for sdm:', round(self.sdmtime, 3), 's')
-        self.sdm_list.sort()
-        self.calc_molindex(list(self.atoms))
-        need_symm = self.collect_needed_symmetry()
-        if DEBUG:
-            print("The asymmetric unit contains {} fragments.".format(self.maxmol))
-        return need_symm
+
+    def _calc_sdm_numpy(self, max_block_size: int = 2 ** 21) -> None:
+        """
+        Calculates the same shortest distance matrix as _calc_sdm_python(), but for a block of atoms all
+        symmetry equivalent fractional differences are calculated at once as (rows x N x nsym x 3) array.
+        The arithmetic is done in the same order as in the Python version in order to get exactly the
+        same distances.
+        :param max_block_size: maximum number of elements of the difference array per block
+        """
+        natoms = len(self.atoms)
+        if not natoms:
+            return
+        coords = np.array([at[2:5] for at in self.atoms], dtype=float)
+        matrices = np.array([symop.matrix.values for symop in self.symmcards], dtype=float)
+        trans = np.array([list(symop.trans) for symop in self.symmcards], dtype=float)
+        nsym = len(matrices)
+        # Array() * Matrix() + trans for every atom and every symmetry card -> (N, nsym, 3)
+        prime = coords[:, None, 0, None] * matrices[None, :, 0, :] \
+                + coords[:, None, 1, None] * matrices[None, :, 1, :] \
+                + coords[:, None, 2, None] * matrices[None, :, 2, :] + trans[None, :, :]
+        at2_plushalf = coords + 0.5
+        rows_per_block = max(1, max_block_size // (natoms * nsym * 3))
+        for start in range(0, natoms, rows_per_block):
+            stop = min(start + rows_per_block, natoms)
+            D = prime[start:stop, None, :, :] - at2_plushalf[None, :, None, :]
+            dp = D - np.floor(D) - 0.5
+            dk = self.vector_lengths(dp)
+            dk[:, :, 1:] += 0.0001
+            dk[(dk > 4.0) | (dk <= 0.01)] = np.inf
+            # The Python version takes the last of several equal distances, so search backwards:
+            symm_numbers = nsym - 1 - np.argmin(dk[:, :, ::-1], axis=2)
+            mind = np.take_along_axis(dk, symm_numbers[:, :, None], axis=2)[:, :, 0]
+            for i, j in zip(*np.nonzero(np.isfinite(mind))):
+                self._append_sdm_item(start + int(i), int(j), float(mind[i, j]), int(symm_numbers[i, j]))
+
+    def _calc_sdm_grid(self) -> None:
+        """
+        Calculates the same shortest distance matrix as _calc_sdm_numpy(), but only for atom pairs that are
+        near to each other. The atoms are sorted into a periodic grid of the unit cell where each grid cell
+        is at least max_distance wide. Only atoms in neighbouring grid cells of a symmetry equivalent atom
+        are candidates for a distance. This makes the calculation almost linear with the number of atoms.
+        """
+        natoms = len(self.atoms)
+        if not natoms:
+            return
+        coords = np.array([at[2:5] for at in self.atoms], dtype=float)
+        matrices = np.array([symop.matrix.values for symop in self.symmcards], dtype=float)
+        trans = np.array([list(symop.trans) for symop in self.symmcards], dtype=float)
+        nsym = len(matrices)
+        prime = coords[:, None, 0, None] * matrices[None, :, 0, :] \
+                + coords[:, None, 1, None] * matrices[None, :, 1, :] \
+                + coords[:, None, 2, None] * matrices[None, :, 2, :] + trans[None, :, :]
+        prime = prime.reshape(natoms * nsym, 3)
+        at2_plushalf = coords + 0.5
+        # A distance of max_distance is at most this long in fractional units along each axis:
+        reach = np.array(self.reciprocal_lengths) * (self.max_distance + 0.001)
+        ncells = np.maximum(1, np.floor(1.0 / reach)).astype(int)
+        atom_cells = self._grid_cells(coords, ncells)
+        atoms_by_cell = np.argsort(atom_cells, kind='stable')
+        cell_counts = np.bincount(atom_cells, minlength=ncells.prod())
+        cell_starts = np.cumsum(cell_counts) - cell_counts
+        query_cells = np.stack(np.unravel_index(self._grid_cells(prime, ncells), ncells), axis=1)
+        offsets = product(*[sorted({-1 % n, 0, 1 % n}) for n in ncells])
+        found = []
+        for offset in offsets:
+            neighbour_cells = np.ravel_multi_index(((query_cells + offset) % ncells).T, ncells)
+            counts = cell_counts[neighbour_cells]
+            queries = np.repeat(np.arange(len(prime)), counts)
+            if not len(queries):
+                continue
+            position = np.arange(len(queries)) - np.repeat(np.cumsum(counts) - counts, counts)
+            candidates = atoms_by_cell[np.repeat(cell_starts[neighbour_cells], counts) + position]
+            D = prime[queries] - at2_plushalf[candidates]
+            dp = D - np.floor(D) - 0.5
+            dk = self.vector_lengths(dp)
+            symm_numbers = queries % nsym
+            dk[symm_numbers > 0] += 0.0001
+            valid = (dk <= 4.0) & (dk > 0.01)
+            found.append((queries[valid] // nsym, candidates[valid], symm_numbers[valid], dk[valid]))
+        if not found:
+            return
+        atoms1, atoms2, symm_numbers, dk = [np.concatenate(x) for x in zip(*found)]
+        # The shortest distance of each pair first, the last symmetry card of equal distances wins:
+        order = np.lexsort((-symm_numbers, dk, atoms2, atoms1))
+        atoms1, atoms2, symm_numbers, dk = atoms1[order], atoms2[order], symm_numbers[order], dk[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (atoms1[1:] != atoms1[:-1]) | (atoms2[1:] != atoms2[:-1])
+        for i, j, n, dist in zip(atoms1[first].tolist(), atoms2[first].tolist(), symm_numbers[first].tolist(),
+                                 dk[first].tolist()):
+            self._append_sdm_item(i, j, dist, n)
+
+    @staticmethod
+    def _grid_cells(coords: 'np.ndarray', ncells: 'np.ndarray') -> 'np.ndarray':
+        """
+        Returns the flat index of the periodic grid cell for each fractional coordinate.
+        """
+        cells = np.floor((coords - np.floor(coords)) * ncells).astype(int) % ncells
+        return np.ravel_multi_index(cells.T, ncells)
+
+    def _append_sdm_item(self, i: int, j: int, dist: float, symmetry_number: int) -> None:
+        """
+        Adds an SDMItem of the atoms i and j with their shortest distance to the sdm_list.
+        """
+        h = ('H', 'D')
+        at1 = self.atoms[i]
+        at2 = self.atoms[j]
+        sdmItem = SDMItem()
+        sdmItem.dist = dist
+        sdmItem.atom1 = at1
+        sdmItem.atom2 = at2
+        sdmItem.a1 = i
+        sdmItem.a2 = j
+        sdmItem.symmetry_number = symmetry_number
+        if (not at1[1] in h and not at2[1] in h) and at1[5] * at2[5] == 0 or at1[5] == at2[5]:
+            sdmItem.dddd = (get_radius_from_element(at1[1]) + get_radius_from_element(at2[1])) * 1.2
+        sdmItem.covalent = sdmItem.dist < sdmItem.dddd
+        self.sdm_list.append(sdmItem)
 
     def collect_needed_symmetry(self) -> list:
         need_symm = []
+        # The same as need_symm, but as set for fast lookup:
+        found_symm = set()
         h = ('H', 'D')
         # Collect needsymm list:
         for sdmItem in self.sdm_list:
@@ -220,34 +416,39 @@ class SDM():
                         dddd = 1.8
                     if (dk > 0.001) and (dddd >= dk):
                         bs = [n + 1, (5 - floorD[0]), (5 - floorD[1]), (5 - floorD[2]), sdmItem.atom1[-1]]
-                        if bs not in need_symm:
+                        if tuple(bs) not in found_symm:
+                            found_symm.add(tuple(bs))
                             need_symm.append(bs)
         return need_symm
 
     def calc_molindex(self, all_atoms):
-        # Start for George's "bring atoms together algorithm":
-        someleft = 1
-        nextmol = 1
-        for at in all_atoms:
-            at.append(-1)
-        all_atoms[0][-1] = 1
-        while nextmol:
-            someleft = 1
-            nextmol = 0
-            while someleft:
-                someleft = 0
-                for sdmItem in self.sdm_list:
-                    if sdmItem.covalent and sdmItem.atom1[-1] * sdmItem.atom2[-1] < 0:
-                        sdmItem.atom1[-1] = self.maxmol  # last item is the molindex
-                        sdmItem.atom2[-1] = self.maxmol
-                        someleft += 1
-            for ni, at in enumerate(all_atoms):
-                if at[-1] < 0:
-                    nextmol = ni
-                    break
-            if nextmol:
-                self.maxmol += 1
-                all_atoms[nextmol][-1] = self.maxmol
+        """
+        Appends the molindex to each atom. Atoms connected by covalent bonds are in the same fragment.
+        The fragments are numbered in the order of their first atom, like in George's "bring atoms
+        together algorithm", but the fragments are found in a single pass with a disjoint-set (union-find).
+        """
+        parent = list(range(len(all_atoms)))
+
+        def find(num: int) -> int:
+            while parent[num] != num:
+                parent[num] = parent[parent[num]]
+                num = parent[num]
+            return num
+
+        for sdmItem in self.sdm_list:
+            if sdmItem.covalent:
+                root1 = find(sdmItem.a1)
+                root2 = find(sdmItem.a2)
+                if root1 != root2:
+                    parent[max(root1, root2)] = min(root1, root2)
+        molindex = {}
+        for num, at in enumerate(all_atoms):
+            root = find(num)
+            if root not in molindex:
+                molindex[root] = len(molindex) + 1
+            # last item is the molindex
+            at.append(molindex[root])
+        self.maxmol = max(1, len(molindex))
 
     def vector_length(self, x: float, y: float, z: float) -> float:
         """
@@ -256,45 +457,106 @@ class SDM():
         A = 2.0 * (x * y * self.aga + x * z * self.bbe + y * z * self.cal)
         return sqrt(x ** 2 * self.asq + y ** 2 * self.bsq + z ** 2 * self.csq + A)
 
+    @property
+    def reciprocal_lengths(self) -> tuple:
+        """
+        The lengths of the reciprocal cell vectors a*, b* and c*.
+        """
+        a, b, c = self.cell[:3]
+        sinal, sinbe, singa = [sin(radians(x)) for x in self.cell[3:6]]
+        volume = a * b * c * sqrt(1 - self.cosal ** 2 - self.cosbe ** 2 - self.cosga ** 2
+                                  + 2 * self.cosal * self.cosbe * self.cosga)
+        return b * c * sinal / volume, a * c * sinbe / volume, a * b * singa / volume
+
+    def vector_lengths(self, vectors: 'np.ndarray') -> 'np.ndarray':
+        """
+        Same as vector_length(), but for an array of fractional vectors with the xyz values in the last axis.
+        The lengths are calculated with the metric tensor elements in the same order as in vector_length().
+        float_power() is used, because it rounds exactly like x ** 2 in Python.
+        """
+        x = vectors[..., 0]
+        y = vectors[..., 1]
+        z = vectors[..., 2]
+        A = 2.0 * (x * y * self.aga + x * z * self.bbe + y * z * self.cal)
+        return np.sqrt(np.float_power(x, 2) * self.asq + np.float_power(y, 2) * self.bsq
+                       + np.float_power(z, 2) * self.csq + A)
+
     def packer(self, sdm: 'SDM', need_symm: list, with_qpeaks=False):
         """
         Packs atoms of the asymmetric unit to real molecules.
         """
         showatoms = self.atoms[:]
-        new_atoms = []
+        # The index of the asymmetric unit atom of each packed atom:
+        sources = list(range(len(showatoms)))
+        atomhash = AtomHash(sdm, 0.2)
+        for atom in showatoms:
+            atomhash.add(atom)
         for symm in need_symm:
             s, h, k, l, symmgroup = symm
             h -= 5
             k -= 5
             l -= 5
             s -= 1
-            for atom in self.atoms:
+            for num, atom in enumerate(self.atoms):
                 if atom[-1] == symmgroup:
                     coords = Array(atom[2:5]) * self.symmcards[s].matrix \
                              + Array(self.symmcards[s].trans) + Array([h, k, l])
                     # The new atom:
                     new = [atom[0], atom[1]] + list(coords) + [atom[5], atom[6], atom[7], 'symmgen']
-                    new_atoms.append(new)
-                    isthere = False
                     # Only add atom if its occupancy (new[5]) is greater zero:
-                    if new[5] >= 0:
-                        for atom in showatoms:
-                            if atom[5] != new[5]:
-                                continue
-                            length = sdm.vector_length(new[2] - atom[2],
-                                                       new[3] - atom[3],
-                                                       new[4] - atom[4])
-                            if length < 0.2:
-                                isthere = True
-                    if not isthere:
-                        showatoms.append(new)
+                    if new[5] >= 0 and atomhash.is_there(new):
+                        continue
+                    showatoms.append(new)
+                    sources.append(num)
+                    atomhash.add(new)
                 # elif grow_qpeaks:
                 #    add q-peaks here
+        self.bondlist = self.packed_bonds(showatoms, sources)
         cart_atoms = []
         for a in showatoms:
             cart_atoms.append(self.to_cartesian(a))
         return cart_atoms
 
+    def packed_bonds(self, atoms: list, sources: list) -> list:
+        """
+        Returns the covalent bonds between the packed atoms as list of [num1, num2] with num1 < num2, starting
+        from 1 like in a mol file. Only atoms whose atoms in the asymmetric unit are covalently bonded
+        in the sdm are compared, with the same bond criterion as in the sdm. Symmetry images of the same
+        atom are never bonded.
+        :param atoms: The packed atoms in fractional coordinates
+        :param sources: The index of the asymmetric unit atom for every packed atom
+        """
+        partners = {}
+        for item in self.sdm_list:
+            if item.covalent:
+                partners.setdefault(item.a1, {})[item.a2] = item.dddd
+                partners.setdefault(item.a2, {})[item.a1] = item.dddd
+        if not partners:
+            return []
+        maxdist = max(dddd for bonded in partners.values() for dddd in bonded.values())
+        widths = [maxdist * x for x in self.reciprocal_lengths]
+        cells = [tuple(floor(at[n + 2] / widths[n]) for n in range(3)) for at in atoms]
+        grid = {}
+        for num, cell in enumerate(cells):
+            grid.setdefault(cell, []).append(num)
+        bonds = []
+        for num1, at1 in enumerate(atoms):
+            bonded = partners.get(sources[num1])
+            if not bonded:
+                continue
+            x, y, z = cells[num1]
+            for dx, dy, dz in product((-1, 0, 1), repeat=3):
+                for num2 in grid.get((x + dx, y + dy, z + dz), ()):
+                    # No bonds between an atom and its own symmetry images, like in MolFile:
+                    if num2 <= num1 or sources[num2] not in bonded or sources[num2] == sources[num1]:
+                        continue
+                    at2 = atoms[num2]
+                    length = self.vector_length(at1[2] - at2[2], at1[3] - at2[3], at1[4] - at2[4])
+                    if 0.01 < length < bonded[sources[num2]]:
+                        bonds.append([num1 + 1, num2 + 1])
+        bonds.sort()
+        return bonds
+
     def to_cartesian(self, at):
         return list(at[:2]) + frac_to_cart([at[2], at[3], at[4]], self.cell[:6]) + list(at[5:])
 
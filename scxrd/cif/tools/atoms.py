@@ -662,6 +662,30 @@ def get_atomlabel(input_atom: str) -> str:
         raise KeyError
 
 
+def formula_str_to_dict(sumform: str) -> dict:
+    """
+    Converts a sum formula like in _chemical_formula_sum to a dictionary of element and count.
+    Elements without a number count once and unknown elements are left out.
+
+    >>> formula_str_to_dict('C12 H10 O2 Pd')
+    {'C': 12.0, 'H': 10.0, 'O': 2.0, 'Pd': 1.0}
+    >>> formula_str_to_dict('C6H5Cl0.5 Cl')
+    {'C': 6.0, 'H': 5.0, 'Cl': 1.5}
+    >>> formula_str_to_dict('foo')
+    {}
+    """
+    formula = {}
+    for element, count in re.findall(r'([A-Z][a-z]?)(\d*\.?\d*)', sumform or ''):
+        if element not in atoms:
+            continue
+        try:
+            count = float(count) if count else 1.0
+        except ValueError:
+            continue
+        formula[element] = formula.get(element, 0.0) + count
+    return formula
+
+
 if __name__ == '__main__':
     import doctest
 
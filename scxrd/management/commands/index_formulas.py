@@ -0,0 +1,39 @@
+"""
+Fills the formula element index for all existing measurements, samples and CIF files:
+
+python manage.py index_formulas
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from scxrd.cif.tools.atoms import formula_str_to_dict
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.formula_model import FormulaElement
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.sample_model import Sample
+
+
+class Command(BaseCommand):
+    help = 'Fills the formula element index of measurements, samples and CIF files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of index rows written in one query.')
+
+    def handle(self, *args, **options):
+        sources = (
+            (FormulaElement.MEASUREMENT, 'measurement_id', Measurement.objects.values_list('pk', 'sum_formula')),
+            (FormulaElement.SAMPLE, 'sample_id', Sample.objects.values_list('pk', 'sum_formula')),
+            (FormulaElement.CIF, 'measurement_id',
+             CifFileModel.objects.filter(measurement__isnull=False).values_list('measurement_id',
+                                                                                'chemical_formula_sum')),
+        )
+        with transaction.atomic():
+            for source, owner_field, formulas in sources:
+                FormulaElement.objects.filter(source=source).delete()
+                rows = [FormulaElement(**{owner_field: owner_id}, source=source, element=element, count=count)
+                        for owner_id, formula in formulas.iterator()
+                        for element, count in formula_str_to_dict(formula).items()]
+                FormulaElement.objects.bulk_create(rows, batch_size=options['batch_size'])
+                self.stdout.write('{}: {} elements'.format(source, len(rows)))
+        self.stdout.write(self.style.SUCCESS('Formula index complete.'))
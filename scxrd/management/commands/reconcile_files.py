@@ -0,0 +1,31 @@
+"""
+Compares the recorded file metadata of CIF files, checkCIF reports and structure reports with the storage,
+e.g. after files were deleted or restored by hand. The status of the samples depends on the CIF files and
+is computed again afterwards. Run it periodically, for example as cron job:
+
+*/30 * * * * python manage.py reconcile_files
+"""
+from django.core.management.base import BaseCommand
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.models import CheckCifModel, ReportModel
+from scxrd.models.sample_model import update_sample_status
+
+
+class Command(BaseCommand):
+    help = 'Updates the recorded existence, size and change date of all uploaded files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rows written to the database in one query.')
+        parser.add_argument('--unchecked', action='store_true',
+                            help='Only look at files that were never checked.')
+
+    def handle(self, *args, **options):
+        for model in (CifFileModel, CheckCifModel, ReportModel):
+            checked, changed, missing = model.reconcile_files(unchecked_only=options['unchecked'],
+                                                              batch_size=options['batch_size'])
+            self.stdout.write('{}: {} checked, {} changed, {} missing.'.format(
+                model._meta.verbose_name_plural, checked, changed, missing))
+        self.stdout.write('samples: {} status updated.'.format(update_sample_status()))
+        self.stdout.write(self.style.SUCCESS('Files reconciled.'))
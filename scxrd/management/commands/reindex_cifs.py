@@ -0,0 +1,149 @@
+"""
+Extracts the residuals of all stored CIF files again, e.g. after a new column was added to CifFileModel
+or fill_residuals_table() was changed:
+
+python manage.py reindex_cifs --workers 4 --since 2020-01-01
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from scxrd.cif.cif_file_io import CifContainer
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.formula_model import update_cif_formula
+from scxrd.models.reduced_cell_model import update_cif_reduced_cell
+from scxrd.search_index import update_search_index
+
+
+def _init_worker():
+    # Worker processes that are spawned instead of forked need their own Django setup:
+    django.setup()
+
+
+def parse_residuals(job: tuple) -> tuple:
+    """
+    Parses a CIF file and returns (pk, values of CifFileModel.residual_fields, error message).
+    """
+    pk, path = job
+    cif_model = CifFileModel()
+    try:
+        cif_model.fill_residuals_table(CifContainer(Path(path), metadata_only=True))
+        # The values as they come back from the database, in order to compare them:
+        values = {name: CifFileModel._meta.get_field(name).to_python(getattr(cif_model, name))
+                  for name in CifFileModel.residual_fields}
+    except Exception as e:
+        return pk, None, '{}: {}'.format(Path(path).name, e)
+    return pk, values, ''
+
+
+class Command(BaseCommand):
+    help = 'Extracts the residuals of all stored CIF files again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes that parse CIF files.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of rows written to the database in one transaction.')
+        parser.add_argument('--since', help='Only CIF files changed since this date (YYYY-MM-DD).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Parse all files and report the changes without writing them.')
+        parser.add_argument('--state-file', default=os.path.join(settings.BASE_DIR, '.reindex_cifs_done'),
+                            help='The sha256 checksums of finished files are stored here to resume an '
+                                 'interrupted run. It is deleted after a complete run.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the state of an interrupted run.')
+
+    def handle(self, *args, **options):
+        state_file = Path(options['state_file'])
+        if options['restart'] and state_file.exists():
+            state_file.unlink()
+        done = set(state_file.read_text().split()) if state_file.exists() else set()
+        queryset = CifFileModel.objects.exclude(cif_file_on_disk='').only('pk', 'sha256', 'cif_file_on_disk',
+                                                                          'cif_file_name', 'measurement',
+                                                                          *CifFileModel.residual_fields)
+        if options['since']:
+            since = parse_date(options['since'])
+            if not since:
+                raise CommandError('--since needs a date like 2020-01-31.')
+            queryset = queryset.filter(date_updated__gte=timezone.make_aware(datetime.combine(since, dt_time.min)))
+        cif_models = {}
+        jobs = []
+        missing = 0
+        for cif_model in queryset.order_by('pk').iterator():
+            if cif_model.sha256 and cif_model.sha256 in done:
+                continue
+            path = Path(cif_model.cif_file_on_disk.path)
+            if not path.is_file():
+                missing += 1
+                continue
+            cif_models[cif_model.pk] = cif_model
+            jobs.append((cif_model.pk, str(path)))
+        if done:
+            self.stdout.write('Resuming, {} files were already finished.'.format(len(done)))
+        self.stdout.write('{} CIF files to parse, {} missing on disk.'.format(len(jobs), missing))
+        start = time.perf_counter()
+        processed = changed = failed = 0
+        finished = []
+        updated = []
+        for pk, values, error in self._parse_all(jobs, options['workers']):
+            processed += 1
+            cif_model = cif_models.pop(pk)
+            if error:
+                failed += 1
+                self.stderr.write('\nError in {}'.format(error))
+                continue
+            # The cached file name of rows from before the cif_file_name column:
+            values['cif_file_name'] = Path(cif_model.cif_file_on_disk.name).name
+            if any(getattr(cif_model, name) != value for name, value in values.items()):
+                for name, value in values.items():
+                    setattr(cif_model, name, value)
+                changed += 1
+                updated.append(cif_model)
+            finished.append(cif_model)
+            if len(finished) >= options['batch_size']:
+                self._write_batch(finished, updated, state_file, options['dry_run'])
+                finished, updated = [], []
+            rate = processed / (time.perf_counter() - start)
+            self.stdout.write('\r{}/{} files, {:.1f} files/s'.format(processed, len(jobs), rate), ending='')
+        self._write_batch(finished, updated, state_file, options['dry_run'])
+        elapsed = time.perf_counter() - start
+        if not options['dry_run'] and state_file.exists():
+            state_file.unlink()
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            '{} files in {:.1f} s ({:.1f} files/s): {} {}, {} failed.'.format(
+                processed, elapsed, processed / elapsed if elapsed else 0.0, changed,
+                'would change' if options['dry_run'] else 'changed', failed)))
+
+    @staticmethod
+    def _parse_all(jobs: list, workers: int):
+        if workers < 2 or len(jobs) < 2:
+            yield from map(parse_residuals, jobs)
+            return
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            yield from executor.map(parse_residuals, jobs, chunksize=max(1, min(20, len(jobs) // (workers * 4))))
+
+    @staticmethod
+    def _write_batch(finished: list, updated: list, state_file: Path, dry_run: bool) -> None:
+        """
+        Writes the updated rows in one transaction and remembers the finished files in the state file.
+        """
+        if dry_run or not finished:
+            return
+        with transaction.atomic():
+            CifFileModel.objects.bulk_update(updated, CifFileModel.residual_fields + ('cif_file_name',))
+            # bulk_update() sends no post_save signal:
+            for cif_model in updated:
+                update_cif_reduced_cell(CifFileModel, cif_model)
+                update_cif_formula(CifFileModel, cif_model)
+            update_search_index([x.measurement_id for x in updated])
+        with open(str(state_file), 'a') as f:
+            f.write(''.join('{}\n'.format(x.sha256) for x in finished if x.sha256))
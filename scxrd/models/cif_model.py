@@ -7,6 +7,7 @@ from django.utils.translation import gettext_lazy as _
 from simple_history.models import HistoricalRecords
 
 from scxrd.cif.cif_file_io import CifContainer
+from scxrd.models.models import StoredFileModel
 from scxrd.utils import get_float
 
 DEBUG = False
@@ -20,11 +21,16 @@ def validate_cif_file_extension(value):
         raise error
 
 
-class CifFileModel(models.Model):
+class CifFileModel(StoredFileModel):
     """
     The database model for a single cif file. The following table rows are filled during file upload
     wR2, R1, Space group, symmcards, atoms, cell, sumformula, completeness, Goof, temperature, Z, Rint, Peak/hole
     """
+    file_field = 'cif_file_on_disk'
+    name_field = 'cif_file_name'
+    # The file size is in filesize:
+    size_field = 'filesize'
+    file_size = None
     measurement = models.OneToOneField(to='Measurement', on_delete=models.CASCADE, verbose_name='cif file data',
                                       related_name='ciffilemodel')
     sha256 = models.CharField(max_length=256, blank=True, verbose_name=_('checksum'))
@@ -60,11 +66,31 @@ class CifFileModel(models.Model):
     refine_diff_density_max = models.FloatField(null=True, blank=True)
     refine_diff_density_min = models.FloatField(null=True, blank=True)
     diffrn_reflns_av_unetI_netI = models.FloatField(null=True, blank=True)
+    # As in the CIF file with its standard uncertainty:
+    diffrn_ambient_temperature = models.CharField(max_length=255, blank=True, default='',
+                                                  verbose_name=_('temperature'))
     ccdc_number = models.CharField(max_length=12, blank=True, default='', verbose_name=_('CCDC number'))
     cif_file_on_disk = models.FileField(upload_to='cifs', null=True, blank=True, max_length=255,
                                         validators=[validate_cif_file_extension],
                                         verbose_name='cif file')
-    history = HistoricalRecords()
+    # The file name of cif_file_on_disk, for lists where the file itself is not needed:
+    cif_file_name = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True,
+                                     verbose_name=_('cif file name'))
+    # The mol files for the molecule view are computed in the background after upload:
+    molfile = models.TextField(blank=True, default='', editable=False)
+    molfile_grown = models.TextField(blank=True, default='', editable=False)
+    history = HistoricalRecords(excluded_fields=['molfile', 'molfile_grown'])
+
+    # The model fields that fill_residuals_table() extracts from the CIF file:
+    residual_fields = ('data', 'cell_length_a', 'cell_length_b', 'cell_length_c', 'cell_angle_alpha',
+                       'cell_angle_beta', 'cell_angle_gamma', 'cell_volume', 'cell_formula_units_Z',
+                       'space_group_name_H_M_alt', 'space_group_IT_number', 'space_group_crystal_system',
+                       'space_group_symop_operation_xyz', 'chemical_formula_sum', 'diffrn_radiation_wavelength',
+                       'diffrn_radiation_type', 'diffrn_reflns_av_R_equivalents', 'diffrn_reflns_theta_min',
+                       'diffrn_reflns_theta_max', 'diffrn_measured_fraction_theta_max',
+                       'refine_ls_abs_structure_Flack', 'refine_ls_R_factor_gt', 'refine_ls_wR_factor_ref',
+                       'refine_ls_goodness_of_fit_ref', 'refine_diff_density_max', 'refine_diff_density_min',
+                       'diffrn_reflns_av_unetI_netI', 'ccdc_number', 'diffrn_ambient_temperature')
 
     class Meta:
         verbose_name = _('CIF file')
@@ -80,7 +106,7 @@ class CifFileModel(models.Model):
 
     def fill_residuals_table(self, cif: CifContainer):
         """
-        Fill the table with residuals of the refinement.
+        Fill the table with residuals of the refinement. A CifContainer with metadata_only=True is sufficient.
         """
         self.data = cif.block.name
         self.cell_length_a, self.cell_length_b, self.cell_length_c, \
@@ -91,7 +117,6 @@ class CifFileModel(models.Model):
         self.space_group_IT_number = cif.spgr_number_from_symmops
         self.space_group_crystal_system = cif.crystal_system
         self.space_group_symop_operation_xyz = cif.symmops
-        self.shelx_res_file = cif.resdata
         self.shelx_res_checksum = cif['_shelx_res_checksum']
         # self.shelx_hkl_file = cif['_shelx_hkl_file']
         # self.shelx_hkl_checksum = cif['_shelx_hkl_checksum']
@@ -111,6 +136,7 @@ class CifFileModel(models.Model):
         self.refine_diff_density_min = get_float(cif["_refine_diff_density_min"])
         self.diffrn_reflns_av_unetI_netI = get_float(cif["_diffrn_reflns_av_unetI/netI"])
         self.ccdc_number = cif["_database_code_depnum_ccdc_archive"]
+        self.diffrn_ambient_temperature = cif["_diffrn_ambient_temperature"]
 
     def wr2_in_percent(self):
         if self.refine_ls_R_factor_gt:
@@ -135,32 +161,27 @@ class CifFileModel(models.Model):
             return round(self.diffrn_measured_fraction_theta_max * 100, 1)
 
     def temperature(self):
-        if not self.cif_exists:
-            return ''
-        return CifContainer(self.cif_file_path)['_diffrn_ambient_temperature']
+        return self.diffrn_ambient_temperature
 
     @property
     def cif_file_path(self) -> Path:
         """The complete absolute path of the CIF file with file name and ending"""
-        try:
-            return Path(str(self.cif_file_on_disk.file))
-        except FileNotFoundError:
+        if not self.cif_file_on_disk:
             return Path()
+        return Path(self.cif_file_on_disk.path)
 
     @property
     def cif_name_only(self) -> str:
         """The CIF file name without path"""
         if self.cif_exists:
-            return self.cif_file_path.name
+            return self.cif_file_name
         else:
             return '# No CIf file #'
 
     @property
     def cif_exists(self):
-        """Check if the CIF exists and is a file"""
-        if self.cif_file_path.exists() and self.cif_file_path.is_file():
-            return True
-        return False
+        """If the CIF file existed at the last save or reconcile_files run"""
+        return bool(self.file_exists)
 
     @staticmethod
     def quote_string(string):
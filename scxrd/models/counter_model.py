@@ -0,0 +1,62 @@
+from django.db import models, connection, IntegrityError, transaction
+from django.db.models import Max
+from django.utils.translation import gettext_lazy as _
+
+from scxrd.models.measurement_model import Measurement
+
+MEASUREMENT_NUMBER = 'measurement_number'
+
+
+class Counter(models.Model):
+    """
+    A counter that hands out consecutive numbers, e.g. the numbers of new measurements.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('counter')
+        verbose_name_plural = _('counters')
+
+    def __str__(self):
+        return '{}: {}'.format(self.name, self.value)
+
+
+def next_measurement_number() -> int:
+    """
+    Allocates the number of a new measurement. The counter is incremented in a single UPDATE ... RETURNING
+    statement, so the row lock of the counter serializes concurrent requests and every caller gets another
+    number. The number is at least one above the highest existing measurement number, because numbers
+    can also be given in the admin.
+    UPDATE ... RETURNING needs SQLite 3.35 or newer or PostgreSQL.
+    """
+    sql = ('UPDATE {counter} SET value = 1 + CASE '
+           'WHEN value >= COALESCE((SELECT MAX(number) FROM {measurement}), 0) THEN value '
+           'ELSE (SELECT MAX(number) FROM {measurement}) END '
+           'WHERE name = %s RETURNING value').format(
+        counter=connection.ops.quote_name(Counter._meta.db_table),
+        measurement=connection.ops.quote_name(Measurement._meta.db_table))
+    for _attempt in range(2):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [MEASUREMENT_NUMBER])
+            row = cursor.fetchone()
+        if row:
+            return row[0]
+        # The first number ever:
+        try:
+            with transaction.atomic():
+                Counter.objects.create(name=MEASUREMENT_NUMBER)
+        except IntegrityError:
+            # Another request was faster.
+            pass
+    raise RuntimeError('The measurement number counter could not be created.')
+
+
+def peek_next_measurement_number() -> int:
+    """
+    The number that next_measurement_number() would return now, for initial values of forms.
+    It allocates nothing.
+    """
+    counter = Counter.objects.filter(name=MEASUREMENT_NUMBER).values_list('value', flat=True).first() or 0
+    highest = Measurement.objects.aggregate(Max('number'))['number__max'] or 0
+    return max(counter, highest) + 1
@@ -0,0 +1,154 @@
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from scxrd.cif.tools.atoms import formula_str_to_dict, get_atomlabel
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.sample_model import Sample
+
+
+class FormulaElement(models.Model):
+    """
+    One element of a parsed sum formula. It is the index to search measurements and samples by their
+    elements instead of searching in the formula text.
+    """
+    MEASUREMENT = 'measurement'
+    CIF = 'cif'
+    SAMPLE = 'sample'
+    SOURCE_CHOICES = ((MEASUREMENT, _('empirical formula')), (CIF, _('CIF file')),
+                      (SAMPLE, _('assumed sum formula')))
+    # The measurement for the MEASUREMENT and CIF formulas, the sample for the SAMPLE formula:
+    measurement = models.ForeignKey(to=Measurement, on_delete=models.CASCADE, null=True, blank=True,
+                                    related_name='formula_elements')
+    sample = models.ForeignKey(to=Sample, on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='formula_elements')
+    source = models.CharField(max_length=15, choices=SOURCE_CHOICES)
+    element = models.CharField(max_length=2)
+    count = models.FloatField()
+
+    class Meta:
+        verbose_name = _('formula element')
+        verbose_name_plural = _('formula elements')
+        # The formula search reads the owner ids from these indexes without visiting the table:
+        indexes = [models.Index(fields=['element', 'source', 'count', 'measurement']),
+                   models.Index(fields=['element', 'source', 'count', 'sample'])]
+
+    def __str__(self):
+        return '{}{:g}'.format(self.element, self.count)
+
+    @staticmethod
+    def update_for(owner_id: int, source: str, formula: str) -> None:
+        """
+        Replaces the elements of a formula if they changed.
+        :param owner_id: The primary key of the sample for SAMPLE formulas, else of the measurement
+        """
+        owner_field = 'sample_id' if source == FormulaElement.SAMPLE else 'measurement_id'
+        rows = FormulaElement.objects.filter(**{owner_field: owner_id, 'source': source})
+        elements = formula_str_to_dict(formula)
+        if dict(rows.values_list('element', 'count')) == elements:
+            return
+        rows.delete()
+        FormulaElement.objects.bulk_create([FormulaElement(**{owner_field: owner_id}, source=source,
+                                                           element=element, count=count)
+                                            for element, count in elements.items()])
+
+
+def _element(name: str) -> str:
+    try:
+        return get_atomlabel(name)
+    except KeyError:
+        raise ValueError('{} is no element.'.format(name))
+
+
+def formula_filter(contains: (list, tuple) = (), excludes: (list, tuple) = (), ranges: dict = None,
+                   owner: str = 'measurement') -> Q:
+    """
+    A filter for Measurement or Sample querysets by the elements of their formulas. Each condition is an
+    uncorrelated IN subquery that reads the owner ids from the (element, source, count, owner) index once,
+    instead of a subquery for every measurement. For measurements, either the empirical formula or the
+    formula of the CIF file has to match all conditions, they are not mixed.
+    :param contains: Elements that have to be in the formula, e.g. ['Pd', 'P']
+    :param excludes: Elements that must not be in the formula, e.g. ['Cl']
+    :param ranges: Element and (minimum, maximum) count, e.g. {'C': (20, 30)}, maximum None for no limit
+    :param owner: 'measurement' or 'sample'
+    """
+    if owner == 'sample':
+        sources = (FormulaElement.SAMPLE,)
+    else:
+        sources = (FormulaElement.MEASUREMENT, FormulaElement.CIF)
+    owner_ids = owner + '_id'
+    query = Q()
+    for source in sources:
+        # Without NULL owners, because NOT IN of a list with NULL is never true:
+        elements = FormulaElement.objects.filter(**{owner + '__isnull': False}, source=source)
+        source_query = Q()
+        for element in contains:
+            source_query &= Q(pk__in=elements.filter(element=_element(element)).values(owner_ids))
+        for element in excludes:
+            source_query &= ~Q(pk__in=elements.filter(element=_element(element)).values(owner_ids))
+        for element, (minimum, maximum) in (ranges or {}).items():
+            counts = elements.filter(element=_element(element), count__gte=minimum)
+            if maximum is not None:
+                counts = counts.filter(count__lte=maximum)
+            source_query &= Q(pk__in=counts.values(owner_ids))
+        if not contains and not ranges:
+            # Only exclusions: The formula of this source has to exist at all.
+            source_query &= Q(pk__in=elements.values(owner_ids))
+        query |= source_query
+    return query
+
+
+def parse_formula_query(text: str) -> dict:
+    """
+    Parses a formula search like 'Pd P -Cl C20-30' into the arguments of formula_filter().
+    An element counts as contained, a leading minus excludes it and numbers after the element give
+    the range of its count. A range without maximum like C20- has no upper limit.
+
+    >>> parse_formula_query('Pd P -Cl C20-30 N2')
+    {'contains': ['Pd', 'P'], 'excludes': ['Cl'], 'ranges': {'C': (20.0, 30.0), 'N': (2.0, 2.0)}}
+    >>> parse_formula_query('C20-')
+    {'contains': [], 'excludes': [], 'ranges': {'C': (20.0, None)}}
+    """
+    query = {'contains': [], 'excludes': [], 'ranges': {}}
+    for token in text.split():
+        if token.startswith('-'):
+            query['excludes'].append(_element(token[1:]))
+            continue
+        element = _element(token)
+        numbers = token[len(element):]
+        if not numbers:
+            query['contains'].append(element)
+            continue
+        minimum, sep, maximum = numbers.partition('-')
+        try:
+            if sep and not maximum:
+                query['ranges'][element] = (float(minimum), None)
+            else:
+                query['ranges'][element] = (float(minimum), float(maximum or minimum))
+        except ValueError:
+            raise ValueError('{} is no valid element count.'.format(token))
+    return query
+
+
+@receiver(post_save, sender=Measurement)
+def update_measurement_formula(sender, instance: Measurement, **kwargs):
+    FormulaElement.update_for(instance.pk, FormulaElement.MEASUREMENT, instance.sum_formula)
+
+
+@receiver(post_save, sender=Sample)
+def update_sample_formula(sender, instance: Sample, **kwargs):
+    FormulaElement.update_for(instance.pk, FormulaElement.SAMPLE, instance.sum_formula)
+
+
+@receiver(post_save, sender=CifFileModel)
+def update_cif_formula(sender, instance: CifFileModel, **kwargs):
+    if instance.measurement_id:
+        FormulaElement.update_for(instance.measurement_id, FormulaElement.CIF, instance.chemical_formula_sum)
+
+
+@receiver(post_delete, sender=CifFileModel)
+def delete_cif_formula(sender, instance: CifFileModel, **kwargs):
+    FormulaElement.objects.filter(measurement_id=instance.measurement_id, source=FormulaElement.CIF).delete()
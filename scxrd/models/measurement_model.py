@@ -1,10 +1,12 @@
 import datetime
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import ProtectedError
-from django.db.models.signals import pre_delete
+from django.db.models import ProtectedError, QuerySet
+from django.core.cache import cache
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
 from django.urls import reverse_lazy
 from django.utils import timezone
@@ -78,6 +80,10 @@ class Measurement(models.Model):
         ordering = ["-number"]
         verbose_name = _('Measurement')
         verbose_name_plural = _('Measurements')
+        # For the running measurements, the sortable columns of the measurements table, the date filter
+        # of the admin and the work group statistics:
+        indexes = [models.Index(fields=['end_time', 'machine']), models.Index(fields=['publishable', 'number']),
+                   models.Index(fields=['measure_date']), models.Index(fields=['customer', 'measure_date'])]
 
     def was_measured_recently(self) -> bool:
         now = timezone.now()
@@ -98,6 +104,43 @@ class Measurement(models.Model):
         return reverse_lazy('scxrd:edit-measurement', args=(self.number,))
 
 
+# The unfinished measurements for running_measurements():
+UNFINISHED_CACHE_KEY = 'scxrd:unfinished_measurements'
+# Default of settings.RUNNING_MEASUREMENTS_CACHE_TIMEOUT in seconds:
+UNFINISHED_CACHE_TIMEOUT = 10
+
+
+def unfinished_measurements(now: datetime.datetime) -> QuerySet:
+    """
+    The measurements with an end time after now. The (end_time, machine) index finds them.
+    """
+    return Measurement.objects.filter(end_time__gt=now).select_related('machine', 'operator__profile').order_by()
+
+
+def running_measurements() -> list:
+    """
+    The currently running measurements, sorted by machine and end time.
+    The measurements with an end time in the future only change when a measurement is saved, so they are
+    cached until then and the running ones are picked from them.
+    """
+    now = timezone.now()
+    unfinished = cache.get(UNFINISHED_CACHE_KEY)
+    if unfinished is None:
+        unfinished = list(unfinished_measurements(now))
+        # Sorted here, because an ORDER BY machine would make the database scan the machine index
+        # instead of searching the end_time index. NULL machines come first like in SQL:
+        unfinished.sort(key=lambda exp: (exp.machine_id is not None, exp.machine_id or 0, exp.end_time))
+        cache.set(UNFINISHED_CACHE_KEY, unfinished,
+                  getattr(settings, 'RUNNING_MEASUREMENTS_CACHE_TIMEOUT', UNFINISHED_CACHE_TIMEOUT))
+    return [exp for exp in unfinished if exp.measure_date < now < exp.end_time]
+
+
+@receiver(post_save, sender=Measurement)
+@receiver(post_delete, sender=Measurement)
+def invalidate_running_measurements(sender, instance: Measurement, **kwargs):
+    cache.delete(UNFINISHED_CACHE_KEY)
+
+
 @receiver(pre_delete, sender=Measurement)
 def delete_protect_handler(sender, instance: Measurement, **kwargs):
     """
@@ -4,7 +4,7 @@ from pathlib import Path
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import EmailValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
 # Create your models here.
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -20,7 +20,6 @@ TODO:
 - mail request of operator status: page for operators where they can send a mail and set status
 - check checksum for correctness during file upload and download
 - show wrong cif crc in "Details" of measurements list page
-- Check for existing unit cell during cif upload and measure measurement.
 - for charts:
     https://simpleisbetterthancomplex.com/tutorial/2020/01/19/how-to-use-chart-js-with-django.html 
     https://www.chartjs.org/docs/latest/
@@ -186,15 +185,93 @@ def validate_reportdoc_file_extension(value):
         raise error
 
 
-class CheckCifModel(models.Model):
+class StoredFileModel(models.Model):
+    """
+    A model with an uploaded file. The name, existence, size and modification time of the file are recorded
+    on save and by the reconcile_files command, so that pages with many of them need no file system access.
+    """
+    # The FileField and the field with the cached file name of the subclass:
+    file_field = ''
+    name_field = ''
+    size_field = 'file_size'
+    # None until the file was looked at, e.g. for rows from before this field existed:
+    file_exists = models.BooleanField(null=True, default=None, editable=False, verbose_name=_('file exists'))
+    file_size = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name=_('file size'))
+    file_mtime = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_('file change date'))
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def file_metadata_fields(cls) -> list:
+        return [cls.name_field, 'file_exists', cls.size_field, 'file_mtime']
+
+    def read_file_metadata(self) -> bool:
+        """
+        Reads the file metadata from the storage. Returns True if it changed.
+        """
+        stored_file = getattr(self, self.file_field)
+        name = Path(stored_file.name).name if stored_file else ''
+        exists, size, mtime = False, None, None
+        if stored_file:
+            try:
+                exists = stored_file.storage.exists(stored_file.name)
+                if exists:
+                    size = stored_file.storage.size(stored_file.name)
+                    mtime = stored_file.storage.get_modified_time(stored_file.name)
+            except (OSError, NotImplementedError):
+                exists = False
+        old = [getattr(self, x) for x in self.file_metadata_fields()]
+        for field, value in zip(self.file_metadata_fields(), (name, exists, size, mtime)):
+            setattr(self, field, value)
+        return old != [name, exists, size, mtime]
+
+    @classmethod
+    def reconcile_files(cls, unchecked_only: bool = False, batch_size: int = 500) -> tuple:
+        """
+        Reads the file metadata of all rows, or only of the rows that were never checked, and writes the
+        changed rows. bulk_update() writes no history and sends no signals, it is only metadata.
+        :return: The numbers of checked, changed and missing files
+        """
+        checked = changed = missing = 0
+        updated = []
+        fields = cls.file_metadata_fields()
+        rows = cls.objects.only('pk', cls.file_field, *fields)
+        if unchecked_only:
+            rows = rows.filter(file_exists__isnull=True)
+        for row in rows.iterator():
+            checked += 1
+            if row.read_file_metadata():
+                updated.append(row)
+                changed += 1
+            if getattr(row, cls.file_field) and not row.file_exists:
+                missing += 1
+        with transaction.atomic():
+            cls.objects.bulk_update(updated, fields, batch_size=batch_size)
+        return checked, changed, missing
+
+    def save(self, *args, **kwargs):
+        stored_file = getattr(self, self.file_field)
+        if stored_file and not stored_file._committed:
+            # The FileField would write a new upload only during super().save():
+            stored_file.save(stored_file.name, stored_file.file, save=False)
+        self.read_file_metadata()
+        super().save(*args, **kwargs)
+
+
+class CheckCifModel(StoredFileModel):
     """
     A pdf or html file with the IUCr checkcif result: https://checkcif.iucr.org/
     """
+    file_field = 'checkcif_on_disk'
+    name_field = 'checkcif_file_name'
     measurement = models.OneToOneField(to='Measurement', on_delete=models.CASCADE, verbose_name='checkCIF report',
                                        related_name='checkcifmodel')
     checkcif_on_disk = models.FileField(upload_to='checkcif_reports', null=True, blank=True, max_length=255,
                                         validators=[validate_checkcif_file_extension],
                                         verbose_name='cif file')
+    # The file name of checkcif_on_disk, for pages where the file itself is not needed:
+    checkcif_file_name = models.CharField(max_length=255, blank=True, default='', editable=False)
     history = HistoricalRecords()
 
     def __str__(self):
@@ -206,34 +283,35 @@ class CheckCifModel(models.Model):
     @property
     def chkcif_file_path(self) -> Path:
         """The complete absolute path of the CIF file with file name and ending"""
-        try:
-            return Path(str(self.checkcif_on_disk.file))
-        except FileNotFoundError:
+        if not self.checkcif_on_disk:
             return Path()
+        return Path(self.checkcif_on_disk.path)
 
     @property
     def chkcif_name_only(self) -> str:
         """The CIF file name without path"""
-        return self.chkcif_file_path.name
+        return self.checkcif_file_name if self.file_exists else ''
 
     @property
     def chkcif_exists(self):
-        """Check if the CIF exists"""
-        if self.chkcif_file_path.exists() and self.chkcif_file_path.is_file():
-            return True
-        return False
+        """If the file existed at the last save or reconcile_files run"""
+        return bool(self.file_exists)
 
 
-class ReportModel(models.Model):
+class ReportModel(StoredFileModel):
     """
     A pdf or html file with the IUCr checkcif result: https://checkcif.iucr.org/
     """
+    file_field = 'reportdoc_on_disk'
+    name_field = 'reportdoc_file_name'
     measurement = models.OneToOneField(to='Measurement', on_delete=models.CASCADE, max_length=255,
                                        verbose_name='structure report document',
                                        related_name='reportmodel')
     reportdoc_on_disk = models.FileField(upload_to='struct_reports', null=True, blank=True,
                                          validators=[validate_reportdoc_file_extension],
                                          verbose_name='cif file')
+    # The file name of reportdoc_on_disk, for pages where the file itself is not needed:
+    reportdoc_file_name = models.CharField(max_length=255, blank=True, default='', editable=False)
     history = HistoricalRecords()
 
     def __str__(self):
@@ -245,22 +323,19 @@ class ReportModel(models.Model):
     @property
     def report_file_path(self) -> Path:
         """The complete absolute path of the report file with file name and ending"""
-        try:
-            return Path(str(self.reportdoc_on_disk.file))
-        except FileNotFoundError:
+        if not self.reportdoc_on_disk:
             return Path()
+        return Path(self.reportdoc_on_disk.path)
 
     @property
     def report_name_only(self) -> str:
         """The CIF file name without path"""
-        return self.report_file_path.name
+        return self.reportdoc_file_name if self.file_exists else ''
 
     @property
     def report_exists(self):
-        """Check if the report document exists"""
-        if self.report_file_path.exists() and self.report_file_path.is_file():
-            return True
-        return False
+        """If the report document existed at the last save or reconcile_files run"""
+        return bool(self.file_exists)
 
 
 class MachineLogbookModel(models.Model):
@@ -285,3 +360,18 @@ def update_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
         # print('Created a profile instance!')
     instance.profile.save()
+
+
+def check_unchecked_files(sender=None, **kwargs) -> None:
+    """
+    Records the file metadata of the uploaded files that were never checked and computes the sample status
+    again. This runs after migrate, so that existing files do not look missing after the file_exists field
+    was added.
+    """
+    from scxrd.models.sample_model import update_sample_status
+    changed = 0
+    for model in StoredFileModel.__subclasses__():
+        changed += model.reconcile_files(unchecked_only=True)[1]
+    if changed:
+        update_sample_status()
+
@@ -0,0 +1,106 @@
+from django.db import models
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.utils import niggli_reduced_cell, parse_cell
+
+
+class ReducedCell(models.Model):
+    """
+    The Niggli reduced unit cell of the CIF file or of the preliminary unit cell of a measurement.
+    It is the index to find measurements of already known unit cells.
+    """
+    CIF = 'cif'
+    PRELIM = 'prelim'
+    SOURCE_CHOICES = ((CIF, _('CIF file')), (PRELIM, _('first unit cell')))
+    measurement = models.ForeignKey(to=Measurement, on_delete=models.CASCADE, related_name='reduced_cells')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    a = models.FloatField()
+    b = models.FloatField()
+    c = models.FloatField()
+    alpha = models.FloatField()
+    beta = models.FloatField()
+    gamma = models.FloatField()
+    volume = models.FloatField(db_index=True)
+
+    class Meta:
+        verbose_name = _('reduced cell')
+        verbose_name_plural = _('reduced cells')
+        constraints = [models.UniqueConstraint(fields=['measurement', 'source'], name='unique_reduced_cell')]
+        indexes = [models.Index(fields=['a', 'b', 'c'])]
+
+    def __str__(self):
+        return '{:.3f} {:.3f} {:.3f} {:.2f} {:.2f} {:.2f}'.format(self.a, self.b, self.c, self.alpha, self.beta,
+                                                                  self.gamma)
+
+    @staticmethod
+    def update_for(measurement_id: int, source: str, cell: (list, None), centring: str = 'P') -> None:
+        """
+        Stores the reduced cell of a measurement or deletes it if cell is None or can not exist.
+        """
+        reduced = niggli_reduced_cell(cell, centring) if cell else None
+        if not reduced:
+            ReducedCell.objects.filter(measurement_id=measurement_id, source=source).delete()
+            return
+        a, b, c, alpha, beta, gamma, volume = reduced
+        ReducedCell.objects.update_or_create(measurement_id=measurement_id, source=source,
+                                             defaults=dict(a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma,
+                                                           volume=volume))
+
+
+def search_cells(cell: (list, tuple), centring: str = 'P', length_percent: float = 1.5,
+                 angle_degree: float = 1.5) -> QuerySet:
+    """
+    Returns the reduced cells that are similar to cell. The reduced cell lengths may deviate by length_percent
+    and the angles by angle_degree. All conditions are range queries on indexed columns.
+    :param cell: a, b, c, alpha, beta, gamma
+    :param centring: The lattice centring of cell
+    """
+    reduced = niggli_reduced_cell(cell, centring)
+    if not reduced:
+        return ReducedCell.objects.none()
+    a, b, c, alpha, beta, gamma, volume = reduced
+    factor = length_percent / 100.0
+    filters = {}
+    for name, value in (('a', a), ('b', b), ('c', c)):
+        filters[name + '__range'] = (value * (1 - factor), value * (1 + factor))
+    for name, value in (('alpha', alpha), ('beta', beta), ('gamma', gamma)):
+        filters[name + '__range'] = (value - angle_degree, value + angle_degree)
+    filters['volume__range'] = (volume * (1 - factor) ** 3, volume * (1 + factor) ** 3)
+    return ReducedCell.objects.filter(**filters).select_related('measurement')
+
+
+def centring_of(cif_model: CifFileModel) -> str:
+    """
+    The lattice centring from the first letter of the Hermann-Mauguin symbol.
+    """
+    space_group = (cif_model.space_group_name_H_M_alt or 'P').strip("' ")
+    return space_group[:1].upper() or 'P'
+
+
+def cif_cell(cif_model: CifFileModel) -> (list, None):
+    cell = [cif_model.cell_length_a, cif_model.cell_length_b, cif_model.cell_length_c,
+            cif_model.cell_angle_alpha, cif_model.cell_angle_beta, cif_model.cell_angle_gamma]
+    if not all(cell):
+        return None
+    return cell
+
+
+@receiver(post_save, sender=CifFileModel)
+def update_cif_reduced_cell(sender, instance: CifFileModel, **kwargs):
+    ReducedCell.update_for(instance.measurement_id, ReducedCell.CIF, cif_cell(instance), centring_of(instance))
+
+
+@receiver(post_delete, sender=CifFileModel)
+def delete_cif_reduced_cell(sender, instance: CifFileModel, **kwargs):
+    ReducedCell.objects.filter(measurement_id=instance.measurement_id, source=ReducedCell.CIF).delete()
+
+
+@receiver(post_save, sender=Measurement)
+def update_prelim_reduced_cell(sender, instance: Measurement, **kwargs):
+    # The centring of the first unit cell is unknown, it is always reduced as primitive cell.
+    ReducedCell.update_for(instance.pk, ReducedCell.PRELIM, parse_cell(instance.prelim_unit_cell or ''))
@@ -3,10 +3,15 @@ from pathlib import Path
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Exists, OuterRef, QuerySet, Case, When, Value
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from simple_history.models import HistoricalRecords
 
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
 from scxrd.models.models import sample_name_validator
 
 
@@ -17,6 +22,10 @@ def validate_reaction_file_extension(value):
 
 
 class Sample(models.Model):
+    OPEN = 'open'
+    MEASURED = 'measured'
+    REFINED = 'refined'
+    STATUS_CHOICES = ((OPEN, _('awaiting measurement')), (MEASURED, _('measured')), (REFINED, _('refined')))
     # TODO: make sure that no samples can be created in the future and not too far in the past. 
     sample_name = models.CharField(verbose_name=_('sample name'), max_length=200, blank=False, unique=True,
                                    help_text=_('A unique name of your sample'), validators=[sample_name_validator])
@@ -44,12 +53,17 @@ class Sample(models.Model):
     mol_file = models.TextField(verbose_name=_('MOL file of the structure'), blank=True, default='')
     special_remarks = models.TextField(verbose_name=_('special remarks'), blank=True,
                                        help_text=_('Any additional information we should know.'))
+    # Kept up to date from the measurements and CIF files of the sample by update_sample_status():
+    status = models.CharField(verbose_name=_('status'), max_length=10, choices=STATUS_CHOICES, default=OPEN,
+                              editable=False)
     history = HistoricalRecords()
 
     class Meta:
         ordering = ["id"]
         verbose_name = _('Sample')
         verbose_name_plural = _('Samples')
+        # The operator queue filters by status and sorts by submission date:
+        indexes = [models.Index(fields=['status', 'submit_date'])]
 
     def __str__(self):
         return self.sample_name
@@ -57,6 +71,8 @@ class Sample(models.Model):
     @property
     def reaction_path_file_path(self) -> Path:
         """The complete absolute path of the CIF file with file name and ending"""
+        if not self.reaction_path:
+            return Path()
         try:
             return Path(str(self.reaction_path.file))
         except FileNotFoundError:
@@ -67,9 +83,60 @@ class Sample(models.Model):
         """The CIF file name without path"""
         return self.reaction_path_file_path.name
 
-    def was_measured(self):
-        if not self.measurements:
-            return False
-        return any([x.was_measured for x in self.measurements.all()])
+    def was_measured(self) -> bool:
+        if hasattr(self, 'any_measured'):
+            # From samples_with_status()
+            return self.any_measured
+        return self.measurements.filter(was_measured=True).exists()
+
+    was_measured.boolean = True
+
+
+def samples_with_status(queryset: QuerySet = None) -> QuerySet:
+    """
+    Annotates the samples with the status of their measurements, so that sample lists need no queries
+    per sample:
+    any_measured: A measurement of the sample was measured successfully.
+    has_cif_file: A measurement of the sample has a CIF file.
+    The measurements and their CIF files are prefetched for the templates.
+    """
+    if queryset is None:
+        queryset = Sample.objects.all()
+    return queryset.annotate(
+        any_measured=Exists(Measurement.objects.filter(sample=OuterRef('pk'), was_measured=True)),
+        has_cif_file=Exists(CifFileModel.objects.filter(measurement__sample=OuterRef('pk'), file_exists=True)),
+    ).prefetch_related('measurements__ciffilemodel')
+
+
+def update_sample_status(sample_ids: (list, tuple) = None) -> int:
+    """
+    Computes the status of the samples with sample_ids (or of all samples) in a single UPDATE statement.
+    A sample is refined if a measurement of it has a CIF file and measured if a measurement was measured
+    successfully.
+    :return: The number of updated samples
+    """
+    samples = Sample.objects.all()
+    if sample_ids is not None:
+        samples = samples.filter(pk__in=[x for x in sample_ids if x])
+    return samples.update(status=Case(
+        When(Exists(CifFileModel.objects.filter(measurement__sample=OuterRef('pk'), file_exists=True)),
+             then=Value(Sample.REFINED)),
+        When(Exists(Measurement.objects.filter(sample=OuterRef('pk'), was_measured=True)),
+             then=Value(Sample.MEASURED)),
+        default=Value(Sample.OPEN), output_field=models.CharField()))
+
+
+@receiver(post_save, sender=Measurement)
+@receiver(post_delete, sender=Measurement)
+def update_measurement_sample_status(sender, instance: Measurement, **kwargs):
+    if instance.sample_id:
+        update_sample_status([instance.sample_id])
+
+
+@receiver(post_save, sender=CifFileModel)
+@receiver(post_delete, sender=CifFileModel)
+def update_cif_sample_status(sender, instance: CifFileModel, **kwargs):
+    sample_id = Measurement.objects.filter(pk=instance.measurement_id).values_list('sample_id', flat=True).first()
+    if sample_id:
+        update_sample_status([sample_id])
 
-    was_measured.boolean = True
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+A cache for the mol files of the molecule view. The mol files are stored in the 'molfiles' cache of
+settings.CACHES with the sha256 checksum of the CIF file and the grow state as key. The cache backend
+decides about the eviction, the LocMemCache evicts the least recently used entries above MAX_ENTRIES.
+Mol files larger than settings.MOLFILE_CACHE_MAX_SIZE characters are not cached, so that the memory of
+the cache is bounded by MAX_ENTRIES * MOLFILE_CACHE_MAX_SIZE in every process.
+"""
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.core.cache.backends.base import BaseCache
+
+MOLFILE_CACHE = 'molfiles'
+# The default of settings.MOLFILE_CACHE_MAX_SIZE:
+MOLFILE_MAX_SIZE = 200_000
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = Lock()
+
+
+def _get_cache() -> BaseCache:
+    try:
+        return caches[MOLFILE_CACHE]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _cache_key(sha256: str, grow: bool) -> str:
+    return 'molfile:{}:{}'.format(sha256, 'grown' if grow else 'asu')
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_molfile(sha256: str, grow: bool) -> (str, None):
+    """
+    Returns the cached mol file of the CIF file with the checksum sha256 or None.
+    """
+    if not sha256:
+        return None
+    molfile = _get_cache().get(_cache_key(sha256, grow))
+    _count('misses' if molfile is None else 'hits')
+    return molfile
+
+
+def set_molfile(sha256: str, grow: bool, molfile: str) -> None:
+    if not sha256 or not molfile.strip():
+        return
+    if len(molfile) > getattr(settings, 'MOLFILE_CACHE_MAX_SIZE', MOLFILE_MAX_SIZE):
+        # e.g. large grown structures, they are made again on each request
+        return
+    _get_cache().set(_cache_key(sha256, grow), molfile)
+
+
+def invalidate_molfiles(sha256: str) -> None:
+    """
+    Removes the grown and the not grown mol file of a CIF file from the cache.
+    """
+    if not sha256:
+        return
+    _get_cache().delete_many([_cache_key(sha256, grow) for grow in (True, False)])
+
+
+def molfile_cache_stats() -> dict:
+    """
+    The cache hits and misses of this process.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    requests = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / requests, 3) if requests else 0.0
+    return stats
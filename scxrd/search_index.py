@@ -0,0 +1,157 @@
+"""
+A full text search index of the measurements for the search field of the measurements table.
+The index is a SQLite FTS5 table or a PostgreSQL table with a tsvector column and a GIN index. It is
+created and filled after every migrate and kept up to date with the post_save and post_delete signals
+of the models that contribute to the text of a measurement. Other databases search with icontains.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.sample_model import Sample
+
+SEARCH_TABLE = 'scxrd_measurement_fts'
+
+# The fields for databases without a full text search:
+fallback_fields = ('measurement_name', 'sum_formula', 'operator__username', 'operator__first_name',
+                   'operator__last_name', 'customer__username', 'customer__first_name', 'customer__last_name',
+                   'ciffilemodel__ccdc_number', 'ciffilemodel__space_group_name_H_M_alt',
+                   'ciffilemodel__chemical_formula_sum', 'sample__special_remarks')
+
+
+def search_backend() -> str:
+    """
+    'sqlite', 'postgresql' or '' for databases without full text search.
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        return connection.vendor
+    return ''
+
+
+def _measurements() -> QuerySet:
+    return Measurement.objects.select_related('operator', 'customer', 'ciffilemodel', 'sample')
+
+
+def document_of(measurement: Measurement) -> str:
+    """
+    The text of a measurement in the search index.
+    """
+    words = [measurement.measurement_name, str(measurement.number), measurement.sum_formula]
+    for user in (measurement.operator, measurement.customer):
+        if user:
+            words.extend([user.username, user.first_name, user.last_name])
+    try:
+        cif = measurement.ciffilemodel
+        words.extend([cif.ccdc_number, cif.space_group_name_H_M_alt, cif.chemical_formula_sum])
+    except CifFileModel.DoesNotExist:
+        pass
+    if measurement.sample:
+        words.append(measurement.sample.special_remarks)
+    return ' '.join(x for x in words if x)
+
+
+def create_search_index(sender=None, **kwargs) -> None:
+    """
+    Creates the search index table if it is missing and fills it with all measurements.
+    This runs after migrate and after the database was flushed.
+    """
+    backend = search_backend()
+    with connection.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(document)'.format(SEARCH_TABLE))
+        elif backend == 'postgresql':
+            cursor.execute('CREATE TABLE IF NOT EXISTS {} (measurement_id integer PRIMARY KEY, '
+                           'document tsvector NOT NULL)'.format(SEARCH_TABLE))
+            cursor.execute('CREATE INDEX IF NOT EXISTS {0}_document ON {0} USING GIN (document)'
+                           .format(SEARCH_TABLE))
+        else:
+            return
+        cursor.execute('DELETE FROM {}'.format(SEARCH_TABLE))
+        cursor.executemany(_insert_sql(), [(x.pk, document_of(x)) for x in _measurements().iterator()])
+
+
+def _insert_sql() -> str:
+    """
+    Inserts or replaces the document of a measurement with the parameters measurement id and text.
+    """
+    if search_backend() == 'sqlite':
+        return 'INSERT OR REPLACE INTO {} (rowid, document) VALUES (%s, %s)'.format(SEARCH_TABLE)
+    return ("INSERT INTO {} (measurement_id, document) VALUES (%s, to_tsvector('simple', %s)) "
+            "ON CONFLICT (measurement_id) DO UPDATE SET document = EXCLUDED.document".format(SEARCH_TABLE))
+
+
+def update_search_index(measurement_ids: (list, tuple)) -> None:
+    """
+    Writes the documents of the measurements with measurement_ids again.
+    """
+    if not search_backend() or not measurement_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(_insert_sql(), [(x.pk, document_of(x))
+                                           for x in _measurements().filter(pk__in=measurement_ids)])
+
+
+def search_filter(text: str) -> Q:
+    """
+    A filter for Measurement querysets that finds all words of text as word prefixes.
+    """
+    words = re.findall(r'[^\W_]+', text)
+    if not words:
+        return Q()
+    backend = search_backend()
+    if backend == 'sqlite':
+        match = ' '.join('"{}"*'.format(word) for word in words)
+        return Q(pk__in=RawSQL('SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(SEARCH_TABLE), [match]))
+    if backend == 'postgresql':
+        match = ' & '.join('{}:*'.format(word) for word in words)
+        return Q(pk__in=RawSQL("SELECT measurement_id FROM {} WHERE document @@ to_tsquery('simple', %s)"
+                               .format(SEARCH_TABLE), [match]))
+    query = Q()
+    for word in words:
+        word_query = Q()
+        for field in fallback_fields:
+            word_query |= Q(**{field + '__icontains': word})
+        query &= word_query
+    return query
+
+
+@receiver(post_save, sender=Measurement)
+def index_measurement(sender, instance: Measurement, **kwargs):
+    update_search_index([instance.pk])
+
+
+@receiver(post_delete, sender=Measurement)
+def remove_measurement(sender, instance: Measurement, **kwargs):
+    if not search_backend():
+        return
+    column = 'rowid' if search_backend() == 'sqlite' else 'measurement_id'
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE {} = %s'.format(SEARCH_TABLE, column), [instance.pk])
+
+
+@receiver(post_save, sender=CifFileModel)
+@receiver(post_delete, sender=CifFileModel)
+def index_cif_measurement(sender, instance: CifFileModel, **kwargs):
+    if instance.measurement_id:
+        update_search_index([instance.measurement_id])
+
+
+@receiver(post_save, sender=Sample)
+def index_sample_measurements(sender, instance: Sample, **kwargs):
+    update_search_index(list(instance.measurements.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=User)
+def index_user_measurements(sender, instance: User, update_fields=None, **kwargs):
+    if update_fields and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        # e.g. the last_login after each login
+        return
+    update_search_index(list(Measurement.objects.filter(Q(operator=instance) | Q(customer=instance))
+                             .values_list('pk', flat=True)))
@@ -0,0 +1,53 @@
+"""
+Background jobs that run in a thread pool of the web server process. They need no external broker,
+but a job is lost if the process ends before it is finished. Everything a job computes can therefore
+also be computed on demand.
+"""
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from django.db import connection, transaction
+
+from scxrd.cif.cif_file_io import CifContainer
+from scxrd.cif.mol_file_writer import make_molfile
+from scxrd.models.cif_model import CifFileModel
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='messlog-jobs')
+
+
+def _run_job(func, *args) -> None:
+    try:
+        func(*args)
+    except Exception as e:
+        print('Error in background job {}: {}'.format(func.__name__, e))
+    finally:
+        # Every thread has its own database connection:
+        connection.close()
+
+
+def submit(func, *args) -> Future:
+    return _executor.submit(_run_job, func, *args)
+
+
+def precompute_molfiles(cif_pk: int, sha256: str) -> None:
+    """
+    Computes the mol files of the asymmetric unit and of the grown molecule and stores them in
+    the CifFileModel. Nothing is stored if the CIF file was replaced in the meantime.
+    """
+    try:
+        cif_model = CifFileModel.objects.get(pk=cif_pk, sha256=sha256)
+    except CifFileModel.DoesNotExist:
+        return
+    if not cif_model.cif_file_path.is_file():
+        return
+    cif = CifContainer(cif_model.cif_file_path)
+    molfile = make_molfile(cif, grow=False)
+    molfile_grown = make_molfile(cif, grow=True)
+    # update() instead of save() to leave the history and a concurrent upload alone:
+    CifFileModel.objects.filter(pk=cif_pk, sha256=sha256).update(molfile=molfile, molfile_grown=molfile_grown)
+
+
+def enqueue_molfiles(cif_model: CifFileModel) -> None:
+    """
+    Computes the mol files of the CIF file in the background after the current transaction is committed.
+    """
+    transaction.on_commit(lambda: submit(precompute_molfiles, cif_model.pk, cif_model.sha256))
@@ -14,27 +14,27 @@ def is_superuser(user: User):
     return user.is_superuser
 
 
+def _sample_status(measurements, annotation: str, **filters) -> bool:
+    """
+    Reads the status of the sample of the related measurements manager from the annotation of
+    samples_with_status() or asks the database once if the sample was not annotated.
+    """
+    sample = getattr(measurements, 'instance', None)
+    if hasattr(sample, annotation):
+        return getattr(sample, annotation)
+    return measurements.filter(**filters).exists()
+
+
 @register.filter
 def was_refined(measurements) -> bool:
-    if measurements.count() == 0:
-        return False
-    print([x.ciffilemodel.cif_exists for x in measurements])
-    return any([x.ciffilemodel.cif_exists for x in measurements])
+    return _sample_status(measurements, 'has_cif_file', ciffilemodel__file_exists=True)
 
 
 @register.filter
 def was_measured(measurements) -> bool:
-    try:
-        return any([x.was_measured for x in measurements.all()])
-    except Exception as e:
-        print('Error in "was_measured" filter:', e)
-        return False
+    return _sample_status(measurements, 'any_measured', was_measured=True)
 
 
 @register.filter
 def was_deposited(measurements) -> bool:
-    try:
-        return any([x.ciffilemodel.cif_exists for x in measurements.all()])
-    except Exception as e:
-        print('Error in "was_deposited" filter:', e)
-        return False
+    return _sample_status(measurements, 'has_cif_file', ciffilemodel__file_exists=True)
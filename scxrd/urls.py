@@ -5,8 +5,8 @@ from mysite.mysite.views import HomePageView
 from scxrd.views.measurement_views import MeasurementIndexView, MeasurementCreateView, MeasurementFromSampleCreateView, \
     MeasurementEditView, MeasurementListJson, MeasurementsListJsonUser
 from scxrd.views.sample_views import MySamplesList, NewSampleByCustomer, OperatorSamplesList, SampleDeleteView, \
-    OperatorSampleDetail, NewSampleOKView
-from scxrd.views.views import ResidualsTable, MoleculeView
+    OperatorSampleDetail, NewSampleOKView, OperatorSampleListJson
+from scxrd.views.views import ResidualsTable, MoleculeView, MoleculeCacheStats, CellSearchView
 
 app_name = 'scxrd'
 
@@ -15,6 +15,7 @@ urlpatterns = [
     # Samples:
     path('submit/mysamples/', MySamplesList.as_view(), name='my_samples_page'),
     path('operator/allsamples/', OperatorSamplesList.as_view(), name='op_samples_page'),
+    path('operator/samples_list/', OperatorSampleListJson.as_view(), name='op_samples_list'),
     path('sample/submit/', NewSampleByCustomer.as_view(), name='submit_sample'),
     path('sample/submit_ok/', NewSampleOKView.as_view(), name='submit_sample_ok'),
     path('sample/delete/<int:pk>', SampleDeleteView.as_view(), name='delete_sample'),
@@ -30,6 +31,8 @@ urlpatterns = [
     path('measurements_list_user/', MeasurementsListJsonUser.as_view(), name='measurements_list_from_user'),
     # Others
     path('measurements/molecule/', MoleculeView.as_view(), name='molecule'),
+    path('measurements/molecule/cache/', MoleculeCacheStats.as_view(), name='molecule_cache_stats'),
+    path('cells/search/', CellSearchView.as_view(), name='cell_search'),
     path('sample/submit/library.sdf', TemplateView.as_view(template_name="scxrd/ketcher/library.sdf")),
     path('sample/submit/library.svg', TemplateView.as_view(template_name="scxrd/ketcher/library.svg")),
     path('sample/submit/ketcher.svg', TemplateView.as_view(template_name="scxrd/ketcher/ketcher.svg")),
@@ -1,7 +1,7 @@
 import base64
 import hashlib
 import os
-from math import radians, cos, sin, sqrt
+from math import radians, cos, sin, sqrt, isfinite
 
 import gemmi
 from django.core.files import File
@@ -27,6 +27,26 @@ def generate_sha256(file: File):
     return myhash.hexdigest()
 
 
+class HashingFile(File):
+    """
+    Wraps an uploaded file and computes the sha3_256 checksum of its chunks while the storage writes
+    them to disk. This way, the upload is read only once.
+    """
+
+    def __init__(self, file: File):
+        super().__init__(file, name=file.name)
+        self._hash = hashlib.sha3_256()
+
+    def chunks(self, chunk_size=None):
+        self._hash = hashlib.sha3_256()
+        for chunk in self.file.chunks(chunk_size):
+            self._hash.update(chunk)
+            yield chunk
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
 def frac_to_cart(frac_coord, cell):
     """
     Converts fractional coordinates to cartesian coodinates
@@ -59,6 +79,73 @@ def vol_unitcell(a: float, b: float, c: float, al: float, be: float, ga: float):
                             - cos(radians(al)) ** 2 - cos(radians(be)) ** 2 - cos(radians(ga)) ** 2)
 
 
+def metric_determinant(a: float, b: float, c: float, al: float, be: float, ga: float) -> float:
+    """
+    The determinant of the metric tensor, which is the squared cell volume. It is not positive for
+    angles that can not form a cell.
+
+    >>> metric_determinant(2, 2, 2, 90, 90, 90)
+    64.0
+    >>> metric_determinant(10, 10, 10, 170, 170, 170) < 0
+    True
+    """
+    cosa, cosb, cosg = cos(radians(al)), cos(radians(be)), cos(radians(ga))
+    return (a * b * c) ** 2 * (1 + 2 * cosa * cosb * cosg - cosa ** 2 - cosb ** 2 - cosg ** 2)
+
+
+def is_possible_cell(cell: (list, tuple)) -> bool:
+    """
+    True if the six cell parameters span a cell with a finite, positive volume.
+    """
+    try:
+        determinant = metric_determinant(*cell[:6])
+    except (TypeError, ValueError):
+        return False
+    return isfinite(determinant) and determinant > 0
+
+
+def niggli_reduced_cell(cell: (list, tuple), centring: str = 'P') -> (tuple, None):
+    """
+    Returns the Niggli reduced primitive cell and its volume as (a, b, c, alpha, beta, gamma, volume)
+    or None if the cell can not exist.
+    :param cell: a, b, c, alpha, beta, gamma
+    :param centring: The lattice centring: P, A, B, C, I, F or R (hexagonal axes)
+    """
+    if not is_possible_cell(cell):
+        return None
+    a, b, c, alpha, beta, gamma = cell[:6]
+    if centring == 'R' and (alpha == beta == gamma) and alpha != 90:
+        # A rhombohedral cell on rhombohedral axes is already primitive:
+        centring = 'P'
+    if centring not in ('P', 'A', 'B', 'C', 'I', 'F', 'R'):
+        centring = 'P'
+    gruber = gemmi.GruberVector(gemmi.UnitCell(a, b, c, alpha, beta, gamma), centring)
+    gruber.niggli_reduce()
+    reduced = gruber.get_cell()
+    result = (reduced.a, reduced.b, reduced.c, reduced.alpha, reduced.beta, reduced.gamma, reduced.volume)
+    if not all(isfinite(x) for x in result):
+        return None
+    return result
+
+
+def parse_cell(cell: str) -> (list, None):
+    """
+    Returns the six cell parameters from a string like '12.12 13.654 29.374 90 108.5(2) 90' or None.
+    Cells that can not exist are None, too.
+
+    >>> parse_cell('12.12 13.654, 29.374 90 108.5(2) 90')
+    [12.12, 13.654, 29.374, 90.0, 108.5, 90.0]
+    >>> parse_cell('12.12 13.654')
+    >>> parse_cell('10 10 10 170 170 170')
+    """
+    values = [get_float(x) for x in cell.replace(',', ' ').replace(';', ' ').split()]
+    if len(values) != 6 or not all(values) or any(x <= 0 for x in values):
+        return None
+    if any(x >= 180 for x in values[3:]) or not is_possible_cell(values):
+        return None
+    return values
+
+
 COLOUR_CHOICES = (
     (0, '----------'),
     (1, 'colourless'),
@@ -1,28 +1,53 @@
 from datetime import datetime
+from pathlib import Path
 from pprint import pprint
 
-import pytz
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.core.handlers.wsgi import WSGIRequest
-from django.db.models import Q
+from django.db.models import Q, Subquery
 from django.urls import reverse_lazy
+from django.utils.html import escape
 from django.utils import timezone
 from django.utils.timezone import make_naive
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import CreateView, UpdateView, ListView
 from django_datatables_view.base_datatable_view import BaseDatatableView
 
+from scxrd.cell_index import cell_index, np
 from scxrd.cif.cif_file_io import CifContainer
 from scxrd.forms.edit_measurement import MeasurementEditForm
 from scxrd.forms.new_measure_from_sample import MeasurementFromSampleForm
 from scxrd.forms.new_measurement import MeasurementNewForm
 from scxrd.models.cif_model import CifFileModel
-from scxrd.models.measurement_model import Measurement
+from scxrd.models.counter_model import next_measurement_number, peek_next_measurement_number
+from scxrd.models.formula_model import formula_filter, parse_formula_query
+from scxrd.models.measurement_model import Measurement, running_measurements
 from scxrd.models.models import CheckCifModel, ReportModel
+from scxrd.models.reduced_cell_model import search_cells, cif_cell, centring_of
 from scxrd.models.sample_model import Sample
-from scxrd.utils import generate_sha256
+from scxrd.molecule_cache import invalidate_molfiles
+from scxrd.search_index import search_filter
+from scxrd.tasks import enqueue_molfiles
+from scxrd.utils import HashingFile, parse_cell
+
+
+FORMULA_SEARCH_PREFIX = 'formula:'
+
+
+def inform_about_known_cell(request: WSGIRequest, exp: Measurement) -> None:
+    """
+    Informs the operator about other measurements with a similar preliminary unit cell.
+    """
+    cell = parse_cell(exp.prelim_unit_cell or '')
+    if not cell or np is None:
+        return
+    ids = [x['measurement_id'] for x in cell_index.search(cell) if x['measurement_id'] != exp.pk]
+    names = Measurement.objects.filter(pk__in=ids).values_list('measurement_name', flat=True)
+    if names:
+        messages.info(request, _('This unit cell is similar to the measurements: {}').format(
+            ', '.join(sorted(set(names)))))
 
 
 class MeasurementIndexView(LoginRequiredMixin, ListView):
@@ -34,13 +59,7 @@ class MeasurementIndexView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         """Get a list of currently running measurements to the context"""
-        exp: Measurement
-        utc = pytz.UTC
-        mess = []
-        for exp in self.object_list:
-            if exp.end_time > utc.localize(datetime.now()) > exp.measure_date:
-                mess.append(exp)
-        kwargs.update({'current_measures': mess})
+        kwargs.update({'current_measures': running_measurements()})
         return super().get_context_data(**kwargs)
 
 
@@ -64,11 +83,9 @@ class MeasurementCreateView(LoginRequiredMixin, CreateView):
             return self.form_invalid(form)
         self.object: Measurement = form.save(commit=False)
         self.object.operator = self.request.user
-        if Measurement.objects.first():
-            self.object.number = Measurement.objects.first().number + 1
-        else:
-            self.object.number = 1
+        self.object.number = next_measurement_number()
         self.object.save()
+        inform_about_known_cell(self.request, self.object)
         return super().form_valid(form)
 
     def form_invalid(self, form):
@@ -99,14 +116,10 @@ class MeasurementFromSampleCreateView(LoginRequiredMixin, UpdateView):
         """
         initial = super().get_initial()
         pk = self.kwargs.get('pk')
-        try:
-            expnum = Measurement.objects.first().number + 1
-        except AttributeError as e:
-            expnum = 1
         initial.update({
             'measurement_name'     : Sample.objects.get(pk=pk).sample_name,
             'customer'             : Sample.objects.get(pk=pk).customer_samp_id,
-            'number'               : expnum,
+            'number'               : peek_next_measurement_number(),
             'sum_formula'          : Sample.objects.get(pk=pk).sum_formula,
             'submit_date'          : Sample.objects.get(pk=pk).submit_date,
             'exptl_special_details': Sample.objects.get(pk=pk).special_remarks,
@@ -133,10 +146,7 @@ class MeasurementFromSampleCreateView(LoginRequiredMixin, UpdateView):
             # form.instance is Measurement, because of the form class:
             exp: Measurement = form.instance
             # exp.number = form.cleaned_data['number']
-            if Measurement.objects.first():
-                exp.number = Measurement.objects.first().number + 1
-            else:
-                exp.number = 1
+            exp.number = next_measurement_number()
             exp.measurement_name = form.cleaned_data.get('measurement_name')
             exp.exptl_special_details = form.cleaned_data.get('exptl_special_details')
             exp.customer = self.object.customer_samp
@@ -154,6 +164,7 @@ class MeasurementFromSampleCreateView(LoginRequiredMixin, UpdateView):
             exp.sample = self.object
             exp.save()
             messages.success(request, _('Saved successfully.'))
+            inform_about_known_cell(request, exp)
             return self.form_valid(form)
         else:
             print('MeasurementFromSampleCreateView is invalid!')
@@ -241,6 +252,7 @@ class MeasurementEditView(LoginRequiredMixin, UpdateView):
                 messages.warning(request, _('You can only edit your own measurements.'))
                 return self.form_invalid(form)
             if request.POST.get('cif_file_on_disk-clear'):
+                invalidate_molfiles(exp.ciffilemodel.sha256)
                 exp.ciffilemodel.delete()
             if request.POST.get('checkcif_on_disk-clear'):
                 exp.checkcifmodel.delete()
@@ -280,24 +292,39 @@ class MeasurementEditView(LoginRequiredMixin, UpdateView):
 
     def prepare_cif_file_model(self, exp, form):
         if hasattr(exp, 'ciffilemodel'):
+            invalidate_molfiles(exp.ciffilemodel.sha256)
             exp.ciffilemodel.delete()
-        cif_file = form.files['cif_file_on_disk']
+        cif_file = HashingFile(form.files['cif_file_on_disk'])
         cif_model = CifFileModel()
+        # The checksum is calculated while the file is written to the storage. gemmi then reads the stored file:
+        cif_model.cif_file_on_disk.save(cif_file.name, cif_file, save=False)
+        cif_model.sha256 = cif_file.hexdigest()
+        cif_model.filesize = cif_file.size
         try:
-            cif = CifContainer(
-                chunks='\n'.join([x.decode(encoding='cp1250', errors='ignore') for x in cif_file.chunks()]))
+            cif = CifContainer(Path(cif_model.cif_file_on_disk.path), metadata_only=True)
             cif_model.fill_residuals_table(cif)
         except Exception as e:
             print('Error during CIF parsing:', e)
             # TODO: handle bad cif parsing
-        cif_model.cif_file_on_disk = cif_file
-        cif_model.sha256 = generate_sha256(cif_file)
-        cif_model.filesize = cif_file.size
         if not cif_model.date_created:
             cif_model.date_created = timezone.now()
         cif_model.date_updated = timezone.now()
         exp.ciffilemodel = cif_model
         cif_model.save()
+        enqueue_molfiles(cif_model)
+        self.check_known_cell(exp, cif_model)
+
+    def check_known_cell(self, exp: Measurement, cif_model: CifFileModel) -> None:
+        """
+        Informs the operator about other measurements with a similar unit cell.
+        """
+        cell = cif_cell(cif_model)
+        if not cell:
+            return
+        similar = search_cells(cell, centring_of(cif_model)).exclude(measurement=exp)
+        names = sorted({x.measurement.measurement_name for x in similar[:10]})
+        if names:
+            messages.info(self.request, _('Measurements with a similar unit cell: {}').format(', '.join(names)))
 
     def all_files_there(self, form: MeasurementEditForm) -> bool:
         if form.cleaned_data.get('cif_file_on_disk') \
@@ -329,18 +356,73 @@ class MeasurementListJson(LoginRequiredMixin, BaseDatatableView):
     # order is important and should be same as order of columns
     # displayed by datatables. For non sortable columns use empty
     # value like ''
-    order_columns = ['', 'number', 'measurement_name', 'measure_date', 'machine', 'operator', 'publishable',
-                     'cif_file_on_disk', '']
+    order_columns = ['id', 'number', 'measurement_name', 'measure_date', 'machine', 'operator', 'publishable',
+                     'ciffilemodel__cif_file_name', '']
 
     # set max limit of records returned, this is used to protect our site if someone tries to attack our site
     # and make it return huge amount of data
-    max_display_length = 500000
+    max_display_length = 500
+
+    # Pages behind this offset are found by the sort key instead of skipping all previous rows:
+    seek_offset = 1000
+
+    # Order columns with unique values. Only they can be used to seek for a page:
+    unique_order_columns = ('id', 'number', 'measurement_name')
 
     pre_camel_case_notation = False
 
+    def get_initial_queryset(self):
+        return Measurement.objects.select_related('machine', 'operator', 'ciffilemodel').only(
+            'id', 'number', 'measurement_name', 'measure_date', 'publishable',
+            'machine__diffrn_measurement_device_type', 'operator__username', 'ciffilemodel__cif_file_name',
+            'ciffilemodel__file_exists')
+
+    def ordering(self, qs):
+        """
+        Sorts by number after the requested columns, so that the pages are stable.
+        """
+        qs = super().ordering(qs)
+        order = [x for x in qs.query.order_by if x.lstrip('-') in self.unique_order_columns]
+        if not order:
+            qs = qs.order_by(*qs.query.order_by, '-number')
+        return qs
+
+    def paging(self, qs):
+        """
+        Pages after seek_offset start at the sort key of their first row. This key is found in the index
+        of the sort column, so that the database does not have to read all previous rows.
+        """
+        limit = int(self._querydict.get('length', 10))
+        if limit < 0 or limit > self.max_display_length:
+            limit = self.max_display_length
+        start = max(int(self._querydict.get('start', 0)), 0)
+        order = qs.query.order_by
+        if start < self.seek_offset or len(order) != 1 or order[0].lstrip('-') not in self.unique_order_columns:
+            return qs[start:start + limit]
+        column = order[0].lstrip('-')
+        first_key = qs.values_list(column, flat=True)[start:start + 1]
+        lookup = '{}__{}'.format(column, 'lte' if order[0].startswith('-') else 'gte')
+        return qs.filter(**{lookup: Subquery(first_key)})[:limit]
+
     def get_filter_method(self):
         return self.FILTER_ICONTAINS
 
+    def filter_queryset(self, qs):
+        """
+        The search field searches in the full text search index. A search like 'formula: Pd P -Cl C20-30'
+        searches in the formula index instead.
+        """
+        search = self._querydict.get('search[value]', '').strip()
+        if not search:
+            return super().filter_queryset(qs)
+        if not search.lower().startswith(FORMULA_SEARCH_PREFIX):
+            return qs.filter(search_filter(search))
+        try:
+            query = parse_formula_query(search[len(FORMULA_SEARCH_PREFIX):])
+        except ValueError:
+            return qs.none()
+        return qs.filter(formula_filter(**query))
+
     def render_column(self, row, column):
         # We want to render user as a custom column
         if column == 'publishable':
@@ -352,6 +434,12 @@ class MeasurementListJson(LoginRequiredMixin, BaseDatatableView):
             return '<a class="btn-outline-danger m-0 p-1" href="{}">{}</a>'.format(row.get_absolute_url(), _('Edit'))
         if column == 'measure_date':
             return datetime.strftime(make_naive(row.measure_date), '%d.%m.%Y %H:%M')
+        if column == 'ciffilemodel':
+            # The cached name, because str() of the CifFileModel looks for the file on the disk:
+            try:
+                return escape(row.ciffilemodel.cif_file_name) if row.ciffilemodel.file_exists else ''
+            except CifFileModel.DoesNotExist:
+                return ''
         else:
             # no super() of parent method or every value in each row turns into a link:
             # return super(MeasurementListJson, self).render_column(row, column)
@@ -3,13 +3,17 @@ from pprint import pprint
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.core.handlers.wsgi import WSGIRequest
+from django.db.models import Q, QuerySet
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.html import escape
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import CreateView, ListView, DetailView, DeleteView, TemplateView
+from django_datatables_view.base_datatable_view import BaseDatatableView
 
 from scxrd.forms.new_sample import SubmitNewSampleForm
-from scxrd.models.sample_model import Sample
+from scxrd.models.sample_model import Sample, samples_with_status
 from scxrd.utils import randstring
 
 
@@ -78,25 +82,120 @@ class MySamplesList(LoginRequiredMixin, ListView):
     def get_queryset(self):
         super(MySamplesList, self).get_queryset()
         # Filter by samples owned by the current user:
-        return Sample.objects.filter(customer_samp_id=self.request.user)
+        return samples_with_status(Sample.objects.filter(customer_samp_id=self.request.user))
+
+
+def filter_sample_queue(qs: QuerySet, params) -> QuerySet:
+    """
+    Filters samples by the request parameters of the operator queue. Invalid values are ignored.
+    status: open, measured or refined
+    work_group: The id of the work group of the customer
+    submitted_from, submitted_to: Range of the submission date as YYYY-MM-DD
+    """
+    status = params.get('status', '')
+    if status in dict(Sample.STATUS_CHOICES):
+        qs = qs.filter(status=status)
+    work_group = params.get('work_group', '')
+    if work_group.isdigit():
+        qs = qs.filter(customer_samp__profile__work_group_id=int(work_group))
+    for param, lookup in (('submitted_from', 'submit_date__gte'), ('submitted_to', 'submit_date__lte')):
+        try:
+            date = parse_date(params.get(param, ''))
+        except ValueError:
+            date = None
+        if date:
+            qs = qs.filter(**{lookup: date})
+    return qs
 
 
 class OperatorSamplesList(LoginRequiredMixin, ListView):
     """
-    The list of all samples submitted by customers.
+    The list of all samples submitted by customers. It can be filtered like the operator queue,
+    e.g. ?status=open for the samples that await their measurement.
     """
     model = Sample
-    # queryset = Sample.objects.filter(was_measured=False)
     template_name = 'scxrd/submitted_samples_list_operator.html'
     ordering = '-pk'  # oldest should be top
+    paginate_by = 50
+
+    def get_queryset(self):
+        return samples_with_status(filter_sample_queue(super().get_queryset(), self.request.GET)
+                                   .select_related('customer_samp__profile__work_group'))
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        context = super().get_context_data(object_list=object_list, **kwargs)
+        # The filters for the page links:
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        context['filter_params'] = params.urlencode()
+        return context
+
+
+class OperatorSampleListJson(LoginRequiredMixin, BaseDatatableView):
+    """
+    The operator queue of samples for a datatables table. Besides the datatables parameters, the
+    samples can be filtered by the parameters of filter_sample_queue().
+    """
+    model = Sample
+    columns = ['id', 'sample_name', 'submit_date', 'customer_samp', 'work_group', 'status', 'sum_formula',
+               'measure']
+    order_columns = ['id', 'sample_name', 'submit_date', 'customer_samp__last_name',
+                     'customer_samp__profile__work_group__group_head', 'status', 'sum_formula', '']
+    max_display_length = 500
+    pre_camel_case_notation = False
+
+    def get_initial_queryset(self):
+        # The rows need only the annotations of samples_with_status(), not the prefetched measurements:
+        return samples_with_status(
+            Sample.objects.select_related('customer_samp__profile__work_group').only(
+                'id', 'sample_name', 'submit_date', 'status', 'sum_formula', 'customer_samp__username',
+                'customer_samp__first_name', 'customer_samp__last_name', 'customer_samp__profile__work_group')
+        ).prefetch_related(None)
+
+    def ordering(self, qs):
+        """
+        Sorts by id after the requested columns, so that the pages are stable.
+        """
+        qs = super().ordering(qs)
+        if not [x for x in qs.query.order_by if x.lstrip('-') == 'id']:
+            qs = qs.order_by(*qs.query.order_by, '-id')
+        return qs
+
+    def filter_queryset(self, qs):
+        qs = filter_sample_queue(qs, self._querydict)
+        search = self._querydict.get('search[value]', '').strip()
+        for word in search.split():
+            qs = qs.filter(Q(sample_name__icontains=word) | Q(sum_formula__icontains=word)
+                           | Q(customer_samp__username__icontains=word) | Q(customer_samp__last_name__icontains=word))
+        return qs
+
+    def render_column(self, row: Sample, column):
+        if column == 'submit_date':
+            return row.submit_date.strftime('%d.%m.%Y') if row.submit_date else ''
+        if column == 'customer_samp':
+            user = row.customer_samp
+            if not user:
+                return ''
+            if user.first_name and user.last_name:
+                return escape('{} {}'.format(user.first_name, user.last_name))
+            return escape(user.username)
+        if column == 'work_group':
+            try:
+                return escape(str(row.customer_samp.profile.work_group or ''))
+            except AttributeError:
+                # No customer or no profile
+                return ''
+        if column == 'status':
+            badge = {Sample.OPEN: 'badge-warning', Sample.MEASURED: 'badge-primary', Sample.REFINED: 'badge-success'}
+            return '<span class="badge {}">{}</span>'.format(badge[row.status], row.get_status_display())
+        if column == 'measure':
+            # Like on the samples page, the button is only highlighted for samples that were not measured yet:
+            style = 'btn-outline-success' if row.was_measured() else 'btn-success'
+            return '<a class="btn btn-sm {} m-0 p-1" href="{}">{}</a>'.format(
+                style, reverse_lazy('scxrd:new_exp_from_sample', kwargs={'pk': row.pk}), _('Measure Sample'))
+        return super()._render_column(row, column)
 
 
 class OperatorSampleDetail(LoginRequiredMixin, DetailView):
     model = Sample
     template_name = 'scxrd/sample_details_operator.html'
-
-    def get_context_data(self, *, object_list=None, **kwargs):
-        context = super().get_context_data(**kwargs)
-        pk = self.kwargs.get('pk')
-        context['sample'] = Sample.objects.get(pk=pk)
-        return context
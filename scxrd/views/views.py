@@ -1,18 +1,20 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.handlers.wsgi import WSGIRequest
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.views import View
 from django.views.decorators.cache import never_cache
 from django.views.generic import DetailView
 from django_robohash.robotmaker import make_robot_svg
 
+from scxrd.cell_index import cell_index, np
 from scxrd.cif.cif_file_io import CifContainer
-from scxrd.cif.mol_file_writer import MolFile
-from scxrd.cif.sdm import SDM
+from scxrd.cif.mol_file_writer import make_molfile
+from scxrd.molecule_cache import get_molfile, set_molfile, molfile_cache_stats
 from scxrd.models.cif_model import CifFileModel
 from scxrd.models.measurement_model import Measurement
-from scxrd.utils import randstring
+from scxrd.models.reduced_cell_model import search_cells
+from scxrd.utils import randstring, parse_cell, get_float
 
 
 class ResidualsTable(DetailView):
@@ -22,6 +24,11 @@ class ResidualsTable(DetailView):
     model = Measurement
     template_name = 'scxrd/residuals_table.html'
 
+    def get_queryset(self):
+        # Everything in the table comes from the database, no file is opened:
+        return Measurement.objects.select_related('machine', 'operator', 'customer', 'ciffilemodel',
+                                                  'checkcifmodel', 'reportmodel')
+
 
 class MoleculeView(LoginRequiredMixin, View):
     """
@@ -38,10 +45,16 @@ class MoleculeView(LoginRequiredMixin, View):
         if not cif.cif_exists:
             return self.show_robot()
         grow = request.POST.get('grow')
-        cif = CifContainer(cif_path)
-        if cif.atoms_fract:
-            return HttpResponse(self.make_molfile(cif, grow))
-        return HttpResponse('')
+        molfile = get_molfile(cif.sha256, grow == 'true')
+        if molfile is None:
+            # The mol files are precomputed in the background after the CIF upload:
+            molfile = cif.molfile_grown if grow == 'true' else cif.molfile
+            if not molfile.strip():
+                if not cif_path.is_file():
+                    return self.show_robot()
+                molfile = self.make_molfile(CifContainer(cif_path), grow)
+            set_molfile(cif.sha256, grow == 'true', molfile)
+        return HttpResponse(molfile)
 
     def show_robot(self):
         # Show a robot where no cif is found:
@@ -55,25 +68,56 @@ class MoleculeView(LoginRequiredMixin, View):
         :param grow: wheather to grow or not
         :return: molfile string
         """
-        molfile = ' '
-        if grow == 'true':
-            sdm = SDM(list(cif.atoms_fract), cif.symmops, cif.cell[:6], centric=cif.is_centrosymm)
-            try:
-                needsymm = sdm.calc_sdm()
-                atoms = sdm.packer(sdm, needsymm)
-            except Exception as e:
-                print('Error in SDM:', e)
-                return molfile
-        else:
-            atoms = cif.atoms_orth
-        try:
-            molfile = MolFile(atoms)
-            molfile = molfile.make_mol()
-        except (TypeError, KeyError):
-            print("Error while writing mol file.")
-        return molfile
+        return make_molfile(cif, grow == 'true')
 
     # always reload complete molecule:
     @never_cache
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
+
+
+class MoleculeCacheStats(LoginRequiredMixin, View):
+    """
+    The hits and misses of the mol file cache as json.
+    """
+
+    def get(self, request: WSGIRequest, *args, **kwargs):
+        return JsonResponse(molfile_cache_stats())
+
+
+class CellSearchView(LoginRequiredMixin, View):
+    """
+    Searches measurements with a similar reduced unit cell, e.g.:
+    ?cell=10.5 20.9 20.5 90 94.1 90&centring=P&length=1.5&angle=1.5
+    With &ranked=1, the results come from the in-memory cell index and are ranked by their similarity.
+    """
+
+    def get(self, request: WSGIRequest, *args, **kwargs):
+        cell = parse_cell(request.GET.get('cell', ''))
+        if not cell:
+            return JsonResponse({'error': 'A cell needs six numbers: a b c alpha beta gamma'}, status=400)
+        length = get_float(request.GET.get('length', '')) or 1.5
+        angle = get_float(request.GET.get('angle', '')) or 1.5
+        centring = request.GET.get('centring', 'P').upper()[:1] or 'P'
+        if request.GET.get('ranked') and np is not None:
+            return JsonResponse({'results': self.ranked_results(cell, centring)})
+        cells = search_cells(cell, centring, length_percent=length, angle_degree=angle).order_by('volume')[:100]
+        return JsonResponse({'results': [{'measurement': x.measurement.measurement_name,
+                                          'number'     : x.measurement.number,
+                                          'source'     : x.source,
+                                          'cell'       : [x.a, x.b, x.c, x.alpha, x.beta, x.gamma],
+                                          'volume'     : x.volume} for x in cells]})
+
+    @staticmethod
+    def ranked_results(cell: list, centring: str) -> list:
+        """
+        The most similar cells from the in-memory cell index, the most similar first.
+        """
+        results = cell_index.search(cell, centring)
+        measurements = Measurement.objects.only('measurement_name', 'number').in_bulk(
+            [x['measurement_id'] for x in results])
+        for result in results:
+            measurement = measurements.get(result['measurement_id'])
+            result['measurement'] = measurement.measurement_name if measurement else ''
+            result['number'] = measurement.number if measurement else None
+        return results
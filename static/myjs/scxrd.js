@@ -47,7 +47,9 @@ $(document).ready(function () {
         //"DisplayLength": 10000,
         "scrollY": "350px",     // This defines the height of the table!
         "scrollCollapse": true,
-        "paging": false,
+        "paging": true,  // the server sends only the rows of the current page
+        "pageLength": 100,
+        "lengthMenu": [50, 100, 500],
         "order": [[1, "desc"]],
         columns: [
             {  // title and name are important, otherwise the server-side processing does not work.
@@ -0,0 +1,161 @@
+"""
+Benchmarks for the slow parts of messlog. They are not run with the normal tests, run them with:
+
+python manage.py test tests.benchmarks
+"""
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from scxrd.cell_index import CellIndex
+from scxrd.cif.cif_file_io import CifContainer
+from scxrd.cif.sdm import SDM
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.reduced_cell_model import ReducedCell, search_cells
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.models import Machine
+from scxrd.utils import niggli_reduced_cell
+from scxrd.views.measurement_views import MeasurementListJson
+
+
+def make_polymer_structure(chain_length: int = 500, chains: int = 4, seed: int = 42):
+    """
+    A synthetic P1 structure with infinite carbon chains along a. The atoms are shuffled, so that the
+    order of the atoms has nothing to do with their position in the chain.
+    :return: atoms, symmops, cell
+    """
+    bond = 1.54
+    cell = [bond * chain_length, 6.0 * chains, 6.0, 90.0, 90.0, 90.0]
+    atoms = []
+    for chain in range(chains):
+        for num in range(chain_length):
+            zigzag = 0.05 if num % 2 else 0.0
+            atoms.append(['C{}_{}'.format(num, chain), 'C', num / chain_length,
+                          (chain + 0.5) / chains, 0.5 + zigzag, 0, 1.0, 0.02])
+    random.Random(seed).shuffle(atoms)
+    return atoms, ['x, y, z'], cell
+
+
+class BenchmarkSDM(SimpleTestCase):
+
+    def test_molindex_polymer(self):
+        atoms, symmops, cell = make_polymer_structure(chain_length=1000, chains=4)
+        sdm = SDM(atoms, symmops, cell)
+        t1 = time.perf_counter()
+        sdm.calc_sdm()
+        t2 = time.perf_counter()
+        for at in sdm.atoms:
+            del at[-1]
+        sdm.calc_molindex(list(sdm.atoms))
+        t3 = time.perf_counter()
+        print('\nSDM of {} atoms: {:.3f} s, fragments: {:.3f} s'.format(len(atoms), t2 - t1, t3 - t2))
+        self.assertEqual(4, sdm.maxmol)
+
+
+class _NoMemo(dict):
+    """
+    A memo dictionary that forgets everything, like CifContainer before the memoization.
+    """
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class BenchmarkCifContainer(SimpleTestCase):
+
+    def test_get_keys(self):
+        cif_text = Path('scxrd/testfiles/p21c.cif').read_text()
+        # Many additional keys like in cif files with a lot of author and publication data:
+        extra_keys = ''.join('_benchmark_key_{} value{}\n'.format(num, num) for num in range(5000))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cif_file = Path(tmpdir, 'large.cif')
+            cif_file.write_text(cif_text.replace('_chemical_name_systematic', extra_keys + '_chemical_name_systematic'))
+            cif = CifContainer(cif_file)
+            t1 = time.perf_counter()
+            keys = cif.get_keys()
+            t2 = time.perf_counter()
+            cif._memo = _NoMemo()
+            self.assertEqual(keys, cif.get_keys())
+            t3 = time.perf_counter()
+        print('\nget_keys with memo: {:.3f} s, without: {:.3f} s'.format(t2 - t1, t3 - t2))
+
+
+def make_random_cells(number: int, seed: int = 42) -> list:
+    """
+    Random unit cells with a, b, c, alpha, beta, gamma.
+    """
+    rand = random.Random(seed)
+    cells = []
+    for _ in range(number):
+        cells.append([rand.uniform(5, 30), rand.uniform(5, 30), rand.uniform(5, 30), 90.0, rand.uniform(90, 120),
+                      90.0])
+    return cells
+
+
+class BenchmarkCellSearch(TestCase):
+
+    def test_search_50k_cells(self):
+        cells = make_random_cells(50000)
+        now = timezone.now()
+        Measurement.objects.bulk_create([Measurement(measurement_name='bench_{}'.format(num), number=num + 1,
+                                                     end_time=now) for num in range(len(cells))], batch_size=2000)
+        reduced = []
+        for measurement_id, cell in zip(Measurement.objects.order_by('number').values_list('pk', flat=True), cells):
+            a, b, c, alpha, beta, gamma, volume = niggli_reduced_cell(cell)
+            reduced.append(ReducedCell(measurement_id=measurement_id, source=ReducedCell.PRELIM, a=a, b=b, c=c,
+                                       alpha=alpha, beta=beta, gamma=gamma, volume=volume))
+        ReducedCell.objects.bulk_create(reduced, batch_size=2000)
+        t1 = time.perf_counter()
+        for cell in cells[:100]:
+            self.assertGreaterEqual(len(search_cells(cell)), 1)
+        t2 = time.perf_counter()
+        index = CellIndex()
+        index.reload()
+        t3 = time.perf_counter()
+        for cell in cells[:100]:
+            self.assertGreaterEqual(len(index.search(cell)), 1)
+        t4 = time.perf_counter()
+        print('\nCell search in {} cells: {:.1f} ms per search, cell index: {:.2f} ms per search'.format(
+            len(cells), (t2 - t1) * 10, (t4 - t3) * 10))
+
+
+def make_measurements(number: int, with_cif_every: int = 2) -> None:
+    """
+    Creates measurements with a machine and an operator. Every with_cif_every measurement has a CIF file.
+    """
+    now = timezone.now()
+    machine = Machine.objects.create(diffrn_measurement_device_type='APEXII')
+    operator = User.objects.create_user(username='benchmark', password='Test1234!')
+    Measurement.objects.bulk_create([Measurement(measurement_name='bench_{}'.format(num), number=num + 1,
+                                                 measure_date=now, end_time=now, machine=machine, operator=operator)
+                                     for num in range(number)], batch_size=2000)
+    measurements = Measurement.objects.values_list('pk', 'number')
+    CifFileModel.objects.bulk_create([CifFileModel(measurement_id=pk, cif_file_name='bench_{}.cif'.format(num),
+                                                   cif_file_on_disk='cifs/bench_{}.cif'.format(num))
+                                      for pk, num in measurements if num % with_cif_every == 0], batch_size=2000)
+
+
+class BenchmarkMeasurementList(TestCase):
+
+    def test_list_100k_measurements(self):
+        make_measurements(100000)
+        self.client.force_login(User.objects.get(username='benchmark'))
+        url = reverse('scxrd:measurements_list')
+        page = {'length': 100, 'order[0][column]': 1, 'order[0][dir]': 'desc'}
+        for start in (0, 50000, 99900):
+            t1 = time.perf_counter()
+            rows = self.client.post(url, data=dict(page, start=start)).json()['data']
+            t2 = time.perf_counter()
+            with mock.patch.object(MeasurementListJson, 'seek_offset', 10 ** 9):
+                self.assertEqual(rows, self.client.post(url, data=dict(page, start=start)).json()['data'])
+            t3 = time.perf_counter()
+            print('\nMeasurement list of 100000 rows at row {}: {:.1f} ms with seek, {:.1f} ms with offset'.format(
+                start, (t2 - t1) * 1000, (t3 - t2) * 1000))
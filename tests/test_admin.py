@@ -0,0 +1,63 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.models import Machine, WorkGroup, CrystalGlue, CrystalSupport
+from scxrd.models.sample_model import Sample
+from tests.tests import SuperUserMixin
+
+
+class TestAdminQueries(SuperUserMixin, TestCase):
+    """
+    The changelists of the admin need the same number of queries for few and for many rows.
+    """
+    changelists = ['workgroup', 'measurement', 'machine', 'user', 'sample', 'ciffilemodel', 'crystalglue',
+                   'crystalsupport']
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.add_rows(0, 1)
+
+    def add_rows(self, start: int, count: int) -> None:
+        for num in range(start, start + count):
+            WorkGroup.objects.create(group_head='group_{}'.format(num))
+            machine = Machine.objects.create(diffrn_measurement_device_type='machine_{}'.format(num))
+            glue = CrystalGlue.objects.create(glue='glue_{}'.format(num))
+            support = CrystalSupport.objects.create(support='support_{}'.format(num))
+            sample = Sample.objects.create(sample_name='sample_{}'.format(num), customer_samp=self.user,
+                                           stable=False, solve_refine_selve=False)
+            exp = Measurement.objects.create(measurement_name='admin_{}'.format(num), number=num + 1,
+                                             end_time=timezone.now(), machine=machine, operator=self.user,
+                                             customer=self.user, glue=glue, base=support, sample=sample)
+            CifFileModel.objects.create(measurement=exp, cif_file_on_disk='cifs/admin_{}.cif'.format(num))
+
+    def count_queries(self) -> dict:
+        queries = {}
+        for model in self.changelists:
+            app = 'auth' if model == 'user' else 'scxrd'
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('admin:{}_{}_changelist'.format(app, model)))
+            self.assertEqual(200, response.status_code)
+            queries[model] = len(context)
+        return queries
+
+    def test_queries_independent_of_rows(self):
+        few_rows = self.count_queries()
+        self.add_rows(1, 10)
+        self.assertEqual(few_rows, self.count_queries())
+
+    def test_work_group_statistics(self):
+        response = self.client.get(reverse('admin:scxrd_workgroup_changelist'))
+        group = response.context_data['cl'].result_list.get(group_head='Blümchen')
+        self.assertEqual(1, group._members)
+        self.assertEqual(1, group._measurements_this_year)
+        response = self.client.get(reverse('admin:scxrd_machine_changelist'))
+        machine = response.context_data['cl'].result_list.get(diffrn_measurement_device_type='machine_0')
+        self.assertEqual((1, 0, 1), (machine._measurements, machine._measurements_last_year,
+                                     machine._measurements_this_year))
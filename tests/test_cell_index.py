@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.test import TransactionTestCase
+
+from scxrd.cell_index import CellIndex, cell_index, metric_tensor
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.reduced_cell_model import ReducedCell
+from tests.test_reduced_cell import create_measurement
+
+
+class TestCellIndex(TransactionTestCase):
+    """
+    The index follows the ReducedCell table after the transaction is committed, therefore these
+    are TransactionTestCases.
+    """
+
+    def setUp(self) -> None:
+        cell_index.reload()
+
+    def test_metric_tensor(self):
+        self.assertEqual([100.0, 400.0, 900.0], metric_tensor(10, 20, 30, 90, 90, 90)[:3])
+        self.assertAlmostEqual(0.0, metric_tensor(10, 20, 30, 90, 90, 90)[4])
+        self.assertAlmostEqual(200.0, metric_tensor(10, 20, 30, 90, 90, 60)[5])
+
+    def test_ranking(self):
+        create_measurement(1, '10.6 20.95 20.45 90 94.5 90')
+        create_measurement(2, '10.5086 20.9035 20.5072 90 94.13 90')
+        # The same cell in another setting:
+        create_measurement(3, '20.5072 20.9035 10.5086 90 94.13 90')
+        create_measurement(4, '11.5 20.9 20.5 90 94.1 90')
+        results = cell_index.search([10.5086, 20.9035, 20.5072, 90, 94.13, 90])
+        self.assertEqual(3, len(results))
+        names = [Measurement.objects.get(pk=x['measurement_id']).measurement_name for x in results]
+        self.assertEqual(['cell_2', 'cell_3', 'cell_1'], names)
+        self.assertEqual([0.0, 0.0], [round(x['distance'], 6) for x in results[:2]])
+        self.assertLess(0.001, results[2]['distance'])
+        self.assertEqual(1, len(cell_index.search([10.5086, 20.9035, 20.5072, 90, 94.13, 90], limit=1)))
+
+    def test_incremental_update(self):
+        self.assertEqual(0, len(cell_index))
+        exp = create_measurement(1, '10.5 20.9 20.5 90 94.1 90')
+        self.assertEqual(1, len(cell_index))
+        exp.prelim_unit_cell = '5 6 7 90 90 90'
+        exp.save()
+        self.assertEqual(1, len(cell_index))
+        self.assertEqual([], cell_index.search([10.5, 20.9, 20.5, 90, 94.1, 90]))
+        self.assertEqual([5.0, 6.0, 7.0, 90.0, 90.0, 90.0], cell_index.search([7, 6, 5, 90, 90, 90])[0]['cell'])
+        CifFileModel.objects.create(measurement=exp, cell_length_a=10, cell_length_b=10, cell_length_c=10,
+                                    cell_angle_alpha=90, cell_angle_beta=90, cell_angle_gamma=90,
+                                    space_group_name_H_M_alt='F m -3 m')
+        self.assertEqual(2, len(cell_index))
+        # The primitive cell of the F centred cubic cell:
+        result = cell_index.search([7.0711, 7.0711, 7.0711, 60, 60, 60])
+        self.assertEqual([(exp.pk, ReducedCell.CIF)], [(x['measurement_id'], x['source']) for x in result])
+        self.assertEqual(exp.pk, cell_index.search([10, 10, 10, 90, 90, 90], centring='F')[0]['measurement_id'])
+        exp.delete()
+        self.assertEqual(0, len(cell_index))
+
+    def test_same_as_reload(self):
+        for num in range(1, 20):
+            create_measurement(num, '{} 20.9 {} 90 94.1 90'.format(10 + num / 10, 20.5 - num / 20))
+        index = CellIndex()
+        index.reload()
+        self.assertEqual(index._keys, cell_index._keys)
+        self.assertEqual(index._tensors.tolist(), cell_index._tensors.tolist())
+
+    def test_cells_of_other_processes(self):
+        exp = create_measurement(1, '10.5 20.9 20.5 90 94.1 90')
+        self.assertEqual(1, len(cell_index.search([10.5, 20.9, 20.5, 90, 94.1, 90])))
+        # Written without the signals of this process, like by reindex_cifs in another process:
+        ReducedCell.objects.bulk_create([ReducedCell(measurement=exp, source=ReducedCell.CIF, a=5, b=6, c=7,
+                                                     alpha=90, beta=90, gamma=90, volume=210)])
+        self.assertEqual(exp.pk, cell_index.search([5, 6, 7, 90, 90, 90])[0]['measurement_id'])
+        # Changed cells are only found after max_age, if it is set:
+        ReducedCell.objects.filter(source=ReducedCell.CIF).update(a=4, volume=168)
+        self.assertEqual(1, len(cell_index.search([5, 6, 7, 90, 90, 90])))
+        cell_index.max_age = 0
+        try:
+            self.assertEqual([], cell_index.search([5, 6, 7, 90, 90, 90]))
+            self.assertEqual(1, len(cell_index.search([4, 6, 7, 90, 90, 90])))
+        finally:
+            cell_index.max_age = None
+
+    def test_no_reload_after_own_changes(self):
+        exp = create_measurement(1, '10.5 20.9 20.5 90 94.1 90')
+        cell_index.search([10.5, 20.9, 20.5, 90, 94.1, 90])
+        with mock.patch.object(cell_index, 'reload', wraps=cell_index.reload) as reload:
+            last = create_measurement(2, '5 6 7 90 90 90')
+            self.assertEqual(1, len(cell_index.search([5, 6, 7, 90, 90, 90])))
+            exp.prelim_unit_cell = '11.5 20.9 20.5 90 94.1 90'
+            exp.save()
+            self.assertEqual(1, len(cell_index.search([11.5, 20.9, 20.5, 90, 94.1, 90])))
+            exp.delete()
+            self.assertEqual(1, len(cell_index.search([5, 6, 7, 90, 90, 90])))
+            # The cell with the highest id:
+            last.delete()
+            self.assertEqual([], cell_index.search([5, 6, 7, 90, 90, 90]))
+            reload.assert_not_called()
@@ -0,0 +1,114 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from scxrd.cif.cif_file_io import CifContainer
+
+p21c = Path('scxrd/testfiles/p21c.cif')
+
+
+class TestMetadataOnly(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.cif = CifContainer(p21c)
+        self.meta = CifContainer(p21c, metadata_only=True)
+
+    def test_large_values_are_deferred(self):
+        self.assertEqual({'_shelx_hkl_file', '_shelx_res_file'}, self.meta._deferred)
+        self.assertIn('_shelx_hkl_file ?', self.meta.doc.as_string())
+        self.assertLess(len(self.meta.doc.as_string()), len(self.cif.doc.as_string()) / 10)
+        self.assertIsNone(self.meta._full_cif)
+
+    def test_same_values(self):
+        keys = [item.pair[0] for item in self.cif.block if item.pair]
+        for key in keys:
+            self.assertEqual(self.cif[key], self.meta[key], msg=key)
+        self.assertEqual(self.cif.cell, self.meta.cell)
+        self.assertEqual(self.cif.space_group, self.meta.space_group)
+        self.assertEqual(self.cif.natoms(), self.meta.natoms())
+
+    def test_large_values_on_access(self):
+        self.assertEqual(self.cif.resdata, self.meta.resdata)
+        self.assertEqual(self.cif.hkl_checksum_calcd, self.meta.hkl_checksum_calcd)
+        self.assertIsNotNone(self.meta._full_cif)
+
+    def test_lazy_structure(self):
+        self.assertEqual(10.5086, self.meta.cell[0])
+        self.assertNotIn('atomic_struct', self.meta._memo)
+        self.assertEqual(len(list(self.cif.atoms_fract)), len(list(self.meta.atoms_fract)))
+
+    def test_no_save(self):
+        with self.assertRaises(ValueError):
+            self.meta.save(tempfile.mktemp(suffix='.cif'))
+
+    def test_value_without_text_field(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cif_file = Path(tmpdir, 'test.cif')
+            cif_file.write_text("data_test\n_shelx_res_file\n'TITL foo'\n_cell_length_a 10.0\n"
+                                "_shelx_hkl_file\n;\n   1   0   0   12.3   1.2\n;\n_cell_length_b 11.0\n")
+            cif = CifContainer(cif_file, metadata_only=True)
+            self.assertEqual({'_shelx_hkl_file'}, cif._deferred)
+            self.assertEqual('TITL foo', cif['_shelx_res_file'])
+            self.assertEqual('10.0', cif['_cell_length_a'])
+            self.assertEqual('11.0', cif['_cell_length_b'])
+            self.assertEqual(';\n   1   0   0   12.3   1.2\n;', cif._large_value('_shelx_hkl_file'))
+
+
+class TestMemoized(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.cif = CifContainer(p21c)
+
+    def test_memoized(self):
+        self.assertEqual('P 1 21/c 1', self.cif.space_group)
+        self.assertIn('space_group', self.cif._memo)
+        self.assertIs(self.cif._spgr(), self.cif._spgr())
+        self.assertTrue(self.cif.is_centrosymm)
+        self.assertEqual('monoclinic', self.cif.crystal_system)
+
+    def test_invalidate_add_to_cif(self):
+        self.assertEqual(10.5086, self.cif.cell[0])
+        self.cif.add_to_cif('_cell_length_a', '12.0')
+        self.assertEqual(12.0, self.cif.cell[0])
+
+    def test_invalidate_delitem(self):
+        self.assertEqual(4, len(self.cif.symmops))
+        del self.cif['_space_group_name_H-M_alt']
+        self.assertEqual({}, self.cif._memo)
+
+    def test_invalidate_rename(self):
+        self.assertTrue(self.cif.is_centrosymm)
+        self.cif.rename_data_name('foo')
+        self.assertEqual({}, self.cif._memo)
+
+
+class TestTables(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.cif = CifContainer(p21c)
+
+    def test_atoms_table(self):
+        atoms = self.cif.atoms_table()
+        self.assertEqual(['O1_6', 'C1_6', 'C2_6'], list(atoms['label'][:3]))
+        self.assertEqual([0.08, 0.0299, -0.1032], list(atoms['x'][:3]))
+        self.assertEqual('int64', str(atoms['part'].dtype))
+        self.assertEqual(24, atoms['hydrogen'].sum())
+        without_h = self.cif.atoms_table(without_h=True)
+        self.assertEqual(104, len(without_h['label']))
+        self.assertFalse(without_h['hydrogen'].any())
+
+    def test_geometry_tables(self):
+        self.assertEqual(len(list(self.cif.bonds(without_H=True))), len(self.cif.bonds_table(without_h=True)['dist']))
+        self.assertEqual(len(list(self.cif.angles(without_H=True))),
+                         len(self.cif.angles_table(without_h=True)['angle']))
+        torsions = self.cif.torsion_angles_table()
+        self.assertEqual(226, len(torsions['torsang']))
+        self.assertEqual(0, len(self.cif.hydrogen_bonds_table()['label_d']))
+
+    def test_counts(self):
+        for without_h in (False, True):
+            self.assertEqual(len(list(self.cif.atoms(without_h))), self.cif.natoms(without_h))
+            self.assertEqual(len(list(self.cif.bonds(without_h))), self.cif.nbonds(without_h))
+            self.assertEqual(len(list(self.cif.angles(without_h))), self.cif.nangles(without_h))
+            self.assertEqual(len(list(self.cif.torsion_angles(without_h))), self.cif.ntorsion_angles(without_h))
@@ -0,0 +1,117 @@
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.models import CheckCifModel, check_unchecked_files
+from tests.tests import MEDIA_ROOT, DeleteFilesMixin
+
+
+def create_cif_model(number: int) -> CifFileModel:
+    exp = Measurement.objects.create(measurement_name='test_{}'.format(number), number=number,
+                                     end_time=timezone.now())
+    cif_file = SimpleUploadedFile('p21c.cif', Path('scxrd/testfiles/p21c.cif').read_bytes())
+    cif_model = CifFileModel(measurement=exp, cif_file_on_disk=cif_file, sha256='sha{}'.format(number),
+                             date_updated=timezone.now())
+    cif_model.save()
+    return cif_model
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestReindexCifs(DeleteFilesMixin, TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.cif_models = [create_cif_model(num) for num in (1, 2, 3)]
+        self.state_file = Path(tempfile.mkdtemp(), 'state')
+
+    def reindex(self, **options) -> str:
+        out = StringIO()
+        call_command('reindex_cifs', workers=1, state_file=str(self.state_file), stdout=out, stderr=StringIO(),
+                     **options)
+        return out.getvalue()
+
+    def test_reindex(self):
+        out = self.reindex()
+        self.assertIn('3 files in', out)
+        self.assertIn('3 changed, 0 failed', out)
+        self.assertIn('files/s', out)
+        cif_model = CifFileModel.objects.get(pk=self.cif_models[0].pk)
+        self.assertEqual(10.5086, cif_model.cell_length_a)
+        self.assertEqual('P 1 21/c 1', cif_model.space_group_name_H_M_alt)
+        self.assertFalse(self.state_file.exists())
+        # Nothing changes in the second run:
+        self.assertIn('0 changed', self.reindex())
+
+    def test_dry_run(self):
+        self.assertIn('3 would change', self.reindex(dry_run=True))
+        self.assertIsNone(CifFileModel.objects.get(pk=self.cif_models[0].pk).cell_length_a)
+
+    def test_resume(self):
+        self.state_file.write_text('sha1\nsha2\n')
+        out = self.reindex()
+        self.assertIn('Resuming, 2 files were already finished.', out)
+        self.assertIn('1 files in', out)
+        self.assertIsNone(CifFileModel.objects.get(pk=self.cif_models[0].pk).cell_length_a)
+        self.assertEqual(10.5086, CifFileModel.objects.get(pk=self.cif_models[2].pk).cell_length_a)
+
+    def test_since(self):
+        CifFileModel.objects.filter(pk=self.cif_models[0].pk).update(
+            date_updated=timezone.now() - timezone.timedelta(days=10))
+        since = (timezone.now() - timezone.timedelta(days=1)).date().isoformat()
+        self.assertIn('2 files in', self.reindex(since=since))
+
+    def test_process_pool(self):
+        out = StringIO()
+        call_command('reindex_cifs', workers=2, state_file=str(self.state_file), stdout=out)
+        self.assertIn('3 changed', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestReconcileFiles(DeleteFilesMixin, TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.cif_model = create_cif_model(1)
+        self.checkcif = CheckCifModel.objects.create(measurement=self.cif_model.measurement,
+                                                     checkcif_on_disk=SimpleUploadedFile('checkcif.pdf', b'%PDF'))
+
+    def test_metadata_on_save(self):
+        self.assertTrue(self.cif_model.cif_exists)
+        self.assertEqual(Path('scxrd/testfiles/p21c.cif').stat().st_size, self.cif_model.filesize)
+        self.assertIsNotNone(self.cif_model.file_mtime)
+        self.assertTrue(self.checkcif.chkcif_exists)
+        self.assertEqual(4, self.checkcif.file_size)
+        self.assertEqual('checkcif.pdf', self.checkcif.chkcif_name_only)
+
+    def test_reconcile(self):
+        self.cif_model.cif_file_path.unlink()
+        # Nothing looks at the disk until the files are reconciled:
+        self.assertTrue(CifFileModel.objects.get(pk=self.cif_model.pk).cif_exists)
+        out = StringIO()
+        call_command('reconcile_files', stdout=out)
+        self.assertIn('CIF files: 1 checked, 1 changed, 1 missing.', out.getvalue())
+        self.assertIn('check cif models: 1 checked, 0 changed, 0 missing.', out.getvalue())
+        cif_model = CifFileModel.objects.get(pk=self.cif_model.pk)
+        self.assertFalse(cif_model.cif_exists)
+        self.assertEqual('# No CIf file #', str(cif_model))
+        self.assertIsNone(cif_model.filesize)
+
+    def test_unchecked_files_after_migrate(self):
+        # Rows from before the file_exists field was added:
+        CifFileModel.objects.update(file_exists=None, filesize=None)
+        self.assertFalse(CifFileModel.objects.get(pk=self.cif_model.pk).cif_exists)
+        check_unchecked_files()
+        cif_model = CifFileModel.objects.get(pk=self.cif_model.pk)
+        self.assertTrue(cif_model.cif_exists)
+        self.assertEqual(Path('scxrd/testfiles/p21c.cif').stat().st_size, cif_model.filesize)
+        out = StringIO()
+        call_command('reconcile_files', '--unchecked', stdout=out)
+        self.assertIn('CIF files: 0 checked, 0 changed, 0 missing.', out.getvalue())
+
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from scxrd.models.counter_model import next_measurement_number, peek_next_measurement_number
+from scxrd.models.measurement_model import Measurement
+
+
+class TestCounter(TestCase):
+
+    def test_numbers(self):
+        self.assertEqual(1, peek_next_measurement_number())
+        self.assertEqual([1, 2, 3], [next_measurement_number() for _ in range(3)])
+        self.assertEqual(4, peek_next_measurement_number())
+
+    def test_above_highest_number(self):
+        Measurement.objects.create(measurement_name='manual', number=41, end_time=timezone.now())
+        self.assertEqual(42, peek_next_measurement_number())
+        self.assertEqual(42, next_measurement_number())
+        self.assertEqual(43, next_measurement_number())
+
+    def test_one_query(self):
+        next_measurement_number()
+        with self.assertNumQueries(1):
+            next_measurement_number()
+
+
+class TestConcurrentCounter(TransactionTestCase):
+    """
+    Creates measurements from several threads at once. An in-memory SQLite database can not be written
+    from several connections at once, therefore the SQLite test database is a file (see settings.py).
+    """
+
+    def setUp(self) -> None:
+        self.assertFalse(connection.vendor == 'sqlite' and connection.is_in_memory_db(),
+                         'Concurrent writes need a database file.')
+
+    def create_measurements(self, thread: int) -> list:
+        numbers = []
+        try:
+            for num in range(10):
+                number = next_measurement_number()
+                Measurement.objects.create(measurement_name='thread{}_{}'.format(thread, num), number=number,
+                                           end_time=timezone.now())
+                numbers.append(number)
+        finally:
+            connection.close()
+        return numbers
+
+    def test_concurrent_inserts(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            numbers = [n for result in executor.map(self.create_measurements, range(8)) for n in result]
+        self.assertEqual(list(range(1, 81)), sorted(numbers))
+        self.assertEqual(80, Measurement.objects.count())
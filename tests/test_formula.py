@@ -0,0 +1,112 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.formula_model import FormulaElement, formula_filter, parse_formula_query
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.sample_model import Sample
+
+
+def create_measurement(number: int, sum_formula: str) -> Measurement:
+    return Measurement.objects.create(measurement_name='formula_{}'.format(number), number=number,
+                                      end_time=timezone.now(), sum_formula=sum_formula)
+
+
+def names(formula_query: str) -> list:
+    query = formula_filter(**parse_formula_query(formula_query))
+    return sorted(Measurement.objects.filter(query).values_list('measurement_name', flat=True))
+
+
+class TestFormulaIndex(TestCase):
+
+    def setUp(self) -> None:
+        create_measurement(1, 'C24 H20 Cl2 P2 Pd')
+        create_measurement(2, 'C36H30P2Pd')
+        create_measurement(3, 'C18 H15 P')
+        create_measurement(4, '')
+
+    def test_index_on_save(self):
+        exp = Measurement.objects.get(number=3)
+        self.assertEqual({'C': 18.0, 'H': 15.0, 'P': 1.0},
+                         dict(exp.formula_elements.values_list('element', 'count')))
+        exp.sum_formula = 'C18 H15 O P'
+        exp.save()
+        self.assertEqual(4, exp.formula_elements.count())
+        self.assertEqual(0, Measurement.objects.get(number=4).formula_elements.count())
+
+    def test_queries(self):
+        self.assertEqual(['formula_1', 'formula_2'], names('Pd P'))
+        self.assertEqual(['formula_2'], names('Pd P -Cl'))
+        self.assertEqual(['formula_1', 'formula_3'], names('C10-30'))
+        self.assertEqual(['formula_3'], names('C18 -Pd'))
+        self.assertEqual(['formula_1', 'formula_2'], names('C20-'))
+        self.assertEqual(['formula_2', 'formula_3'], names('-Cl'))
+        with self.assertRaises(ValueError):
+            parse_formula_query('Xy')
+
+    def test_cif_formula(self):
+        exp = Measurement.objects.get(number=4)
+        cif_model = CifFileModel.objects.create(measurement=exp, chemical_formula_sum='C6 H6 Fe')
+        self.assertEqual(['formula_4'], names('Fe'))
+        cif_model.delete()
+        self.assertEqual([], names('Fe'))
+
+    def test_same_source(self):
+        exp = Measurement.objects.get(number=3)
+        CifFileModel.objects.create(measurement=exp, chemical_formula_sum='C6 H6 Fe')
+        self.assertEqual(['formula_3'], names('C6 Fe'))
+        self.assertEqual(['formula_3'], names('C18 P'))
+        # P is only in the empirical formula and Fe only in the CIF file:
+        self.assertEqual([], names('P Fe'))
+        self.assertEqual([], names('C18 Fe'))
+        # Either formula has to match all conditions:
+        self.assertEqual(['formula_3'], names('Fe -P'))
+        self.assertEqual(['formula_3'], names('C18 -Fe'))
+
+    def test_sample_formula(self):
+        sample = Sample.objects.create(sample_name='sample1', stable=False, solve_refine_selve=False,
+                                       sum_formula='C2 H6 O')
+        query = formula_filter(contains=['O'], ranges={'C': (1, 2)}, owner='sample')
+        self.assertEqual([sample], list(Sample.objects.filter(query)))
+
+    def test_backfill(self):
+        FormulaElement.objects.all().delete()
+        call_command('index_formulas', stdout=StringIO())
+        self.assertEqual(['formula_2'], names('Pd P -Cl'))
+        self.assertEqual(5 + 4 + 3, FormulaElement.objects.count())
+
+
+class TestFormulaQueryPlan(TestCase):
+    """
+    The formula search has to use the index instead of a subquery for every measurement.
+    """
+
+    def setUp(self) -> None:
+        Measurement.objects.bulk_create([Measurement(measurement_name='plan_{}'.format(num), number=num,
+                                                     end_time=timezone.now()) for num in range(1, 3001)])
+        elements = []
+        for pk in Measurement.objects.values_list('pk', flat=True):
+            for element, count in (('C', 10 + pk % 30), ('H', 1 + pk % 40), ('Cl', pk % 3)):
+                if count:
+                    elements.append(FormulaElement(measurement_id=pk, source=FormulaElement.MEASUREMENT,
+                                                   element=element, count=count))
+        FormulaElement.objects.bulk_create(elements)
+
+    def test_plan(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The plan is only known for SQLite.')
+        query = formula_filter(**parse_formula_query('C -Cl C20-30'))
+        plan = Measurement.objects.filter(query).explain()
+        self.assertNotIn('SCAN scxrd_measurement', plan)
+        self.assertNotIn('CORRELATED', plan)
+        self.assertIn('COVERING INDEX', plan)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            count = Measurement.objects.filter(formula_filter(**parse_formula_query('C20-30 -Cl'))).count()
+        self.assertEqual(len([x for x in range(1, 3001) if 20 <= 10 + x % 30 <= 30 and x % 3 == 0]), count)
+
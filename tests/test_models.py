@@ -1,13 +1,18 @@
+import datetime
 from pathlib import Path
+from unittest import mock
 
 import gemmi
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.utils import timezone
 
 from scxrd.cif.cif_file_io import CifContainer
 from scxrd.models.cif_model import CifFileModel
-from scxrd.models.measurement_model import Measurement
+from scxrd.models.measurement_model import Measurement, running_measurements, unfinished_measurements
 from scxrd.models.models import model_fixtures, Machine, CrystalSupport, CrystalGlue, WorkGroup
 from scxrd.models.sample_model import Sample
 from scxrd.utils import generate_sha256
@@ -229,3 +234,52 @@ class TestOtherTables(DeleteFilesMixin, TestCase):
         glue = CrystalGlue(glue='other ether oil')
         glue.save()
         self.assertEqual(str(glue), 'other ether oil')
+
+
+class TestRunningMeasurements(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        now = timezone.now()
+        hour = datetime.timedelta(hours=1)
+        for number, start, end in ((1, now - 3 * hour, now - hour), (2, now - hour, now + hour),
+                                   (3, now + hour, now + 2 * hour)):
+            Measurement.objects.create(measurement_name='running_{}'.format(number), number=number,
+                                       measure_date=start, end_time=end)
+
+    def test_running(self):
+        self.assertEqual(['running_2'], [str(x) for x in running_measurements()])
+        # From the cache:
+        with self.assertNumQueries(0):
+            self.assertEqual(['running_2'], [str(x) for x in running_measurements()])
+
+    def test_invalidate_on_save(self):
+        running_measurements()
+        exp = Measurement.objects.get(number=3)
+        exp.measure_date = timezone.now() - datetime.timedelta(minutes=1)
+        exp.save()
+        self.assertEqual(['running_2', 'running_3'], sorted(str(x) for x in running_measurements()))
+        Measurement.objects.get(number=2).delete()
+        self.assertEqual(['running_3'], [str(x) for x in running_measurements()])
+
+    def test_end_time_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('The plan is only known for SQLite.')
+        plan = unfinished_measurements(timezone.now()).explain()
+        self.assertNotIn('SCAN scxrd_measurement', plan)
+        self.assertIn('(end_time>?)', plan)
+
+    def test_time_passes(self):
+        running_measurements()
+        later = timezone.now() + datetime.timedelta(hours=1, minutes=30)
+        with mock.patch('scxrd.models.measurement_model.timezone.now', return_value=later):
+            with self.assertNumQueries(0):
+                self.assertEqual(['running_3'], [str(x) for x in running_measurements()])
+
+    @override_settings(RUNNING_MEASUREMENTS_CACHE_TIMEOUT=0)
+    def test_changes_of_other_processes(self):
+        running_measurements()
+        # Written without the signals of this process:
+        Measurement.objects.filter(number=3).update(measure_date=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(['running_2', 'running_3'], sorted(str(x) for x in running_measurements()))
+
@@ -0,0 +1,42 @@
+from itertools import combinations
+
+from django.test import SimpleTestCase
+
+from scxrd.cif.mol_file_writer import MolFile
+from scxrd.cif.tools.atoms import get_radius_from_element
+from scxrd.cif.tools.dsrmath import distance
+from tests.test_sdm import make_sdm
+
+
+def all_pairs_conntable(atoms, extra_param=0.48):
+    """
+    The bonds of all atom pairs without the grid.
+    """
+    bonds = []
+    for (num1, at1), (num2, at2) in combinations(enumerate(atoms, 1), 2):
+        if at1[5] * at2[5] != 0 and at1[5] != at2[5] or at1[0] == at2[0]:
+            continue
+        if at1[1] in ('H', 'D') and at2[1] in ('H', 'D'):
+            continue
+        d = distance(at1[2], at1[3], at1[4], at2[2], at2[3], at2[4])
+        if d <= 4.0 and get_radius_from_element(at1[1]) + get_radius_from_element(at2[1]) + extra_param > d:
+            bonds.append([num1, num2])
+    return bonds
+
+
+class TestMolFile(SimpleTestCase):
+
+    def test_conntable(self):
+        sdm = make_sdm()
+        atoms = sdm.packer(sdm, sdm.calc_sdm())
+        molfile = MolFile(atoms)
+        self.assertEqual(126, molfile.bondscount)
+        self.assertEqual(all_pairs_conntable(atoms), molfile.bonds)
+
+    def test_conntable_grown(self):
+        sdm = make_sdm(scrambled=True)
+        atoms = sdm.packer(sdm, sdm.calc_sdm())
+        self.assertEqual(all_pairs_conntable(atoms), MolFile(atoms).bonds)
+
+    def test_no_atoms(self):
+        self.assertEqual([], MolFile([]).bonds)
@@ -0,0 +1,49 @@
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from scxrd.molecule_cache import get_molfile, set_molfile, invalidate_molfiles, molfile_cache_stats, \
+    MOLFILE_CACHE
+
+
+class TestMolfileCache(SimpleTestCase):
+
+    def setUp(self) -> None:
+        caches[MOLFILE_CACHE].clear()
+
+    def test_get_and_set(self):
+        self.assertIsNone(get_molfile('abc', True))
+        set_molfile('abc', True, 'grown molecule')
+        self.assertEqual('grown molecule', get_molfile('abc', True))
+        self.assertIsNone(get_molfile('abc', False))
+
+    def test_no_empty_entries(self):
+        set_molfile('', True, 'molecule')
+        set_molfile('abc', True, ' ')
+        self.assertIsNone(get_molfile('', True))
+        self.assertIsNone(get_molfile('abc', True))
+
+    @override_settings(MOLFILE_CACHE_MAX_SIZE=10)
+    def test_no_large_entries(self):
+        set_molfile('abc', True, 'x' * 11)
+        set_molfile('abc', False, 'x' * 10)
+        self.assertIsNone(get_molfile('abc', True))
+        self.assertEqual('x' * 10, get_molfile('abc', False))
+
+    def test_invalidate(self):
+        set_molfile('abc', True, 'grown')
+        set_molfile('abc', False, 'not grown')
+        set_molfile('def', False, 'other')
+        invalidate_molfiles('abc')
+        self.assertIsNone(get_molfile('abc', True))
+        self.assertIsNone(get_molfile('abc', False))
+        self.assertEqual('other', get_molfile('def', False))
+
+    def test_stats(self):
+        before = molfile_cache_stats()
+        set_molfile('abc', True, 'grown')
+        get_molfile('abc', True)
+        get_molfile('abc', False)
+        stats = molfile_cache_stats()
+        self.assertEqual(before['hits'] + 1, stats['hits'])
+        self.assertEqual(before['misses'] + 1, stats['misses'])
+        self.assertTrue(0 < stats['hit_ratio'] < 1)
@@ -0,0 +1,91 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.reduced_cell_model import ReducedCell, search_cells
+
+
+def create_measurement(number: int, prelim_unit_cell: str = '') -> Measurement:
+    return Measurement.objects.create(measurement_name='cell_{}'.format(number), number=number,
+                                      end_time=timezone.now(), prelim_unit_cell=prelim_unit_cell)
+
+
+class TestReducedCell(TestCase):
+
+    def test_prelim_cell(self):
+        exp = create_measurement(1, '10.5086 20.9035 20.5072 90 94.13 90')
+        cell = ReducedCell.objects.get(measurement=exp)
+        self.assertEqual(ReducedCell.PRELIM, cell.source)
+        self.assertEqual('10.509 20.507 20.904 90.00 90.00 94.13', str(cell))
+        exp.prelim_unit_cell = 'foo'
+        exp.save()
+        self.assertEqual(0, ReducedCell.objects.count())
+
+    def test_impossible_cell(self):
+        exp = create_measurement(1, '10 10 10 170 170 170')
+        self.assertEqual(0, ReducedCell.objects.count())
+        exp.prelim_unit_cell = '10 10 10 90 90 90'
+        exp.save()
+        self.assertEqual(1, ReducedCell.objects.count())
+        ReducedCell.update_for(exp.pk, ReducedCell.PRELIM, [10, 10, 10, 170, 170, 170])
+        self.assertEqual(0, ReducedCell.objects.count())
+        CifFileModel.objects.create(measurement=exp, cell_length_a=10, cell_length_b=10, cell_length_c=10,
+                                    cell_angle_alpha=130, cell_angle_beta=130, cell_angle_gamma=130)
+        self.assertEqual(0, ReducedCell.objects.count())
+        self.assertEqual(0, search_cells([10, 10, 10, 170, 170, 170]).count())
+
+    def test_cif_cell(self):
+        exp = create_measurement(1)
+        cif_model = CifFileModel(measurement=exp, cell_length_a=10, cell_length_b=10, cell_length_c=10,
+                                 cell_angle_alpha=90, cell_angle_beta=90, cell_angle_gamma=90,
+                                 space_group_name_H_M_alt='F m -3 m')
+        cif_model.save()
+        cell = ReducedCell.objects.get(measurement=exp, source=ReducedCell.CIF)
+        self.assertAlmostEqual(7.0711, cell.a, 4)
+        self.assertAlmostEqual(60.0, cell.alpha, 4)
+        cif_model.delete()
+        self.assertEqual(0, ReducedCell.objects.count())
+
+    def test_search(self):
+        create_measurement(1, '10.5086 20.9035 20.5072 90 94.13 90')
+        # The same cell in another setting:
+        create_measurement(2, '20.5072 20.9035 10.5086 90 94.13 90')
+        create_measurement(3, '10.6 20.95 20.45 90 94.5 90')
+        create_measurement(4, '11.5 20.9 20.5 90 94.1 90')
+        create_measurement(5, '10.5 20.9 20.5 90 97.0 90')
+        found = search_cells([10.51, 20.90, 20.51, 90, 94.1, 90])
+        self.assertEqual(['cell_1', 'cell_2', 'cell_3'], sorted(x.measurement.measurement_name for x in found))
+        self.assertEqual(2, search_cells([10.51, 20.90, 20.51, 90, 94.1, 90], length_percent=0.1).count())
+
+    def test_search_centred(self):
+        create_measurement(1, '7.0711 7.0711 7.0711 60 60 60')
+        self.assertEqual(1, search_cells([10, 10, 10, 90, 90, 90], centring='F').count())
+        self.assertEqual(0, search_cells([10, 10, 10, 90, 90, 90]).count())
+
+
+class TestCellSearchView(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='operator', password='Test1234!')
+        create_measurement(1, '10.5086 20.9035 20.5072 90 94.13 90')
+
+    def test_search_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('scxrd:cell_search'), data={'cell': '10.5 20.9 20.5 90 94 90'})
+        self.assertEqual(200, response.status_code)
+        results = response.json()['results']
+        self.assertEqual(1, len(results))
+        self.assertEqual('cell_1', results[0]['measurement'])
+        self.assertEqual(ReducedCell.PRELIM, results[0]['source'])
+
+    def test_bad_cell(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('scxrd:cell_search'), data={'cell': '10.5 20.9'})
+        self.assertEqual(400, response.status_code)
+
+    def test_login_required(self):
+        response = self.client.get(reverse('scxrd:cell_search'), data={'cell': '10.5 20.9 20.5 90 94 90'})
+        self.assertEqual(302, response.status_code)
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+from django.test import SimpleTestCase
+
+from scxrd.cif.cif_file_io import CifContainer
+from scxrd.cif.mol_file_writer import MolFile
+from scxrd.cif.sdm import SDM, AtomHash, SDMItem
+from tests.benchmarks import make_polymer_structure
+
+
+def make_sdm(scrambled=False, backend='auto') -> SDM:
+    """
+    Returns an SDM object of the p21c test structure. With scrambled=True, some atoms are moved to
+    symmetry equivalent positions, so that the molecule has to be grown again.
+    """
+    cif = CifContainer(Path('scxrd/testfiles/p21c.cif'))
+    atoms = list(cif.atoms_fract)
+    if scrambled:
+        for num, at in enumerate(atoms):
+            if num % 3 == 1:
+                at[2], at[3], at[4] = -at[2], -at[3], -at[4]
+            elif num % 3 == 2:
+                at[2] += 1
+    return SDM(atoms, cif.symmops, cif.cell[:6], centric=cif.is_centrosymm, backend=backend)
+
+
+def sdm_items(sdm: SDM) -> list:
+    return [(x.a1, x.a2, x.dist, x.symmetry_number, x.covalent, x.dddd) for x in sdm.sdm_list]
+
+
+class TestSDM(SimpleTestCase):
+
+    def test_numpy_same_as_python(self):
+        for scrambled in (False, True):
+            sdm_py = make_sdm(scrambled)
+            sdm_py._calc_sdm_python()
+            sdm_np = make_sdm(scrambled)
+            sdm_np._calc_sdm_numpy(max_block_size=5000)
+            self.assertEqual(sdm_items(sdm_py), sdm_items(sdm_np))
+
+    def test_grid_same_as_python(self):
+        for scrambled in (False, True):
+            sdm_py = make_sdm(scrambled)
+            sdm_py._calc_sdm_python()
+            sdm_grid = make_sdm(scrambled)
+            sdm_grid._calc_sdm_grid()
+            self.assertEqual(sdm_items(sdm_py), sdm_items(sdm_grid))
+
+    def test_backends(self):
+        self.assertEqual('grid', make_sdm().used_backend)
+        self.assertEqual('numpy', make_sdm(backend='numpy').used_backend)
+        with self.assertRaises(ValueError):
+            make_sdm(backend='foo')
+
+    def test_molindex(self):
+        atoms, symmops, cell = make_polymer_structure(chain_length=40, chains=3)
+        sdm = SDM(atoms, symmops, cell)
+        sdm.calc_sdm()
+        self.assertEqual(3, sdm.maxmol)
+        self.assertEqual(1, sdm.atoms[0][-1])
+        # The fragments are numbered in the order of their first atom:
+        first_atoms = [[at[-1] for at in sdm.atoms].index(num) for num in (1, 2, 3)]
+        self.assertEqual(sorted(first_atoms), first_atoms)
+        for at in sdm.atoms:
+            self.assertEqual(at[0].split('_')[1], sdm.atoms[first_atoms[at[-1] - 1]][0].split('_')[1])
+
+    def test_need_symm(self):
+        sdm = make_sdm()
+        self.assertEqual([], sdm.calc_sdm())
+        self.assertEqual(128, len(sdm.packer(sdm, [])))
+        sdm = make_sdm(scrambled=True)
+        need_symm = sdm.calc_sdm()
+        self.assertEqual(12, len(need_symm))
+        self.assertEqual([2, 5, 5, 5, 4], need_symm[0])
+        self.assertEqual(636, len(sdm.packer(sdm, need_symm)))
+
+    def test_atom_hash(self):
+        sdm = make_sdm()
+        atomhash = AtomHash(sdm, 0.2)
+        atomhash.add(['C1', 'C', 0.5, 0.5, 0.5, 0])
+        self.assertTrue(atomhash.is_there(['C1', 'C', 0.501, 0.5, 0.5, 0]))
+        self.assertFalse(atomhash.is_there(['C1', 'C', 0.501, 0.5, 0.5, 1]))
+        self.assertFalse(atomhash.is_there(['C1', 'C', 0.52, 0.5, 0.5, 0]))
+        self.assertFalse(atomhash.is_there(['C1', 'C', 1.5, 0.5, 0.5, 0]))
+
+    def test_packer_bonds(self):
+        for scrambled in (False, True):
+            sdm = make_sdm(scrambled)
+            atoms = sdm.packer(sdm, sdm.calc_sdm())
+            self.assertEqual(MolFile(atoms).bonds, sdm.bondlist)
+        self.assertEqual(512, len(sdm.bondlist))
+
+    def test_no_bonds_to_own_image(self):
+        sdm = make_sdm()
+        sdm.calc_sdm()
+        item = SDMItem()
+        item.a1, item.a2, item.dddd = 0, 0, 100.0
+        sdm.sdm_list = [item]
+        atoms = [['C1', 6, 0.1, 0.1, 0.1], ['C1', 6, 0.2, 0.1, 0.1]]
+        self.assertEqual([], sdm.packed_bonds(atoms, [0, 0]))
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.models.sample_model import Sample
+from scxrd.search_index import search_filter, create_search_index, search_backend
+
+
+def names(text: str) -> list:
+    return sorted(Measurement.objects.filter(search_filter(text)).values_list('measurement_name', flat=True))
+
+
+class TestSearchIndex(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='susi', first_name='Susanne', last_name='Sonnenschein')
+        self.sample = Sample.objects.create(sample_name='sample1', stable=False, solve_refine_selve=False,
+                                            special_remarks='Keep it cold please')
+        self.exp1 = Measurement.objects.create(measurement_name='IK_MSJg20_100K', number=1, end_time=timezone.now(),
+                                               sum_formula='C12 H10 Pd', operator=self.user)
+        self.exp2 = Measurement.objects.create(measurement_name='DK_ML7', number=2, end_time=timezone.now(),
+                                               sample=self.sample)
+
+    def test_backend(self):
+        self.assertEqual('sqlite', search_backend())
+
+    def test_search_fields(self):
+        self.assertEqual(['IK_MSJg20_100K'], names('msjg'))
+        self.assertEqual(['IK_MSJg20_100K'], names('IK_MSJ'))
+        self.assertEqual(['IK_MSJg20_100K'], names('Pd C12'))
+        self.assertEqual(['IK_MSJg20_100K'], names('sonnen'))
+        self.assertEqual(['DK_ML7'], names('cold'))
+        self.assertEqual([], names('Pd cold'))
+        # Words are found by their beginning only:
+        self.assertEqual(['IK_MSJg20_100K'], names('100k'))
+        self.assertEqual([], names('20_100K'))
+        # The FTS5 query syntax is no problem:
+        self.assertEqual([], names('" OR NEAR( *'))
+
+    def test_related_changes(self):
+        CifFileModel.objects.create(measurement=self.exp2, ccdc_number='1234567', space_group_name_H_M_alt='P 21/c')
+        self.assertEqual(['DK_ML7'], names('1234567'))
+        self.user.last_name = 'Regen'
+        self.user.save()
+        self.assertEqual([], names('sonnen'))
+        self.assertEqual(['IK_MSJg20_100K'], names('regen'))
+        self.sample.special_remarks = ''
+        self.sample.save()
+        self.assertEqual([], names('cold'))
+        self.exp1.delete()
+        self.assertEqual([], names('regen'))
+
+    def test_rebuild(self):
+        Measurement.objects.filter(pk=self.exp2.pk).update(measurement_name='renamed')
+        self.assertEqual([], names('renamed'))
+        create_search_index()
+        self.assertEqual(['renamed'], names('renamed'))
+
+    def test_measurement_list(self):
+        self.client.force_login(self.user)
+        for url in ('scxrd:measurements_list', 'scxrd:measurements_list_from_user'):
+            response = self.client.post(reverse(url), data={'search[value]': 'pd'})
+            self.assertEqual(['IK_MSJg20_100K'], [x[2] for x in response.json()['data']])
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from scxrd.models.cif_model import CifFileModel
+from scxrd.models.measurement_model import Measurement
+from scxrd.tasks import precompute_molfiles
+from scxrd.utils import generate_sha256
+from tests.tests import MEDIA_ROOT, DeleteFilesMixin
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestPrecomputeMolfiles(DeleteFilesMixin, TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cif_file = SimpleUploadedFile('p21c.cif', Path('scxrd/testfiles/p21c.cif').read_bytes())
+        exp = Measurement.objects.create(measurement_name='test_measurement', number=1, end_time=timezone.now())
+        self.cif_model = CifFileModel(measurement=exp, cif_file_on_disk=cif_file,
+                                      sha256=generate_sha256(cif_file))
+        self.cif_model.save()
+
+    def test_precompute(self):
+        precompute_molfiles(self.cif_model.pk, self.cif_model.sha256)
+        self.cif_model.refresh_from_db()
+        self.assertTrue(self.cif_model.molfile.startswith('\n\n\n  128  126\n'))
+        self.assertTrue(self.cif_model.molfile_grown.startswith('\n\n\n  128  126\n'))
+
+    def test_replaced_cif_is_not_overwritten(self):
+        precompute_molfiles(self.cif_model.pk, 'an older checksum')
+        self.cif_model.refresh_from_db()
+        self.assertEqual('', self.cif_model.molfile)
+        self.assertEqual('', self.cif_model.molfile_grown)
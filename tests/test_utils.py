@@ -0,0 +1,38 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import SimpleTestCase
+
+from scxrd.utils import HashingFile, generate_sha256
+
+
+class TestHashingFile(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.tempdir = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.tempdir)
+        self.content = Path('scxrd/testfiles/p21c.cif').read_bytes()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_hash_while_saving(self):
+        upload = SimpleUploadedFile('p21c.cif', self.content)
+        hashing_file = HashingFile(upload)
+        name = self.storage.save(hashing_file.name, hashing_file)
+        self.assertEqual(self.content, Path(self.storage.path(name)).read_bytes())
+        self.assertEqual(generate_sha256(SimpleUploadedFile('p21c.cif', self.content)), hashing_file.hexdigest())
+        self.assertEqual(len(self.content), hashing_file.size)
+
+    def test_temporary_upload(self):
+        # Large uploads are temporary files on disk. They have to be hashed as well instead of just moved:
+        upload = TemporaryUploadedFile('p21c.cif', 'text/plain', len(self.content), 'utf-8')
+        upload.write(self.content)
+        hashing_file = HashingFile(upload)
+        name = self.storage.save(hashing_file.name, hashing_file)
+        upload.close()
+        self.assertEqual(self.content, Path(self.storage.path(name)).read_bytes())
+        self.assertEqual(generate_sha256(SimpleUploadedFile('p21c.cif', self.content)), hashing_file.hexdigest())
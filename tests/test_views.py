@@ -1,10 +1,13 @@
 import datetime
 from pathlib import Path
+from unittest import mock
 
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import connection
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 
@@ -12,9 +15,11 @@ from scxrd.cif.cif_file_io import CifContainer
 from scxrd.forms.edit_measurement import MeasurementEditForm
 from scxrd.models.cif_model import CifFileModel
 from scxrd.models.measurement_model import Measurement
-from scxrd.models.models import WorkGroup, CrystalSupport, Machine
-from scxrd.models.sample_model import Sample
+from scxrd.models.models import WorkGroup, CrystalSupport, Machine, CheckCifModel
+from scxrd.models.sample_model import Sample, samples_with_status
 from scxrd.utils import generate_sha256
+from scxrd.views.measurement_views import MeasurementListJson
+from scxrd.templatetags.myfilters import was_measured, was_deposited
 from scxrd.views.sample_views import NewSampleByCustomer
 from tests.tests import MEDIA_ROOT, DeleteFilesMixin, OperatorUserMixin, PlainUserMixin, create_measurement
 
@@ -373,3 +378,218 @@ class TestMeasurementListJsonView(DeleteFilesMixin, OperatorUserMixin, TestCase)
                           b'"", '
                           b'"<a class=\\"btn-outline-danger m-0 p-1\\" href=\\"/scxrd/measurements/edit/1/\\">Edit</a>"]], '
                           b'"result": "ok"}'))
+
+
+class TestResidualsTable(TestCase):
+    def setUp(self) -> None:
+        self.exp = Measurement.objects.create(measurement_name='residuals', number=1, end_time=timezone.now())
+        cif_model = CifFileModel(measurement=self.exp, cif_file_on_disk='cifs/not_on_disk.cif')
+        cif_model.fill_residuals_table(CifContainer(Path('scxrd/testfiles/p21c.cif'), metadata_only=True))
+        cif_model.save()
+        CheckCifModel.objects.create(measurement=self.exp, checkcif_on_disk='checkcif_reports/not_on_disk.pdf')
+
+    def test_temperature_from_cif(self):
+        self.assertEqual('100(2)', CifFileModel.objects.get(measurement=self.exp).diffrn_ambient_temperature)
+
+    def test_only_database(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('scxrd:details_table', args=(self.exp.pk,)))
+        self.assertContains(response, '100(2)&nbsp;K')
+        self.assertContains(response, 'P 1 21/c 1')
+        # The files are not on the disk, the names are from the database:
+        self.assertContains(response, 'not_on_disk.cif</a>')
+        self.assertContains(response, 'not_on_disk.pdf</a>')
+
+
+class TestMeasurementListPaging(TestCase):
+    def setUp(self) -> None:
+        self.client.force_login(User.objects.create_user(username='pager', password='Test1234!'))
+        machine = Machine.objects.create(diffrn_measurement_device_type='APEXII')
+        for num in range(1, 31):
+            exp = Measurement.objects.create(measurement_name='page_{:02d}'.format(31 - num), number=num,
+                                             end_time=timezone.now(), machine=machine)
+            if num % 3 == 0:
+                CifFileModel.objects.create(measurement=exp, cif_file_on_disk='cifs/page_{}.cif'.format(num))
+        # As if the files were on the disk:
+        CifFileModel.objects.exclude(cif_file_name='page_30.cif').update(file_exists=True)
+
+    def get_rows(self, start: int, length: int, column: int = 1, direction: str = 'desc') -> list:
+        response = self.client.post(reverse('scxrd:measurements_list'),
+                                    data={'start': start, 'length': length, 'order[0][column]': column,
+                                          'order[0][dir]': direction})
+        return response.json()['data']
+
+    def test_cached_cif_name(self):
+        rows = self.get_rows(0, 3)
+        self.assertEqual(['30', '29', '28'], [x[1] for x in rows])
+        self.assertEqual(['', '', ''], [x[7] for x in rows])
+        self.assertEqual('page_27.cif', self.get_rows(3, 1)[0][7])
+        self.assertEqual('APEXII', rows[0][4])
+
+    def test_seek_same_as_offset(self):
+        for column in (1, 2):
+            for direction in ('asc', 'desc'):
+                offset_rows = self.get_rows(10, 7, column, direction)
+                with mock.patch.object(MeasurementListJson, 'seek_offset', 5):
+                    self.assertEqual(offset_rows, self.get_rows(10, 7, column, direction))
+        self.assertEqual(['10', '9'], [x[1] for x in self.get_rows(20, 2)])
+        # All measurements have the same machine, so they are sorted by number afterwards:
+        self.assertEqual(['30', '29'], [x[1] for x in self.get_rows(0, 2, column=4, direction='asc')])
+
+    def test_queries_independent_of_rows(self):
+        with CaptureQueriesContext(connection) as few_rows:
+            self.get_rows(0, 2)
+        with CaptureQueriesContext(connection) as many_rows:
+            self.get_rows(0, 30)
+        self.assertEqual(len(few_rows), len(many_rows))
+
+    def test_max_display_length(self):
+        with mock.patch.object(MeasurementListJson, 'max_display_length', 4):
+            self.assertEqual(4, len(self.get_rows(0, -1)))
+
+
+class TestSampleListQueries(OperatorUserMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.add_samples(0, 2)
+
+    def add_samples(self, start: int, count: int) -> None:
+        for num in range(start, start + count):
+            sample = Sample.objects.create(sample_name='sample_{}'.format(num), customer_samp=self.user,
+                                           stable=False, solve_refine_selve=False)
+            exp = Measurement.objects.create(measurement_name='sample_{}'.format(num), number=num + 1,
+                                             sample=sample, was_measured=num % 2 == 0,
+                                             end_time=timezone.now())
+            cif = CifFileModel.objects.create(measurement=exp, cif_file_on_disk='cifs/sample_{}.cif'.format(num),
+                                              ccdc_number=str(1000 + num))
+            CifFileModel.objects.filter(pk=cif.pk).update(file_exists=num % 2 == 0)
+
+    def test_status_annotations(self):
+        samples = {x.sample_name: x for x in samples_with_status()}
+        self.assertTrue(samples['sample_0'].any_measured)
+        self.assertTrue(samples['sample_0'].has_cif_file)
+        self.assertFalse(samples['sample_1'].any_measured)
+        self.assertFalse(samples['sample_1'].has_cif_file)
+        with self.assertNumQueries(0):
+            self.assertTrue(was_measured(samples['sample_0'].measurements))
+            self.assertFalse(was_deposited(samples['sample_1'].measurements))
+            self.assertFalse(samples['sample_1'].was_measured())
+
+    def test_filters_without_annotations(self):
+        sample = Sample.objects.get(sample_name='sample_0')
+        self.assertTrue(was_measured(sample.measurements))
+        self.assertTrue(was_deposited(sample.measurements))
+        self.assertFalse(was_measured(Sample.objects.get(sample_name='sample_1').measurements))
+
+    def test_queries_independent_of_samples(self):
+        for url in (reverse('scxrd:op_samples_page'), reverse('scxrd:my_samples_page')):
+            with CaptureQueriesContext(connection) as few_samples:
+                response = self.client.get(url)
+            self.assertContains(response, 'sample_1')
+            self.add_samples(len(Sample.objects.all()), 10)
+            with CaptureQueriesContext(connection) as many_samples:
+                response = self.client.get(url)
+            self.assertContains(response, 'sample_11')
+            self.assertEqual(len(few_samples), len(many_samples))
+
+
+class TestOperatorSampleQueue(OperatorUserMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.group = self.user.profile.work_group
+        for num in range(1, 7):
+            Sample.objects.create(sample_name='queue_{}'.format(num), customer_samp=self.user, stable=False,
+                                  solve_refine_selve=False, submit_date=datetime.date(2020, 1, num))
+        Sample.objects.create(sample_name='no_customer', stable=False, solve_refine_selve=False,
+                              submit_date=datetime.date(2019, 1, 1))
+
+    def measure(self, sample_name: str, cif: bool = False) -> Measurement:
+        exp = Measurement.objects.create(measurement_name=sample_name, number=Measurement.objects.count() + 1,
+                                         sample=Sample.objects.get(sample_name=sample_name), was_measured=True,
+                                         end_time=timezone.now())
+        if cif:
+            CifFileModel.objects.create(measurement=exp, cif_file_on_disk='cifs/{}.cif'.format(sample_name))
+            CifFileModel.objects.filter(measurement=exp).update(file_exists=True)
+            exp.save()
+        return exp
+
+    def get_names(self, **params) -> list:
+        response = self.client.get(reverse('scxrd:op_samples_page'), data=params)
+        return [x.sample_name for x in response.context_data['sample_list']]
+
+    def get_rows(self, **params) -> dict:
+        data = {'start': 0, 'length': 10, 'order[0][column]': 2, 'order[0][dir]': 'asc'}
+        data.update(params)
+        return self.client.post(reverse('scxrd:op_samples_list'), data=data).json()
+
+    def test_status(self):
+        self.assertEqual(Sample.OPEN, Sample.objects.get(sample_name='queue_1').status)
+        exp = self.measure('queue_1')
+        self.assertEqual(Sample.MEASURED, Sample.objects.get(sample_name='queue_1').status)
+        self.measure('queue_2', cif=True)
+        self.assertEqual(Sample.REFINED, Sample.objects.get(sample_name='queue_2').status)
+        exp.delete()
+        self.assertEqual(Sample.OPEN, Sample.objects.get(sample_name='queue_1').status)
+
+    def test_filters(self):
+        self.measure('queue_1')
+        self.measure('queue_2', cif=True)
+        self.assertEqual(['no_customer', 'queue_6', 'queue_5', 'queue_4', 'queue_3'], self.get_names(status='open'))
+        self.assertEqual(['queue_2'], self.get_names(status='refined'))
+        self.assertEqual(['queue_4', 'queue_3', 'queue_2'],
+                         self.get_names(work_group=self.group.pk, submitted_from='2020-01-02',
+                                        submitted_to='2020-01-04'))
+        # Invalid filters are ignored:
+        self.assertEqual(7, len(self.get_names(status='foo', submitted_to='2020-02-31')))
+
+    def test_queries_independent_of_rows(self):
+        with mock.patch('scxrd.views.sample_views.OperatorSamplesList.paginate_by', 2):
+            with CaptureQueriesContext(connection) as few_rows:
+                self.get_names()
+        with CaptureQueriesContext(connection) as many_rows:
+            self.get_names()
+        self.assertEqual(len(few_rows), len(many_rows))
+
+    def test_json_filters(self):
+        self.measure('queue_1')
+        self.measure('queue_2', cif=True)
+        result = self.get_rows(status='open')
+        self.assertEqual(5, result['recordsFiltered'])
+        self.assertEqual(7, result['recordsTotal'])
+        self.assertEqual('no_customer', result['data'][0][1])
+        self.assertEqual(['queue_2'], [x[1] for x in self.get_rows(status='refined')['data']])
+        rows = self.get_rows(work_group=self.group.pk, submitted_from='2020-01-02', submitted_to='2020-01-04')['data']
+        self.assertEqual(['queue_2', 'queue_3', 'queue_4'], [x[1] for x in rows])
+        self.assertEqual('02.01.2020', rows[0][2])
+        self.assertEqual('Sandra Sorglos', rows[0][3])
+        self.assertEqual('AK Krabäppel', rows[0][4])
+        self.assertIn('badge-success', rows[0][5])
+        self.assertIn('btn-outline-success', rows[0][7])
+        self.assertIn('"btn btn-sm btn-success', rows[1][7])
+        # Invalid filters are ignored:
+        self.assertEqual(7, self.get_rows(status='foo', submitted_to='2020-02-31')['recordsFiltered'])
+
+    def test_json_paging(self):
+        # Ordered by status, where all samples are equal, so the id decides:
+        pages = [self.get_rows(start=start, length=3, **{'order[0][column]': 5})['data'] for start in (0, 3, 6)]
+        self.assertEqual([3, 3, 1], [len(x) for x in pages])
+        names = [row[1] for page in pages for row in page]
+        self.assertEqual(list(Sample.objects.order_by('-id').values_list('sample_name', flat=True)), names)
+
+    def test_json_queries_independent_of_rows(self):
+        self.measure('queue_1')
+        self.measure('queue_2', cif=True)
+        with CaptureQueriesContext(connection) as few_rows:
+            self.get_rows(length=2)
+        with CaptureQueriesContext(connection) as many_rows:
+            self.get_rows(length=7)
+        self.assertEqual(len(few_rows), len(many_rows))
+
+    def test_operator_page(self):
+        with mock.patch('scxrd.views.sample_views.OperatorSamplesList.paginate_by', 4):
+            response = self.client.get(reverse('scxrd:op_samples_page'), data={'status': 'open', 'page': 2})
+        self.assertEqual(3, len(response.context_data['sample_list']))
+        self.assertContains(response, '?page=1&status=open')
+        response = self.client.get(reverse('scxrd:op_samples_detail', kwargs={'pk': Sample.objects.first().pk}))
+        self.assertEqual(Sample.objects.first(), response.context_data['sample'])
+